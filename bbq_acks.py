@@ -0,0 +1,109 @@
+"""
+    Batched (delayed) acknowledgements for the BBQ consumers.
+
+    The consumers used to call basic_ack once per message, one broker round
+    trip per reading. AckBatcher remembers the delivery tag of the last message
+    that was fully processed and acks everything up to it with a single
+    basic_ack(multiple=True):
+        * every `batch_size` processed messages, or
+        * `max_delay` seconds after the first message that is still unacked,
+          so a quiet queue does not hold acks forever
+    Messages are processed one at a time in delivery order, so acking up to
+    the last processed tag never acks a message that has not been processed.
+
+    A batch can never be bigger than the prefetch count: once prefetch_count
+    messages are unacked the broker stops delivering, and the batch would
+    only be acked by the max_delay timer. Pass prefetch_count and a larger
+    batch_size is cut down to it, with a warning.
+
+    On errors and on shutdown call flush() before the channel closes. The
+    messages that were processed get acked, anything not yet processed stays
+    unacked and RabbitMQ delivers it again.
+
+    on_flush runs just before every ack, which is where the consumers
+    checkpoint their windows (see bbq_checkpoint.py): a message is only
+    acked once a checkpoint holds its readings. The checkpoint cadence is
+    therefore the ack cadence, which is why the consumers take batch_size
+    and max_delay from checkpoint_every and checkpoint_interval.
+
+"""
+
+
+class AckBatcher:
+    """
+    Ack processed messages in batches with basic_ack(multiple=True).
+
+    Parameters:
+        channel: the channel the messages were delivered on
+        batch_size (int): ack after this many processed messages (1 = ack every message)
+        max_delay (float): ack at most this many seconds after the oldest unacked message
+        call_later: function(delay, callback) that schedules a timer on the
+                    connection's I/O loop, e.g. BlockingConnection.call_later
+        on_flush: function() called before each basic_ack, when everything
+                  processed so far is about to be acked (e.g. Checkpointer.save)
+        prefetch_count (int): the channel's prefetch count, batch_size is capped at it
+    """
+
+    def __init__(self, channel, batch_size: int = 1, max_delay: float = 0.1, call_later=None, on_flush=None,
+                 prefetch_count: int = None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if prefetch_count is not None and batch_size > prefetch_count > 0:
+            print(f" [!] ack batch size {batch_size} is larger than the prefetch count "
+                  f"{prefetch_count}, acking every {prefetch_count} messages instead")
+            batch_size = prefetch_count
+        self.channel = channel
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.call_later = call_later
+        self.on_flush = on_flush
+        # delivery tag of the last processed message and how many are unacked
+        self.last_tag = None
+        self.pending = 0
+        self.timer_scheduled = False
+        # number of basic_ack calls made, handy for benchmarks
+        self.acks_sent = 0
+
+    def done(self, delivery_tag: int):
+        """Record that the message with this delivery tag has been processed."""
+        self.last_tag = delivery_tag
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+        elif not self.timer_scheduled and self.call_later is not None:
+            self.timer_scheduled = True
+            self.call_later(self.max_delay, self.on_timer)
+
+    def done_through(self, delivery_tag: int, count: int):
+        """
+        Record that `count` messages up to and including this delivery tag
+        have been processed and ack them now, e.g. after a catch-up batch.
+        """
+        self.last_tag = delivery_tag
+        self.pending += count
+        self.flush()
+
+    def on_timer(self):
+        self.timer_scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Ack every processed message that has not been acked yet."""
+        if self.pending == 0:
+            return
+        if self.on_flush is not None:
+            self.on_flush()
+        if self.pending == 1:
+            self.channel.basic_ack(delivery_tag=self.last_tag)
+        else:
+            self.channel.basic_ack(delivery_tag=self.last_tag, multiple=True)
+        self.pending = 0
+        self.acks_sent += 1
+
+    def discard(self):
+        """
+        Forget the unacked messages without acking them, e.g. after the
+        channel has closed, they will be delivered again.
+        """
+        self.pending = 0
+        self.last_tag = None
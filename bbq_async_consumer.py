@@ -0,0 +1,315 @@
+"""
+    This program listens for messages on any number of sensor queues at once.
+
+    Instead of running bbq_smoker_consumer.py, bbq_food_a_consumer.py and
+    food_b_consumer.py as three processes with three connections, this one
+    process opens a single asyncio-based connection to RabbitMQ and subscribes
+    to every queue it is given. Each queue gets its own StreamMonitor (window
+    state and alert rules, see bbq_streams.py), so one process can follow
+    dozens of smokers and probes.
+
+    The bbq_producer.py must run to start sending the messages first
+
+    Usage:
+        python bbq_async_consumer.py [queue ...]
+    With no queues it watches 01-smoker, 02-food-A and 02-food-B.
+
+"""
+
+import asyncio
+import functools
+import signal
+import sys
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from bbq_acks import AckBatcher
+from bbq_catchup import make_catchup
+from bbq_checkpoint import Checkpointer, checkpoint_every, checkpoint_interval, checkpoint_path
+from bbq_dedup import DuplicateFilter
+from bbq_eta import Estimate
+from bbq_history import make_history
+from bbq_join import StreamJoin
+from bbq_metrics import ConsumerMetrics
+from bbq_output import make_output, received_line
+from bbq_profile import SamplingProfiler, StageTimers, install_signal_handlers
+from bbq_readings import decode_readings
+from bbq_streams import make_monitor
+
+# Define the variables
+host = "localhost"
+default_queues = ["01-smoker", "02-food-A", "02-food-B"]
+# readings may arrive up to this many seconds out of order
+allowed_lateness = 0
+# prefetch_count = Per consumer limit of unaknowledged messages,
+# keep it at least ack_batch_size or the batches (and checkpoints) get smaller
+prefetch_count = checkpoint_every
+# ack every ack_batch_size messages with one basic_ack(multiple=True),
+# or ack_max_delay seconds after the oldest unacked message (1 = ack every message)
+# each ack waits for a checkpoint, so both follow the checkpoint cadence
+ack_batch_size = checkpoint_every
+ack_max_delay = checkpoint_interval
+# the windows of every queue are saved here just before messages are acked and restored on startup
+checkpoint_name = "async-consumer"
+# set to serve the latency metrics as JSON on http://localhost:<metrics_port>/metrics
+metrics_port = None
+# True starts with the per-stage callback timers on, they and the sampling
+# profiler can be toggled with kill -USR2 / kill -USR1 <pid> (see bbq_profile.py)
+profile_stages = False
+# line the queues up on event time and raise composite alerts across them,
+# e.g. a smoker drop and a food stall within 10 minutes (see bbq_join.py)
+composite_alerts = True
+
+
+class AsyncConsumer:
+    """Consume many queues over one connection, one StreamMonitor per queue."""
+
+    def __init__(self, host: str, queues: list, prefetch_count: int = checkpoint_every,
+                 ack_batch_size: int = checkpoint_every, ack_max_delay: float = checkpoint_interval):
+        self.host = host
+        self.queues = list(queues)
+        self.prefetch_count = prefetch_count
+        self.ack_batch_size = ack_batch_size
+        self.ack_max_delay = ack_max_delay
+        self.ack_batcher = None
+        self.monitors = {queue: make_monitor(queue, allowed_lateness) for queue in self.queues}
+        # drop readings delivered more than once (see bbq_dedup.py), saved with the windows
+        self.duplicates = DuplicateFilter()
+        self.checkpointer = Checkpointer(checkpoint_path(checkpoint_name), self.monitors, self.duplicates)
+        # end-to-end latency, gaps and duplicates of every queue (see bbq_metrics.py)
+        self.metrics = ConsumerMetrics("async-consumer")
+        self.stages = StageTimers(profile_stages)
+        # readings and alerts are written by a background thread (see bbq_output.py)
+        self.output = make_output(host)
+        self.profiler = SamplingProfiler()
+        self.join = StreamJoin(self.queues) if composite_alerts else None
+        # every reading in columnar segment files, if history_dir is set (see bbq_history.py)
+        self.history = make_history()
+        # skip the per-message logs and add the readings in batches while behind (see bbq_catchup.py)
+        # the lag comes from the producer's x-sent-at header, the queue depth is not polled
+        self.catchup = make_catchup(self.output, self.metrics, self.checkpointer.covered, self.prefetch_count,
+                                    self.join_batch if self.join is not None else None,
+                                    self.duplicates.seen, self.history)
+        self.connection = None
+        self.channel = None
+        self.closing = False
+        self.error = None
+        # resolved when the connection has closed
+        self.closed = None
+
+    async def run(self):
+        """Connect, consume until stop() is called, then return."""
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        # restore the windows saved by the last run
+        if self.checkpointer.restore():
+            print(f" [*] Restored the windows from {self.checkpointer.path}")
+        self.connection = AsyncioConnection(
+            pika.ConnectionParameters(host=self.host),
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_open_error,
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=loop,
+        )
+        await self.closed
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Close the channel and connection, any unacked messages are redelivered."""
+        if self.closing:
+            return
+        self.closing = True
+        if self.connection is not None and self.connection.is_open:
+            # acknowledge every message that was processed before closing
+            if self.ack_batcher is not None and self.channel.is_open:
+                self.catchup.flush()
+                self.ack_batcher.flush()
+                self.checkpointer.save()
+            self.connection.close()
+
+    # connection and channel set-up
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_open_error(self, connection, error):
+        if isinstance(error, pika.exceptions.AMQPError):
+            self.error = error
+        else:
+            self.error = pika.exceptions.AMQPConnectionError(error)
+        self.set_closed()
+
+    def on_connection_closed(self, connection, reason):
+        if not self.closing:
+            self.error = pika.exceptions.AMQPConnectionError(reason)
+        self.set_closed()
+
+    def set_closed(self):
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        # every queue shares this channel, so one batcher acks them all
+        self.ack_batcher = AckBatcher(
+            channel, self.ack_batch_size, self.ack_max_delay, self.connection.ioloop.call_later,
+            self.checkpointer.save, prefetch_count=self.prefetch_count,
+        )
+        self.catchup.attach(self.ack_batcher, self.connection.ioloop.call_later)
+        # prefetch_count = Per consumer limit of unaknowledged messages
+        channel.basic_qos(prefetch_count=self.prefetch_count, callback=self.on_qos_ok)
+
+    def on_channel_closed(self, channel, reason):
+        # acks can no longer be sent, unacked messages will be delivered again
+        if self.ack_batcher is not None:
+            self.ack_batcher.discard()
+        if not self.closing:
+            self.error = pika.exceptions.AMQPChannelError(reason)
+            self.stop()
+
+    def on_qos_ok(self, _frame):
+        # use the channel to declare a durable queue for every stream
+        # and start consuming it once it exists
+        for queue in self.queues:
+            self.channel.queue_declare(
+                queue=queue,
+                durable=True,
+                callback=functools.partial(self.on_queue_declared, queue),
+            )
+
+    def on_queue_declared(self, queue, _frame):
+        # do not auto-acknowledge the message (let the callback handle it)
+        self.channel.basic_consume(
+            queue=queue,
+            on_message_callback=functools.partial(self.on_message, self.monitors[queue]),
+        )
+        print(f" [*] Listening on {queue}")
+
+    # messages
+
+    def on_message(self, monitor, channel, method, properties, body):
+        """Run every reading in the message through the stream's monitor."""
+        stages = self.stages
+        stages.start()
+        started = self.metrics.received(monitor.name, properties)
+        try:
+            readings = decode_readings(properties, body)
+            stages.mark("decode")
+            # while catching up, queue the readings for the next batch, which acks them
+            if self.catchup.observe(properties):
+                self.catchup.defer(monitor, method, readings, started)
+                self.metrics.maybe_report()
+                return
+            # add any queued readings first so they stay in order
+            self.catchup.flush()
+            for timestamp, temp in readings:
+                # skip readings of a redelivered message that are already in the restored window
+                if method.redelivered and self.checkpointer.covered(monitor.name, timestamp):
+                    continue
+                # skip readings that were delivered before
+                if self.duplicates.seen(monitor.name, timestamp):
+                    continue
+                if self.history is not None:
+                    self.history.append(monitor.name, timestamp, temp)
+                self.output.message(received_line, timestamp, temp, monitor.name)
+                stages.mark("print")
+                if stages.enabled:
+                    alerts = monitor.add_timed(timestamp, temp, stages.mark)
+                else:
+                    alerts = monitor.add(timestamp, temp)
+                for alert in alerts:
+                    self.output.alert(alert, monitor.name, timestamp)
+                    if isinstance(alert, Estimate):
+                        self.metrics.estimated()
+                    else:
+                        self.metrics.alerted(started)
+                if self.join is not None:
+                    for when, alert in self.join.add(monitor.name, timestamp, temp, alerts):
+                        self.output.alert(alert, "join", when)
+                        self.metrics.alerted(started)
+                stages.mark("alert")
+        except ValueError:
+            pass
+        except Exception as e:
+            # do not raise into pika's dispatcher: the channel would stay open with
+            # this message unacked, and with a small prefetch every queue stalls.
+            # stop() acks the messages processed before this one and closes the
+            # connection, so RabbitMQ delivers this one again, and run() raises
+            self.error = e
+            self.stop()
+            return
+        # Acknowledge that the message has been processed and can be removed from the queue
+        self.ack_batcher.done(method.delivery_tag)
+        stages.mark("ack")
+        self.metrics.maybe_report()
+
+    def join_batch(self, stream, readings, alerts):
+        """Feed a catch-up batch and its (timestamp, message) alerts to the join."""
+        alerts_at = {}
+        for timestamp, message in alerts:
+            alerts_at.setdefault(timestamp, []).append(message)
+        for timestamp, temp in readings:
+            for when, alert in self.join.add(stream, timestamp, temp, alerts_at.pop(timestamp, ())):
+                self.output.alert(alert, "join", when)
+
+
+async def run_consumer(hn: str, queues: list):
+    """Run the consumer until CTRL+C."""
+    consumer = AsyncConsumer(hn, queues, prefetch_count, ack_batch_size, ack_max_delay)
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, consumer.stop)
+        loop.add_signal_handler(signal.SIGTERM, consumer.stop)
+    except NotImplementedError:
+        # signal handlers are not available on Windows event loops
+        pass
+    if metrics_port:
+        consumer.metrics.serve(metrics_port)
+    install_signal_handlers(consumer.stages, consumer.profiler)
+    print(" [*] Ready for work. To exit press CTRL+C")
+    try:
+        await consumer.run()
+    finally:
+        if consumer.history is not None:
+            consumer.history.close()
+        consumer.output.close()
+        print(consumer.metrics.summary())
+        print(consumer.duplicates.summary())
+
+
+# define a main function to run the program
+def main(hn: str = "localhost", queues: list = None):
+    """Continuously listen for messages on every named queue."""
+    queues = queues or default_queues
+    try:
+        asyncio.run(run_consumer(hn, queues))
+    except pika.exceptions.AMQPConnectionError as e:
+        print()
+        print("ERROR: connection to RabbitMQ server failed.")
+        print(f"Verify the server is running on host={hn}.")
+        print(f"The error says: {e}")
+        print()
+        sys.exit(1)
+    except Exception as e:
+        print()
+        print("ERROR: something went wrong.")
+        print(f"The error says: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+        print(" User interrupted continuous listening process.")
+        sys.exit(0)
+    finally:
+        print("\nClosing connection. Goodbye.\n")
+
+
+# Standard Python idiom to indicate main program entry point
+# This allows us to import this module and use its functions
+# without executing the code below.
+# If this is the program being run, then execute the code below
+if __name__ == "__main__":
+    # call the main function with the host and the queues to watch
+    main(host, sys.argv[1:])
@@ -0,0 +1,184 @@
+"""
+    Offline backtest of the BBQ alert rules over a whole CSV file.
+
+    No RabbitMQ, producer or consumers needed: the CSV is read with
+    bbq_ingest.py and each rule is evaluated for every reading at once with
+    vectorized rolling-window operations. The windows follow the same
+    event-time rules as the streaming consumers (bbq_window.EventTimeWindow):
+    the window of a reading holds every earlier reading of the same stream
+    stamped within the last `span` seconds, so the alert times printed here
+    match what the consumers would print for the same data.
+
+        smoker drop: max - min >= drop over the last 150 seconds
+        food stall:  max - min < delta over the last 600 seconds, once the
+                     stream has been watched for the whole 600 seconds
+
+    Because it is vectorized it can sweep thresholds over months of history
+    in seconds.
+
+    Usage:
+        python bbq_backtest.py [csv_file] [--smoker-drop 15] [--stall-delta 1]
+        python bbq_backtest.py [csv_file] --sweep
+
+"""
+
+import argparse
+
+import numpy as np
+
+from bbq_ingest import channel_queues, read_csv_columns
+from bbq_readings import format_time
+from bbq_rules import rules_for
+
+# Define the variables
+data_file = "smoker-temps.csv"
+smoker_window = 150
+stall_window = 600
+sweep_drops = [5, 10, 15, 20, 25]
+sweep_deltas = [0.25, 0.5, 1, 2]
+
+
+def load_streams(path: str) -> dict:
+    """Read the whole CSV and return {queue: (times, temps)} numpy arrays."""
+    times = {queue: [] for queue in channel_queues}
+    temps = {queue: [] for queue in channel_queues}
+    for columns in read_csv_columns(path):
+        for index, queue in enumerate(channel_queues):
+            present = columns.present[:, index]
+            times[queue].append(columns.times[present])
+            temps[queue].append(columns.temps[present, index])
+    return {
+        queue: (
+            np.concatenate(times[queue]) if times[queue] else np.empty(0, dtype=np.int64),
+            np.concatenate(temps[queue]) if temps[queue] else np.empty(0),
+        )
+        for queue in channel_queues
+    }
+
+
+def drop_late(times: np.ndarray, temps: np.ndarray):
+    """
+    Drop readings stamped earlier than one already seen, like the consumer
+    windows do (with allowed_lateness = 0), so the windows stay sorted.
+    """
+    if len(times) == 0:
+        return times, temps
+    in_order = times >= np.maximum.accumulate(times)
+    return times[in_order], temps[in_order]
+
+
+def window_starts(times: np.ndarray, span: int) -> np.ndarray:
+    """Index of the oldest reading in each reading's event-time window."""
+    # the window of reading i holds readings stamped in (times[i] - span, times[i]]
+    return np.searchsorted(times, times - span, side="right")
+
+
+def rolling_spread(temps: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    max - min of temps[starts[i]:i + 1] for every i.
+
+    Uses a sparse table: level k holds the max/min of every run of 2**k
+    readings, and any window is covered by two overlapping runs. Only the
+    levels up to the longest window are built, so memory stays small.
+    """
+    count = len(temps)
+    if count == 0:
+        return np.empty(0)
+    ends = np.arange(count)
+    lengths = ends - starts + 1
+    levels = int(lengths.max()).bit_length()
+    maxes = [temps]
+    mins = [temps]
+    for level in range(1, levels):
+        half = 1 << (level - 1)
+        previous_max, previous_min = maxes[-1], mins[-1]
+        maxes.append(np.maximum(previous_max[:-half], previous_max[half:]))
+        mins.append(np.minimum(previous_min[:-half], previous_min[half:]))
+
+    spread = np.empty(count)
+    level_of = np.log2(lengths).astype(np.int64)
+    for level in range(levels):
+        rows = np.nonzero(level_of == level)[0]
+        if len(rows) == 0:
+            continue
+        left = starts[rows]
+        right = ends[rows] - (1 << level) + 1
+        window_max = np.maximum(maxes[level][left], maxes[level][right])
+        window_min = np.minimum(mins[level][left], mins[level][right])
+        spread[rows] = window_max - window_min
+    return spread
+
+
+def smoker_drop_alerts(times, temps, drop: float = 15, span: int = smoker_window) -> np.ndarray:
+    """Times of the readings where the smoker changed by `drop` or more within `span` seconds."""
+    spread = rolling_spread(temps, window_starts(times, span))
+    return times[spread >= drop]
+
+
+def food_stall_alerts(times, temps, delta: float = 1, span: int = stall_window) -> np.ndarray:
+    """Times of the readings where the food changed by less than `delta` over `span` seconds."""
+    if len(times) == 0:
+        return times
+    starts = window_starts(times, span)
+    spread = rolling_spread(temps, starts)
+    # like EventTimeWindow.is_full(): more than one reading in the window, a
+    # reading before it, and less than a span from that reading to the window
+    before = np.maximum(starts - 1, 0)
+    full = (np.arange(len(times)) > starts) & (starts > 0) & (times[starts] - times[before] < span)
+    return times[full & (spread < delta)]
+
+
+def backtest(streams: dict, drop: float = 15, delta: float = 1) -> dict:
+    """Return {queue: alert times} for every stream."""
+    alerts = {}
+    for queue, (times, temps) in streams.items():
+        times, temps = drop_late(times, temps)
+        if "smoker" in queue:
+            alerts[queue] = smoker_drop_alerts(times, temps, drop)
+        else:
+            alerts[queue] = food_stall_alerts(times, temps, delta)
+    return alerts
+
+
+def print_alerts(alerts: dict):
+    """Print every alert with its Time stamp, using the consumers' messages."""
+    for queue, times in alerts.items():
+        kind = "delta" if "smoker" in queue else "stall"
+        messages = [rule["message"] for rule in rules_for(queue) if rule.get("type") == kind]
+        message = messages[0].replace("{queue}", queue) if messages else f"{kind} alert"
+        for timestamp in times.tolist():
+            print(f"{format_time(timestamp)} {queue} {message}")
+        print(f" [x] {queue}: {len(times)} alerts")
+
+
+def sweep(streams: dict):
+    """Print how many alerts each threshold would raise."""
+    streams = {queue: drop_late(times, temps) for queue, (times, temps) in streams.items()}
+    smoker_times, smoker_temps = streams["01-smoker"]
+    print("smoker drop threshold -> alerts")
+    for drop in sweep_drops:
+        print(f"{drop:>8} {len(smoker_drop_alerts(smoker_times, smoker_temps, drop)):>8}")
+    print("food stall threshold -> alerts (food A, food B)")
+    for delta in sweep_deltas:
+        counts = [len(food_stall_alerts(*streams[queue], delta)) for queue in ("02-food-A", "02-food-B")]
+        print(f"{delta:>8} {counts[0]:>8} {counts[1]:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the BBQ alert rules over a CSV file.")
+    parser.add_argument("csv_file", nargs="?", default=data_file)
+    parser.add_argument("--smoker-drop", type=float, default=15)
+    parser.add_argument("--stall-delta", type=float, default=1)
+    parser.add_argument("--sweep", action="store_true", help="count alerts for a range of thresholds")
+    args = parser.parse_args()
+
+    streams = load_streams(args.csv_file)
+    if args.sweep:
+        sweep(streams)
+    else:
+        print_alerts(backtest(streams, args.smoker_drop, args.stall_delta))
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+    Catch-up mode for consumers that have fallen behind.
+
+    After a restart, or when the producer runs faster than the consumer,
+    thousands of readings can be waiting in the queue. Handling each stale
+    message the normal way (log it, add it, check the rules, ack it) makes
+    the consumer slowest exactly when it most needs to be fast. CatchUp
+    watches how far behind the consumer is:
+        * lag: now minus the producer's x-sent-at header (see bbq_metrics.py),
+          checked on every message
+        * depth: the number of messages waiting in the queue, polled every
+          few seconds with a passive queue_declare (blocking consumers only)
+    It switches on when the lag is above enter_lag seconds or the depth is
+    above enter_depth messages, and off again once both are below exit_lag
+    and exit_depth, so it does not flap at the boundary.
+
+    While catching up, the callback hands the decoded readings to defer()
+    instead of processing them:
+        * no per-message " [x] Received" logs
+        * readings are queued per stream and added in batches with
+          StreamMonitor.add_many(), which still updates the windows and
+          evaluates the rules after every reading, so every alert that would
+          have fired still fires, for the reading that fired it
+        * repeats of the same alert in a batch are coalesced into one line,
+          e.g. "... (x12 from 12:01:30 to 12:07:00, catching up)"
+        * the batch is acked with one basic_ack(multiple=True) after it has
+          been added, so a crash mid-batch only redelivers messages
+    A batch is flushed every batch_messages deferred messages (at most the
+    prefetch count, or RabbitMQ would stop delivering before it is full),
+    after max_delay seconds, and before the first message that is handled
+    normally again, so the readings of each stream stay in order.
+
+"""
+
+import time
+
+from bbq_eta import Estimate
+from bbq_metrics import sent_at_header
+from bbq_readings import format_time
+
+# Define the variables
+# start catching up when messages are this many seconds old or this many are queued
+enter_lag = 5.0
+enter_depth = 1000
+# and stop when they are back under these
+exit_lag = 1.0
+exit_depth = 10
+# deferred messages added and acked together (capped at the prefetch count)
+batch_messages = 500
+# seconds a partial batch can wait before it is flushed
+max_delay = 0.2
+# seconds between queue depth polls
+depth_interval = 5.0
+
+
+class CatchUp:
+    """
+    Detect a backlog and process it in batches.
+
+    Parameters:
+        output: the consumer's Output, for the status lines and coalesced alerts
+        metrics: the consumer's ConsumerMetrics, or None
+        covered: function(stream, timestamp) -> True if a redelivered reading
+                 is already in the restored window (Checkpointer.covered), or None
+        batch_messages (int): flush after this many deferred messages
+        max_delay (float): flush a partial batch after this many seconds
+        on_batch: function(stream, readings, alerts) called with every batch
+                  added and the (timestamp, message) alerts it raised, or None
+        seen: function(stream, timestamp) -> True if the reading was seen
+              before (DuplicateFilter.seen), or None
+        history: HistoryWriter the batches are appended to, or None
+
+    In the callback, once the readings are decoded:
+        if catchup.observe(properties):
+            catchup.defer(monitor, method, readings, started)
+            return
+        catchup.flush()
+        ... handle the message normally
+    and in main(), once the channel is open:
+        catchup.attach(ack_batcher, connection.call_later)
+    """
+
+    def __init__(self, output, metrics=None, covered=None,
+                 batch_messages: int = 500, max_delay: float = 0.2, on_batch=None, seen=None,
+                 history=None):
+        if batch_messages < 1:
+            raise ValueError("batch_messages must be at least 1")
+        self.output = output
+        self.metrics = metrics
+        self.covered = covered
+        self.batch_messages = batch_messages
+        self.max_delay = max_delay
+        self.on_batch = on_batch
+        self.seen = seen
+        self.history = history
+        self.ack_batcher = None
+        self.call_later = None
+        self.active = False
+        # latest lag (seconds) and queue depth, None until known
+        self.lag = None
+        self.depth = None
+        # stream name -> (monitor, readings) waiting to be added
+        self.batches = {}
+        self.messages = 0
+        self.last_tag = None
+        self.started = None
+        self.timer_scheduled = False
+        # totals for the current catch-up, reported when it ends
+        self.since = None
+        self.caught_up_messages = 0
+        self.caught_up_readings = 0
+
+    def attach(self, ack_batcher, call_later=None):
+        """Use this AckBatcher for the batches and call_later(delay, callback) for the flush timer."""
+        self.ack_batcher = ack_batcher
+        self.call_later = call_later
+
+    # detecting the backlog
+
+    def observe(self, properties) -> bool:
+        """Update the lag from a message's x-sent-at header, returns True while catching up."""
+        headers = getattr(properties, "headers", None)
+        if headers:
+            sent_at = headers.get(sent_at_header)
+            if sent_at is not None:
+                self.lag = time.time() - sent_at / 1e6
+                self._update()
+        return self.active
+
+    def observe_depth(self, depth: int) -> bool:
+        """Update the number of messages waiting in the queue, returns True while catching up."""
+        self.depth = depth
+        self._update()
+        return self.active
+
+    def watch_depth(self, channel, queue: str, call_later, interval: float = depth_interval):
+        """
+        Poll the queue depth every `interval` seconds on a BlockingChannel
+        (queue_declare with passive=True only reads the queue's message count).
+        """
+        def poll():
+            if not channel.is_open:
+                return
+            frame = channel.queue_declare(queue=queue, passive=True)
+            self.observe_depth(frame.method.message_count)
+            call_later(interval, poll)
+
+        call_later(interval, poll)
+
+    def _update(self):
+        lag, depth = self.lag, self.depth
+        if self.active:
+            if (lag is None or lag < exit_lag) and (depth is None or depth <= exit_depth):
+                self.active = False
+                self.flush()
+                seconds = time.monotonic() - self.since
+                self.output.info(
+                    f" [c] Caught up: {self.caught_up_messages} messages, "
+                    f"{self.caught_up_readings} readings in {seconds:.1f} s"
+                )
+        elif (lag is not None and lag > enter_lag) or (depth is not None and depth > enter_depth):
+            self.active = True
+            self.since = time.monotonic()
+            self.caught_up_messages = 0
+            self.caught_up_readings = 0
+            behind = f"{lag:.1f} s" if lag is not None else f"{depth} messages"
+            self.output.info(f" [c] Behind by {behind}, catching up")
+
+    # batching the backlog
+
+    def defer(self, monitor, method, readings, started: int = None):
+        """Queue a message's readings for the next batch, the message is acked with the batch."""
+        if method.redelivered and self.covered is not None:
+            # skip readings that are already in the restored window
+            readings = [r for r in readings if not self.covered(monitor.name, r[0])]
+        if self.seen is not None:
+            # and readings delivered before, redeliveries and producer replays
+            readings = [r for r in readings if not self.seen(monitor.name, r[0])]
+        batch = self.batches.get(monitor.name)
+        if batch is None:
+            self.batches[monitor.name] = (monitor, list(readings))
+        else:
+            batch[1].extend(readings)
+        if self.started is None:
+            self.started = started
+        self.last_tag = method.delivery_tag
+        self.messages += 1
+        if self.messages >= self.batch_messages:
+            self.flush()
+        elif not self.timer_scheduled and self.call_later is not None:
+            self.timer_scheduled = True
+            self.call_later(self.max_delay, self.on_timer)
+
+    def on_timer(self):
+        self.timer_scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Add every queued reading to its monitor, write the alerts and ack the batch."""
+        if self.messages == 0:
+            return
+        output = self.output
+        metrics = self.metrics
+        for name, (monitor, readings) in self.batches.items():
+            # every reading is added and the rules checked after each one
+            alerts = monitor.add_many(readings)
+            self.caught_up_readings += len(readings)
+            if self.history is not None:
+                self.history.extend(name, readings)
+            if self.on_batch is not None:
+                self.on_batch(name, readings, alerts)
+            # coalesce repeats of the same alert: message -> [count, first time, last time]
+            repeats = {}
+            for timestamp, message in alerts:
+                seen = repeats.get(message)
+                if seen is None:
+                    repeats[message] = [1, timestamp, timestamp]
+                else:
+                    seen[0] += 1
+                    seen[2] = timestamp
+                if metrics is None:
+                    continue
+                if isinstance(message, Estimate):
+                    metrics.estimated()
+                elif self.started is not None:
+                    metrics.alerted(self.started)
+            for message, (count, first, last) in repeats.items():
+                if count > 1:
+                    message = (f"{message} (x{count} from {format_time(first)} "
+                               f"to {format_time(last)}, catching up)")
+                output.alert(message, name, last)
+        self.batches.clear()
+        self.caught_up_messages += self.messages
+        messages, self.messages = self.messages, 0
+        self.started = None
+        if self.ack_batcher is not None:
+            self.ack_batcher.done_through(self.last_tag, messages)
+
+
+def make_catchup(output, metrics=None, covered=None, prefetch_count: int = None,
+                 on_batch=None, seen=None, history=None) -> CatchUp:
+    """Create a CatchUp from the settings at the top of this module, batches capped at the prefetch count."""
+    size = batch_messages if prefetch_count is None else max(1, min(batch_messages, prefetch_count))
+    return CatchUp(output, metrics, covered, size, max_delay, on_batch, seen, history)
@@ -0,0 +1,410 @@
+"""
+    Checkpoints of the consumers' window state for a fast restart.
+
+    The windows of every StreamMonitor only live in memory. When a consumer
+    restarts it starts with empty windows, and a rule like "changed less
+    than 1 degree in 10 minutes" is blind until 10 minutes of readings have
+    built up again.
+
+    A Checkpointer writes the windows of one or more monitors to a small
+    binary file and reads them back on startup:
+        * the file is written just before every ack (AckBatcher on_flush), so
+          a message is never acked before a checkpoint holds its readings.
+          The consumers ack, and so checkpoint, every checkpoint_every
+          messages or checkpoint_interval seconds: their ack_batch_size and
+          ack_max_delay are set from these and prefetch_count is at least
+          as big, so a save (and its fsync) is paid once per batch, not once
+          per message
+        * it is written to a temporary file and moved into place with
+          os.replace(), so a crash while writing leaves the last good file
+        * restoring is a handful of struct.unpack calls, a few milliseconds
+
+    A message that was processed and saved but whose ack never reached the
+    broker is delivered again with method.redelivered set. covered() tells
+    the consumer to skip its readings so they are not counted twice.
+
+    Besides the windows, the file holds the rest of each stream's rule
+    state, so a restart gives the same alerts as an uninterrupted run:
+        * the rolling statistics of "zscore" rules (WindowedStats, Ewma)
+        * the ETA predictors of "eta" rules: the regression sums and its
+          readings, when the next estimate is due and whether the cook is done
+    and, when the consumer passes its DuplicateFilter, the timestamps it
+    remembers (see bbq_dedup.py), so a reading the producer sends again after
+    the consumer restarted is still dropped as a duplicate.
+
+    File layout (little-endian):
+        header     magic b"BBQW", version, number of streams
+        stream     name, newest timestamp, number of windows
+        window     span, allowed_lateness, latest, evicted_time, dropped, lengths,
+                   then timestamps (int64) and readings (float64) for the window,
+                   its max and min deques and the pending heap
+        counts     number of statistics and of predictors
+        stats      kind (0 windowed, 1 ewma), span or halflife, then
+                   count, mean, m2, length, timestamps and readings (windowed)
+                   or count, mean, var, last_time (ewma)
+        predictor  target, span, next_time, done, origin, n, sx, sxx, sy, sxy,
+                   then the regression's x (int64) and y (float64) values
+        duplicates number of streams in the DuplicateFilter (0 without one),
+                   then per stream its name, newest timestamp, number of
+                   timestamps and the timestamps (int64)
+
+"""
+
+import os
+import struct
+
+from bbq_dedup import RecentTimestamps
+
+# Define the variables
+checkpoint_dir = "checkpoints"
+# the consumers checkpoint and then ack every checkpoint_every processed
+# messages, or checkpoint_interval seconds after the oldest unacked one
+checkpoint_every = 100
+checkpoint_interval = 1.0
+
+_magic = b"BBQW"
+_version = 4
+_header = struct.Struct("<4sHI")
+_stream = struct.Struct("<qH")
+_window = struct.Struct("<IIqqQIIII")
+_counts = struct.Struct("<HH")
+_stats = struct.Struct("<Bd")
+_windowed_stats = struct.Struct("<QddI")
+_ewma = struct.Struct("<Qddq")
+_predictor = struct.Struct("<dIqBqIqqddI")
+_recent = struct.Struct("<qI")
+# stands in for None in the int64 fields
+_none = -(1 << 63)
+
+
+def checkpoint_path(name: str) -> str:
+    """Return the checkpoint file for a consumer, e.g. checkpoints/01-smoker.ckpt."""
+    return os.path.join(checkpoint_dir, f"{name}.ckpt")
+
+
+def _pack_window(window) -> bytes:
+    lengths = (len(window.timestamps), len(window.max_times), len(window.min_times), len(window.pending))
+    parts = [_window.pack(
+        window.span,
+        window.allowed_lateness,
+        _none if window.latest is None else window.latest,
+        _none if window.evicted_time is None else window.evicted_time,
+        window.dropped,
+        *lengths,
+    )]
+    pending = sorted(window.pending)
+    for times, readings, count in (
+        (window.timestamps, window.readings, lengths[0]),
+        (window.max_times, window.max_readings, lengths[1]),
+        (window.min_times, window.min_readings, lengths[2]),
+        ([t for t, r in pending], [r for t, r in pending], lengths[3]),
+    ):
+        parts.append(struct.pack(f"<{count}q", *times))
+        parts.append(struct.pack(f"<{count}d", *readings))
+    return b"".join(parts)
+
+
+def _pack_stats(key: tuple, stats) -> bytes:
+    kind, seconds = key
+    if kind == "halflife":
+        return _stats.pack(1, seconds) + _ewma.pack(
+            stats.count, stats.mean, stats.var, _none if stats.last_time is None else stats.last_time)
+    count = len(stats.timestamps)
+    return b"".join((
+        _stats.pack(0, seconds),
+        _windowed_stats.pack(stats.count, stats.mean, stats.m2, count),
+        struct.pack(f"<{count}q", *stats.timestamps),
+        struct.pack(f"<{count}d", *stats.readings),
+    ))
+
+
+def _pack_predictor(predictor) -> bytes:
+    regression = predictor.regression
+    count = len(regression.xs)
+    return b"".join((
+        _predictor.pack(
+            predictor.target,
+            regression.span,
+            _none if predictor.next_time is None else predictor.next_time,
+            predictor.done,
+            _none if regression.origin is None else regression.origin,
+            regression.n,
+            regression.sx,
+            regression.sxx,
+            regression.sy,
+            regression.sxy,
+            count,
+        ),
+        struct.pack(f"<{count}q", *regression.xs),
+        struct.pack(f"<{count}d", *regression.ys),
+    ))
+
+
+def _pack_name(name: str) -> bytes:
+    encoded = name.encode()
+    return struct.pack("<H", len(encoded)) + encoded
+
+
+def _unpack_name(data: bytes, offset: int):
+    (length,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _pack_duplicates(duplicates) -> bytes:
+    streams = {} if duplicates is None else duplicates.streams
+    parts = [struct.pack("<I", len(streams))]
+    for name, recent in streams.items():
+        timestamps = sorted(t for bucket in recent.buckets.values() for t in bucket)
+        parts.append(_pack_name(name))
+        parts.append(_recent.pack(_none if recent.newest is None else recent.newest, len(timestamps)))
+        parts.append(struct.pack(f"<{len(timestamps)}q", *timestamps))
+    return b"".join(parts)
+
+
+def pack_monitors(monitors: dict, duplicates=None) -> bytes:
+    """
+    Serialize the windows, statistics and predictors of {name: StreamMonitor},
+    and the timestamps remembered by a DuplicateFilter if one is given.
+    """
+    parts = [_header.pack(_magic, _version, len(monitors))]
+    for name, monitor in monitors.items():
+        parts.append(_pack_name(name))
+        windows = monitor.windows
+        latest = _none if monitor.latest is None else monitor.latest
+        parts.append(_stream.pack(latest, len(windows)))
+        for window in windows.values():
+            parts.append(_pack_window(window))
+        rules = monitor.rules
+        parts.append(_counts.pack(len(rules.stats), len(rules.predictors)))
+        for key, stats in rules.stats.items():
+            parts.append(_pack_stats(key, stats))
+        for predictor in rules.predictors:
+            parts.append(_pack_predictor(predictor))
+    parts.append(_pack_duplicates(duplicates))
+    return b"".join(parts)
+
+
+def unpack_monitors(data: bytes) -> tuple:
+    """
+    Read a checkpoint back into
+    ({name: (latest, [window state, ...], {stats key: state}, [predictor state, ...])},
+     {name: (newest, timestamps)}),
+    where each state is a dict of the fields of the object it was saved from,
+    and the second dict holds the DuplicateFilter's timestamps per stream.
+    """
+    magic, version, count = _header.unpack_from(data, 0)
+    if magic != _magic or version != _version:
+        raise ValueError("not a BBQ window checkpoint (or an unknown version)")
+    offset = _header.size
+    streams = {}
+    for _ in range(count):
+        name, offset = _unpack_name(data, offset)
+        latest, window_count = _stream.unpack_from(data, offset)
+        offset += _stream.size
+        windows = []
+        for _ in range(window_count):
+            span, lateness, window_latest, evicted_time, dropped, *lengths = _window.unpack_from(data, offset)
+            offset += _window.size
+            state = {
+                "span": span,
+                "allowed_lateness": lateness,
+                "latest": None if window_latest == _none else window_latest,
+                "evicted_time": None if evicted_time == _none else evicted_time,
+                "dropped": dropped,
+            }
+            columns = []
+            for size in lengths:
+                times = struct.unpack_from(f"<{size}q", data, offset)
+                offset += 8 * size
+                readings = struct.unpack_from(f"<{size}d", data, offset)
+                offset += 8 * size
+                columns.append((times, readings))
+            state["window"], state["max"], state["min"], state["pending"] = columns
+            windows.append(state)
+        stats_count, predictor_count = _counts.unpack_from(data, offset)
+        offset += _counts.size
+        stats = {}
+        for _ in range(stats_count):
+            kind, seconds = _stats.unpack_from(data, offset)
+            offset += _stats.size
+            if kind == 1:
+                count, mean, var, last_time = _ewma.unpack_from(data, offset)
+                offset += _ewma.size
+                stats[("halflife", seconds)] = {
+                    "count": count, "mean": mean, "var": var,
+                    "last_time": None if last_time == _none else last_time,
+                }
+            else:
+                count, mean, m2, size = _windowed_stats.unpack_from(data, offset)
+                offset += _windowed_stats.size
+                timestamps = struct.unpack_from(f"<{size}q", data, offset)
+                offset += 8 * size
+                readings = struct.unpack_from(f"<{size}d", data, offset)
+                offset += 8 * size
+                stats[("window", int(seconds))] = {
+                    "count": count, "mean": mean, "m2": m2,
+                    "timestamps": timestamps, "readings": readings,
+                }
+        predictors = []
+        for _ in range(predictor_count):
+            target, span, next_time, done, origin, n, sx, sxx, sy, sxy, size = _predictor.unpack_from(data, offset)
+            offset += _predictor.size
+            xs = struct.unpack_from(f"<{size}q", data, offset)
+            offset += 8 * size
+            ys = struct.unpack_from(f"<{size}d", data, offset)
+            offset += 8 * size
+            predictors.append({
+                "target": target, "span": span,
+                "next_time": None if next_time == _none else next_time,
+                "done": bool(done),
+                "origin": None if origin == _none else origin,
+                "n": n, "sx": sx, "sxx": sxx, "sy": sy, "sxy": sxy, "xs": xs, "ys": ys,
+            })
+        streams[name] = (None if latest == _none else latest, windows, stats, predictors)
+    (count,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    recent = {}
+    for _ in range(count):
+        name, offset = _unpack_name(data, offset)
+        newest, size = _recent.unpack_from(data, offset)
+        offset += _recent.size
+        recent[name] = (None if newest == _none else newest, struct.unpack_from(f"<{size}q", data, offset))
+        offset += 8 * size
+    return streams, recent
+
+
+def restore_window(window, state: dict):
+    """Load a saved window state into an EventTimeWindow with the same span and lateness."""
+    window.clear()
+    window.latest = state["latest"]
+    window.evicted_time = state["evicted_time"]
+    window.dropped = state["dropped"]
+    window.timestamps.extend(state["window"][0])
+    window.readings.extend(state["window"][1])
+    window.max_times.extend(state["max"][0])
+    window.max_readings.extend(state["max"][1])
+    window.min_times.extend(state["min"][0])
+    window.min_readings.extend(state["min"][1])
+    # a sorted list is a valid heap
+    window.pending.extend(zip(*state["pending"]))
+
+
+def restore_stats(stats, state: dict):
+    """Load a saved state into a WindowedStats or Ewma built from the same rule."""
+    for field, value in state.items():
+        if field in ("timestamps", "readings"):
+            getattr(stats, field).clear()
+            getattr(stats, field).extend(value)
+        else:
+            setattr(stats, field, value)
+
+
+def restore_predictor(predictor, state: dict):
+    """Load a saved state into an EtaPredictor with the same target and window."""
+    predictor.next_time = state["next_time"]
+    predictor.done = state["done"]
+    regression = predictor.regression
+    regression.origin = state["origin"]
+    regression.n = state["n"]
+    regression.sx = state["sx"]
+    regression.sxx = state["sxx"]
+    regression.sy = state["sy"]
+    regression.sxy = state["sxy"]
+    regression.xs.clear()
+    regression.xs.extend(state["xs"])
+    regression.ys.clear()
+    regression.ys.extend(state["ys"])
+
+
+def restore_duplicates(duplicates, recent: dict):
+    """Load saved timestamps into a DuplicateFilter, bucketed by its own bucket_seconds."""
+    for name, (newest, timestamps) in recent.items():
+        stream = duplicates.streams[name] = RecentTimestamps()
+        stream.newest = newest
+        # buckets past the horizon are dropped when the stream reaches its next bucket
+        for timestamp in timestamps:
+            stream.buckets.setdefault(timestamp // duplicates.bucket_seconds, set()).add(timestamp)
+
+
+class Checkpointer:
+    """
+    Save and restore the windows of {name: StreamMonitor} in one file.
+
+    Parameters:
+        path (str): the checkpoint file
+        monitors (dict): name -> StreamMonitor
+        duplicates (DuplicateFilter): saved and restored with the monitors, optional
+
+    Pass save as the AckBatcher's on_flush.
+    """
+
+    def __init__(self, path: str, monitors: dict, duplicates=None):
+        self.path = path
+        self.monitors = monitors
+        self.duplicates = duplicates
+        # name -> newest timestamp restored from the file
+        self.restored_through = {}
+        self.saves = 0
+
+    def restore(self) -> bool:
+        """
+        Load the windows, statistics, predictors and duplicate timestamps
+        saved in the file, if there is one. Any of them whose rule changed
+        since the file was written start empty. Returns True if anything was restored.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                streams, recent = unpack_monitors(file.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, struct.error) as e:
+            print(f" [!] Ignoring checkpoint {self.path}: {e}")
+            return False
+        restored = False
+        for name, (latest, states, stats_states, predictor_states) in streams.items():
+            monitor = self.monitors.get(name)
+            if monitor is None:
+                continue
+            for state in states:
+                window = monitor.windows.get(state["span"])
+                if window is None or window.allowed_lateness != state["allowed_lateness"]:
+                    continue
+                restore_window(window, state)
+                restored = True
+            rules = monitor.rules
+            for key, state in stats_states.items():
+                stats = rules.stats.get(key)
+                if stats is not None:
+                    restore_stats(stats, state)
+                    restored = True
+            # predictors are matched by position, target and window
+            for predictor, state in zip(rules.predictors, predictor_states):
+                if predictor.target == state["target"] and predictor.regression.span == state["span"]:
+                    restore_predictor(predictor, state)
+                    restored = True
+            monitor.latest = latest
+            if latest is not None:
+                self.restored_through[name] = latest
+        if self.duplicates is not None and recent:
+            restore_duplicates(self.duplicates, recent)
+            restored = True
+        return restored
+
+    def covered(self, name: str, timestamp: int) -> bool:
+        """True if a redelivered reading is already in the restored windows."""
+        through = self.restored_through.get(name)
+        return through is not None and timestamp <= through
+
+    def save(self):
+        """Write the windows now, replacing the file atomically."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(pack_monitors(self.monitors, self.duplicates))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self.saves += 1
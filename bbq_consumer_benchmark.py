@@ -0,0 +1,97 @@
+"""
+    Benchmark consumer throughput as prefetch_count and ack batch size vary.
+
+    For every combination the benchmark fills a scratch queue with readings,
+    then consumes them exactly like the consumers do (decode, StreamMonitor,
+    AckBatcher) and reports the messages per second and how many basic_ack
+    calls it took. An ack batch larger than the prefetch count can never
+    fill (the broker stops sending), so those combinations are skipped.
+
+    RabbitMQ must be running on localhost.
+
+    Usage:
+        python bbq_consumer_benchmark.py [messages]
+
+"""
+
+import sys
+import time
+
+import pika
+
+from bbq_acks import AckBatcher
+from bbq_readings import binary_content_type, decode_readings, encode_binary
+from bbq_streams import make_monitor
+
+# Define the variables
+host = "localhost"
+bench_queue = "bench-consumer"
+prefetch_counts = [1, 10, 50, 200, 1000]
+ack_batch_sizes = [1, 10, 50, 200]
+ack_max_delay = 0.1
+default_messages = 20_000
+
+
+def fill_queue(channel, count: int):
+    """Empty the scratch queue and publish `count` binary readings to it."""
+    channel.queue_delete(bench_queue)
+    channel.queue_declare(queue=bench_queue, durable=True)
+    properties = pika.BasicProperties(content_type=binary_content_type)
+    start = 1621686015
+    for i in range(count):
+        body = encode_binary(start + i * 5, 1, 225 + (i % 50) * 0.1)
+        channel.basic_publish(exchange="", routing_key=bench_queue, body=body, properties=properties)
+
+
+def consume(connection, channel, count: int, prefetch_count: int, ack_batch_size: int):
+    """Consume `count` messages, returns (seconds, basic_ack calls)."""
+    monitor = make_monitor("01-smoker")
+    batcher = AckBatcher(channel, ack_batch_size, ack_max_delay, connection.call_later,
+                         prefetch_count=prefetch_count)
+    received = 0
+
+    def callback(ch, method, properties, body):
+        nonlocal received
+        for timestamp, temp in decode_readings(properties, body):
+            monitor.add(timestamp, temp)
+        batcher.done(method.delivery_tag)
+        received += 1
+        if received == count:
+            batcher.flush()
+            ch.stop_consuming()
+
+    channel.basic_qos(prefetch_count=prefetch_count)
+    start = time.perf_counter()
+    tag = channel.basic_consume(queue=bench_queue, on_message_callback=callback)
+    channel.start_consuming()
+    elapsed = time.perf_counter() - start
+    channel.basic_cancel(tag)
+    return elapsed, batcher.acks_sent
+
+
+def main(count: int = default_messages):
+    """Run every prefetch / ack batch combination and print a table."""
+    try:
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+    except pika.exceptions.AMQPConnectionError as e:
+        print(f"ERROR: connection to RabbitMQ server failed: {e}")
+        sys.exit(1)
+    try:
+        channel = connection.channel()
+        print(f"{count} messages per run")
+        print(f"{'prefetch':>9} {'ack batch':>10} {'msgs/sec':>10} {'acks sent':>10}")
+        for prefetch_count in prefetch_counts:
+            for ack_batch_size in ack_batch_sizes:
+                if ack_batch_size > prefetch_count:
+                    continue
+                fill_queue(channel, count)
+                elapsed, acks_sent = consume(connection, channel, count, prefetch_count, ack_batch_size)
+                print(f"{prefetch_count:>9} {ack_batch_size:>10} {count / elapsed:>10.0f} {acks_sent:>10}")
+        channel.queue_delete(bench_queue)
+    finally:
+        connection.close()
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else default_messages)
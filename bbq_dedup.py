@@ -0,0 +1,187 @@
+"""
+    Duplicate suppression for the consumers.
+
+    The same reading can reach a consumer more than once:
+        * RabbitMQ redelivers the unacked messages of a consumer that
+          disconnected, some of which it had already processed
+        * the producer deletes its queues and replays the whole CSV file when
+          it is started again
+    The event-time windows drop readings older than their allowed lateness,
+    but the rules, rolling statistics and ETA predictors still see every
+    reading added, so a replayed cook can fire alerts again, and a repeat of
+    the newest reading is added to the windows twice.
+
+    A reading is identified by its stream and its Time stamp (the x-seq
+    header starts at 1 again when the producer restarts, so it cannot tell a
+    replay from new data). DuplicateFilter remembers the timestamps of the
+    last `horizon` seconds of event time of every stream:
+        * timestamps are kept in a set per bucket of `bucket_seconds`, so a
+          lookup is one dict and one set probe, O(1)
+        * when a stream's newest timestamp moves into a new bucket, whole
+          buckets older than the horizon are dropped, so memory is at most
+          horizon / reading interval timestamps per stream, after an hour or
+          after a week
+        * a reading older than the horizon is treated as a duplicate and
+          counted as expired, it is older than anything the windows would
+          still accept (keep horizon above the allowed lateness)
+    The consumers pass their filter to their Checkpointer, so its
+    timestamps are saved with the windows just before every ack and
+    restored on startup (see bbq_checkpoint.py): a reading the producer sends
+    again after the consumer restarted is still dropped. The keyed consumer
+    has no checkpoint, so its filter starts empty after a restart.
+
+    Run this file to replay smoker-temps.csv twice with redeliveries mixed
+    in, and a week of readings, and print what was dropped and the memory held:
+        python bbq_dedup.py [csv_file]
+
+"""
+
+import sys
+
+# Define the variables
+# seconds of event time remembered per stream
+horizon = 3600
+# seconds of event time per bucket, expired buckets are dropped whole
+bucket_seconds = 300
+
+
+class RecentTimestamps:
+    """The timestamps of one stream within the horizon, in buckets."""
+
+    __slots__ = ("newest", "buckets")
+
+    def __init__(self):
+        self.newest = None
+        # bucket number -> set of timestamps
+        self.buckets = {}
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+
+class DuplicateFilter:
+    """
+    Remember the (stream, timestamp) of recent readings and spot repeats.
+
+    In the callback, for every decoded reading:
+        if duplicates.seen(stream, timestamp):
+            continue
+    """
+
+    def __init__(self, horizon: int = horizon, bucket_seconds: int = bucket_seconds):
+        if bucket_seconds < 1 or horizon < bucket_seconds:
+            raise ValueError("bucket_seconds must be at least 1 and no more than horizon")
+        self.horizon = horizon
+        self.bucket_seconds = bucket_seconds
+        # stream name -> RecentTimestamps
+        self.streams = {}
+        # readings dropped as repeats, and as older than the horizon
+        self.duplicates = 0
+        self.expired = 0
+
+    def seen(self, stream: str, timestamp: int) -> bool:
+        """True if this reading was seen before (drop it), otherwise remember it and return False."""
+        recent = self.streams.get(stream)
+        if recent is None:
+            recent = self.streams[stream] = RecentTimestamps()
+        newest = recent.newest
+        if newest is not None and timestamp <= newest - self.horizon:
+            self.expired += 1
+            return True
+        number = timestamp // self.bucket_seconds
+        bucket = recent.buckets.get(number)
+        if bucket is None:
+            bucket = recent.buckets[number] = set()
+        elif timestamp in bucket:
+            self.duplicates += 1
+            return True
+        bucket.add(timestamp)
+        if newest is None or timestamp > newest:
+            recent.newest = timestamp
+            if newest is None or number != newest // self.bucket_seconds:
+                self._expire(recent, timestamp)
+        return False
+
+    def _expire(self, recent: RecentTimestamps, newest: int):
+        # at most horizon / bucket_seconds + 2 buckets, once per bucket boundary
+        oldest = (newest - self.horizon) // self.bucket_seconds
+        for number in [number for number in recent.buckets if number < oldest]:
+            del recent.buckets[number]
+
+    def evict_idle(self, before: int) -> int:
+        """Forget the streams whose newest reading is older than `before`, returns how many."""
+        idle = [stream for stream, recent in self.streams.items()
+                if recent.newest is not None and recent.newest < before]
+        for stream in idle:
+            del self.streams[stream]
+        return len(idle)
+
+    def summary(self) -> str:
+        return (f" [d] Dropped {self.duplicates} duplicate readings and "
+                f"{self.expired} older than the {self.horizon} s horizon")
+
+    def __len__(self):
+        """Timestamps remembered across every stream."""
+        return sum(len(recent) for recent in self.streams.values())
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    import csv
+    import random
+    import tracemalloc
+
+    from bbq_readings import parse_time
+    from bbq_streams import make_monitor
+
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else "smoker-temps.csv"
+    queues = ["01-smoker", "02-food-A", "02-food-B"]
+    readings = []
+    with open(csv_file, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for row in reader:
+            timestamp = parse_time(row[0])
+            for queue, value in zip(queues, row[1:]):
+                if value.strip():
+                    readings.append((queue, timestamp, round(float(value), 2)))
+
+    # a redelivery of every 20th reading shortly after it, then the producer
+    # restarting and replaying the whole file
+    random.seed(1)
+    delivered = []
+    for index, reading in enumerate(readings):
+        delivered.append(reading)
+        if index % 20 == 0 and index >= 5:
+            delivered.append(readings[index - random.randint(0, 5)])
+    delivered.extend(readings)
+
+    def alerts_for(stream_readings, duplicates=None):
+        monitors = {queue: make_monitor(queue) for queue in queues}
+        count = 0
+        for queue, timestamp, temp in stream_readings:
+            if duplicates is not None and duplicates.seen(queue, timestamp):
+                continue
+            count += len(monitors[queue].add(timestamp, temp))
+        return count
+
+    duplicates = DuplicateFilter()
+    print(f"{len(readings)} readings delivered {len(delivered)} times")
+    print(f"alerts without duplicates {alerts_for(readings)}, with them "
+          f"{alerts_for(delivered)}, filtered {alerts_for(delivered, duplicates)}")
+    print(duplicates.summary())
+
+    # a week of readings every 30 seconds on three streams, every 50th delivered twice
+    duplicates = DuplicateFilter()
+    tracemalloc.start()
+    start = readings[0][1]
+    for day in range(1, 8):
+        for timestamp in range(start + (day - 1) * 86400, start + day * 86400, 30):
+            for queue in queues:
+                duplicates.seen(queue, timestamp)
+                if (timestamp - start) % 1500 == 0:
+                    duplicates.seen(queue, timestamp)
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"day {day}: {len(duplicates)} timestamps held, {current / 1024:.1f} KiB "
+              f"(peak {peak / 1024:.1f} KiB), {duplicates.duplicates} duplicates dropped")
+    tracemalloc.stop()
@@ -0,0 +1,176 @@
+"""
+    Cook-completion ETA for the food probes.
+
+    EtaPredictor fits a straight line to the food temperature over the last
+    `window` seconds of event time and extrapolates when it will reach the
+    target (e.g. 203 F for pulled pork). The fit is a least-squares
+    regression kept as running sums (n, sum x, sum x^2, sum y, sum xy) in a
+    WindowedRegression: a reading entering or leaving the window adds or
+    subtracts its terms, so every update is O(1) whatever the window size.
+    x is seconds since the first reading, kept as Python ints so sum x and
+    sum x^2 are exact and the slope does not lose precision on long cooks.
+    sum y and sum xy are floats, so the fit is exact up to float rounding:
+    adding and subtracting them over an endless stream lets rounding errors
+    pile up, so they are summed again from the window every `resum_every`
+    readings that leave it.
+
+    An estimate is only formatted and returned every `every` seconds of
+    event time, and once when the target is reached, so a consumer can run
+    predictors for hundreds of probes without flooding its output.
+
+    Predictors come from "eta" rules in bbq_rules.json (see bbq_rules.py):
+        {"type": "eta", "target": 203, "window": 1800, "every": 300,
+         "message": "COOK ETA: {queue} ... {eta} ..."}
+    The message can use {target}, {temp}, {eta}, {remaining} and {rate}.
+    The lines are returned as Estimate, a str the consumers write like an
+    alert but count apart from the alerts (see bbq_metrics.py), so an ETA
+    line does not add to the alert count or the alert latency.
+
+"""
+
+from collections import deque
+
+from bbq_readings import format_time
+
+# Define the variables
+default_message = "COOK ETA: {queue} will reach {target:g} F around {eta} (in {remaining}, {rate:+.2f} F/min)"
+default_done_message = "COOK DONE! {queue} has reached {target:g} F"
+# readings needed in the window before estimating
+min_points = 10
+# slower than this (degrees per minute) counts as not rising, no ETA is given
+min_rate = 0.05
+# readings leaving a window between two re-sums of its float sums
+resum_every = 10_000
+
+
+class Estimate(str):
+    """An ETA line, written like an alert but counted with Metrics.estimated()."""
+
+    __slots__ = ()
+
+
+class WindowedRegression:
+    """
+    Least-squares line through the readings of the last `span` seconds, O(1)
+    per update (amortized, sum y and sum xy are re-summed every resum_every evictions).
+    """
+
+    __slots__ = ("span", "origin", "xs", "ys", "n", "sx", "sxx", "sy", "sxy", "evicted")
+
+    def __init__(self, span: int):
+        if span < 1:
+            raise ValueError("span must be at least 1 second")
+        self.span = span
+        self.origin = None
+        self.xs = deque()
+        self.ys = deque()
+        self.n = 0
+        self.sx = 0
+        self.sxx = 0
+        self.sy = 0.0
+        self.sxy = 0.0
+        # readings evicted since the float sums were last re-summed
+        self.evicted = 0
+
+    def add(self, timestamp: int, y: float):
+        if self.origin is None:
+            self.origin = timestamp
+        x = timestamp - self.origin
+        if self.xs and x < self.xs[-1]:
+            # out of order, keep the window sorted like EventTimeWindow does
+            return
+        self.xs.append(x)
+        self.ys.append(y)
+        self.n += 1
+        self.sx += x
+        self.sxx += x * x
+        self.sy += y
+        self.sxy += x * y
+
+        cutoff = x - self.span
+        xs, ys = self.xs, self.ys
+        while xs[0] <= cutoff:
+            old_x = xs.popleft()
+            old_y = ys.popleft()
+            self.n -= 1
+            self.sx -= old_x
+            self.sxx -= old_x * old_x
+            self.sy -= old_y
+            self.sxy -= old_x * old_y
+            self.evicted += 1
+        if self.evicted >= resum_every:
+            self.resum()
+
+    def resum(self):
+        """Sum y and xy again from the window, dropping the rounding errors the updates left."""
+        self.sy = float(sum(self.ys))
+        self.sxy = float(sum(x * y for x, y in zip(self.xs, self.ys)))
+        self.evicted = 0
+
+    def slope(self):
+        """Degrees per second, or None if the readings do not span any time."""
+        n = self.n
+        sxx = n * self.sxx - self.sx * self.sx
+        if n < 2 or sxx == 0:
+            return None
+        return (n * self.sxy - self.sx * self.sy) / sxx
+
+    def fitted(self, slope: float) -> float:
+        """The line's value at the newest reading."""
+        intercept = (self.sy - slope * self.sx) / self.n
+        return intercept + slope * self.xs[-1]
+
+    def __len__(self):
+        return self.n
+
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+
+class EtaPredictor:
+    """
+    Estimate when a stream reaches `target` degrees, at most once every `every` seconds.
+
+    add() returns the estimate message when one is due, else None.
+    """
+
+    __slots__ = ("target", "every", "message", "done_message", "regression", "next_time", "done")
+
+    def __init__(self, target: float, window: int = 1800, every: int = 300,
+                 message: str = default_message, done_message: str = default_done_message, queue: str = ""):
+        self.target = target
+        self.every = every
+        self.message = message.replace("{queue}", queue)
+        self.done_message = done_message.replace("{queue}", queue)
+        self.regression = WindowedRegression(window)
+        self.next_time = None
+        self.done = False
+
+    def add(self, timestamp: int, temp: float):
+        regression = self.regression
+        regression.add(timestamp, temp)
+        if self.done:
+            return None
+        if temp >= self.target:
+            self.done = True
+            return Estimate(self.done_message.format(target=self.target, temp=temp))
+        if self.next_time is not None and timestamp < self.next_time:
+            return None
+        if regression.n < min_points:
+            return None
+        slope = regression.slope()
+        if slope is None or slope * 60 < min_rate:
+            return None
+        self.next_time = timestamp + self.every
+        remaining = (self.target - regression.fitted(slope)) / slope
+        if remaining < 0:
+            remaining = 0
+        return Estimate(self.message.format(
+            target=self.target,
+            temp=temp,
+            eta=format_time(int(timestamp + remaining)),
+            remaining=format_duration(remaining),
+            rate=slope * 60,
+        ))
@@ -11,44 +11,145 @@
 import pika
 import sys
 import time
-from collections import deque
+from bbq_acks import AckBatcher
+from bbq_catchup import make_catchup
+from bbq_checkpoint import Checkpointer, checkpoint_every, checkpoint_interval, checkpoint_path
+from bbq_dedup import DuplicateFilter
+from bbq_eta import Estimate
+from bbq_history import make_history
+from bbq_metrics import ConsumerMetrics
+from bbq_output import make_output, received_line
+from bbq_profile import SamplingProfiler, StageTimers, install_signal_handlers
+from bbq_readings import decode_readings
+from bbq_streams import make_monitor
+from bbq_transport import connect
 
-#Declare Deque
-# 1 reading every 30 seconds
-# 10 min * 1 / 0.5 min
-# The 20 most recent readings
-foodA_deque = deque(maxlen=20)
+#Declare the stream monitor
+# The sensor does not report exactly every 30 seconds, so the monitor keeps an
+# event-time window keyed on the Time stamp in each message (10 minutes = 600 seconds)
+# and checks the alert rules for this queue (see bbq_rules.json)
+# readings may arrive up to this many seconds out of order
+allowed_lateness = 0
+foodA_monitor = make_monitor("02-food-A", allowed_lateness)
+# drop readings delivered more than once, by RabbitMQ redelivering them or the
+# producer replaying its file, remembering the last hour of timestamps (see bbq_dedup.py)
+duplicates = DuplicateFilter()
+# the window and the duplicate filter are saved to checkpoints/02-food-A.ckpt just before messages
+# are acked and restored on startup, so the rules do not need to warm up again
+# after a restart and a resent reading is still dropped
+checkpointer = Checkpointer(checkpoint_path("02-food-A"), {"02-food-A": foodA_monitor}, duplicates)
+
+# prefetch_count = Per consumer limit of unaknowledged messages
+# a larger prefetch keeps messages flowing while we work on the current one,
+# keep it at least ack_batch_size or the batches (and checkpoints) get smaller
+prefetch_count = checkpoint_every
+# ack every ack_batch_size messages with one basic_ack(multiple=True),
+# or ack_max_delay seconds after the oldest unacked message (1 = ack every message)
+# each ack waits for a checkpoint, so both follow the checkpoint cadence
+ack_batch_size = checkpoint_every
+ack_max_delay = checkpoint_interval
+# created in main() once the channel is open
+ack_batcher = None
+
+# readings and alerts are written by a background thread, so the callback never
+# waits on the terminal, set verbosity and the alert file / exchange in bbq_output.py
+output = make_output()
+
+# end-to-end latency, gaps and duplicates from the producer's x-sent-at / x-seq headers
+# a summary is printed every 10 seconds, set metrics_port to also serve
+# them as JSON on http://localhost:<metrics_port>/metrics
+metrics = ConsumerMetrics("02-food-A")
+metrics_port = None
+
+# per-stage timers for the callback (no-ops while off) and a sampling profiler,
+# toggle them at runtime with kill -USR2 / kill -USR1 <pid> (see bbq_profile.py)
+profile_stages = False
+stages = StageTimers(profile_stages)
+profiler = SamplingProfiler()
+
+# when the consumer falls behind (old x-sent-at stamps or a deep queue) it skips the
+# per-message logs and adds the readings in batches until it is current again,
+# batches are at most prefetch_count messages, set the limits in bbq_catchup.py
+
+# set history_dir in bbq_history.py to keep every reading in columnar segment files,
+# queried with bbq_history_query.py
+history = make_history()
+
+catchup = make_catchup(output, metrics, checkpointer.covered, prefetch_count,
+                       seen=duplicates.seen, history=history)
 
 # define a callback function to be called when a message is received
 def callback(ch, method, properties, body):
     """ Define behavior on getting a message."""
-    # Message is decoded from bytes to a string using decode()
-    print(f" [x] Received {body.decode()}")
-    reading_string=body.decode()
-    # Split the reading_string variable using the split() method
-    # Retrieve the second element (index 1) assigned to the 'temp' variable
+    # Decode the message into Time stamps (as epoch seconds) and 'temp' readings
+    # the content_type header says whether it is a text reading, a binary reading
+    # or a frame of many binary readings, which are all handled in one pass
+    # then add each reading to the window at the time it was taken
+    stages.start()
+    started = metrics.received("02-food-A", properties)
     try:
-        temp=reading_string.split(",")[1]
-        foodA_deque.append(float(temp))
-        # If there are elements in smoker_deque the code checks if the difference
-        # between the max and min values in the deque is greater than or equal to 15.
-        # If the condition is met, the code prints a message indicating that the smoker temp has decreased by 15 degrees or more
-        if len(foodA_deque)==20 and max(foodA_deque)-min(foodA_deque)<1:
-            print("FOOD STALL ALERT! Food A (Pulled Pork) temp has changed by 1 degree or less in 10 min")
-
-    # Acknowledge that the message has been processed and can be removed from the queue    
+        readings = decode_readings(properties, body)
+        stages.mark("decode")
+        # while catching up, queue the readings for the next batch, which acks them
+        if catchup.observe(properties):
+            catchup.defer(foodA_monitor, method, readings, started)
+            metrics.maybe_report()
+            return
+        # add any queued readings first so they stay in order
+        catchup.flush()
+        for timestamp, temp in readings:
+            # skip readings of a redelivered message that are already in the restored window
+            if method.redelivered and checkpointer.covered("02-food-A", timestamp):
+                continue
+            # skip readings that were delivered before
+            if duplicates.seen("02-food-A", timestamp):
+                continue
+            if history is not None:
+                history.append("02-food-A", timestamp, temp)
+            output.message(received_line, timestamp, temp)
+            stages.mark("print")
+            # add the reading to the window and check the alert rules
+            # the monitor returns the message of every rule that fires
+            if stages.enabled:
+                alerts = foodA_monitor.add_timed(timestamp, temp, stages.mark)
+            else:
+                alerts = foodA_monitor.add(timestamp, temp)
+            for alert in alerts:
+                output.alert(alert, "02-food-A", timestamp)
+                if isinstance(alert, Estimate):
+                    metrics.estimated()
+                else:
+                    metrics.alerted(started)
+            stages.mark("alert")
+
     except ValueError:
         pass
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    except Exception:
+        # ack the messages processed before this one, this one stays unacked
+        # and RabbitMQ delivers it again
+        if ack_batcher is not None:
+            ack_batcher.flush()
+        raise
+
+    # Acknowledge that the message (every reading in a frame) has been processed and can be removed from the queue
+    # with batched acks, several messages are acknowledged at once
+    if ack_batcher is not None:
+        ack_batcher.done(method.delivery_tag)
+    else:
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    stages.mark("ack")
+    metrics.maybe_report()
     
 
 # define a main function to run the program
 def main(hn: str = "localhost", qn: str = "task_queue"):
     """ Continuously listen for task messages on a named queue."""
+    global ack_batcher
 
     # when a statement can go wrong, use a try-except block
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=hn))
+        # RabbitMQ, or the in-process broker with transport = 'local' (see bbq_transport.py)
+        connection = connect(hn)
 
     # If there's an error:
     except Exception as e:
@@ -59,6 +160,13 @@ def main(hn: str = "localhost", qn: str = "task_queue"):
         print()
         sys.exit(1)
 
+    # restore the window saved by the last run
+    if checkpointer.restore():
+        print(f" [*] Restored the window from {checkpointer.path}")
+    if metrics_port:
+        metrics.serve(metrics_port)
+    install_signal_handlers(stages, profiler)
+
     try:
         # use the connection to create a communication channel
         channel = connection.channel()
@@ -69,8 +177,17 @@ def main(hn: str = "localhost", qn: str = "task_queue"):
         # messages will not be deleted until the consumer acknowledges
         channel.queue_declare(queue=qn, durable=True)
 
-        # prefetch_count = Per consumer limit of unaknowledged messages      
-        channel.basic_qos(prefetch_count=1) 
+        # prefetch_count = Per consumer limit of unaknowledged messages
+        channel.basic_qos(prefetch_count=prefetch_count)
+
+        # acknowledge processed messages in batches (see bbq_acks.py)
+        # checkpoint the window just before the processed messages are acked
+        ack_batcher = AckBatcher(channel, ack_batch_size, ack_max_delay, connection.call_later, checkpointer.save,
+                                 prefetch_count=prefetch_count)
+
+        # catch-up batches are acked by the same batcher, and the queue depth is checked every few seconds
+        catchup.attach(ack_batcher, connection.call_later)
+        catchup.watch_depth(channel, qn, connection.call_later)
 
         # configure the channel to listen on a specific queue,  
         # use the callback function named callback,
@@ -94,6 +211,20 @@ def main(hn: str = "localhost", qn: str = "task_queue"):
         print(" User interrupted continuous listening process.")
         sys.exit(0)
     finally:
+        # acknowledge every message that was processed before closing,
+        # messages that were not processed are delivered again
+        if ack_batcher is not None:
+            try:
+                catchup.flush()
+                ack_batcher.flush()
+                checkpointer.save()
+            except pika.exceptions.AMQPError:
+                ack_batcher.discard()
+        if history is not None:
+            history.close()
+        output.close()
+        print(metrics.summary())
+        print(duplicates.summary())
         print("\nClosing connection. Goodbye.\n")
         connection.close()
         
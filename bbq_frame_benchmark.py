@@ -0,0 +1,130 @@
+"""
+    Benchmark for micro-batch frames (many readings per AMQP message).
+
+    For each frame size the benchmark measures the CPU cost per reading of
+    the whole message path without a broker:
+        producer: pack the readings, marshal the AMQP Basic.Publish,
+                  content header and body frames with pika
+        consumer: decode the AMQP frames with pika and unpack the readings
+    Small frames pay the per-message AMQP cost for every reading, large
+    frames spread it out but a reading may wait for its frame to fill.
+
+    The table shows, for a target rate of readings per second on one queue:
+        capacity  = readings/sec one core can move at this frame size
+        wait avg / max = extra latency a reading spends waiting in a frame
+                  (capped by frame_max_delay)
+    The crossover is the smallest frame size whose capacity keeps up with
+    the target rate; anything larger only adds latency.
+
+    Usage:
+        python bbq_frame_benchmark.py [target_readings_per_sec] [frame_max_delay]
+
+"""
+
+import sys
+import time
+
+import pika
+from pika import frame as amqp_frame
+
+from bbq_readings import (
+    FrameBuffer,
+    binary_content_type,
+    decode_readings,
+    frame_content_type,
+    reading_struct,
+)
+
+# Define the variables
+frame_sizes = [1, 2, 5, 10, 20, 50, 100, 500, 1000]
+readings_per_run = 100_000
+default_target_rate = 20_000
+default_max_delay = 0.5
+queue = "01-smoker"
+
+
+def make_readings(count: int) -> list:
+    """Create (timestamp, sensor_id, temp) readings 5 seconds apart."""
+    start = 1621686015
+    return [(start + i * 5, 1, round(225 + (i % 50) * 0.1, 2)) for i in range(count)]
+
+
+def publish_frames(channel_number, body, properties) -> bytes:
+    """Marshal the three AMQP frames pika sends for one basic_publish."""
+    method = amqp_frame.Method(channel_number, pika.spec.Basic.Publish(exchange="", routing_key=queue))
+    header = amqp_frame.Header(channel_number, len(body), properties)
+    content = amqp_frame.Body(channel_number, body)
+    return method.marshal() + header.marshal() + content.marshal()
+
+
+def consume_frames(data: bytes):
+    """Decode the AMQP frames of one message and return (properties, body)."""
+    offset = 0
+    properties = None
+    body = b""
+    while offset < len(data):
+        consumed, decoded = amqp_frame.decode_frame(data[offset:])
+        offset += consumed
+        if isinstance(decoded, amqp_frame.Header):
+            properties = decoded.properties
+        elif isinstance(decoded, amqp_frame.Body):
+            body = decoded.fragment
+    return properties, body
+
+
+def run(frame_size: int, readings: list) -> float:
+    """Move every reading through the message path, return seconds per reading."""
+    if frame_size == 1:
+        properties = pika.BasicProperties(content_type=binary_content_type)
+    else:
+        properties = pika.BasicProperties(content_type=frame_content_type)
+    # max_delay is not used here, the benchmark measures full frames only
+    frame_buffer = FrameBuffer(frame_size, float("inf"))
+    received = 0
+
+    start = time.perf_counter()
+    for timestamp, sensor_id, temp in readings:
+        if frame_size == 1:
+            body = reading_struct.pack(timestamp, sensor_id, temp)
+        else:
+            body = frame_buffer.add(timestamp, sensor_id, temp)
+            if body is None:
+                continue
+        wire = publish_frames(1, body, properties)
+        decoded_properties, decoded_body = consume_frames(wire)
+        for timestamp, temp in decode_readings(decoded_properties, decoded_body):
+            received += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / max(received, 1)
+
+
+def main(target_rate: float = default_target_rate, max_delay: float = default_max_delay):
+    """Print the throughput and latency of every frame size."""
+    readings = make_readings(readings_per_run)
+    print(f"target rate: {target_rate:.0f} readings/sec, frame_max_delay: {max_delay}s")
+    print(f"{'frame':>6} {'us/reading':>11} {'capacity/s':>11} {'wait avg ms':>12} {'wait max ms':>12}")
+    crossover = None
+    for frame_size in frame_sizes:
+        seconds = run(frame_size, readings)
+        capacity = 1 / seconds
+        # a reading waits for the rest of its frame to arrive, at most max_delay
+        fill_time = (frame_size - 1) / target_rate
+        wait_max = min(fill_time, max_delay)
+        wait_avg = min(fill_time / 2, max_delay)
+        marker = ""
+        if crossover is None and capacity >= target_rate:
+            crossover = frame_size
+            marker = "  <- crossover"
+        print(f"{frame_size:>6} {seconds * 1e6:>11.2f} {capacity:>11.0f} "
+              f"{wait_avg * 1000:>12.2f} {wait_max * 1000:>12.2f}{marker}")
+    if crossover is None:
+        print("No frame size keeps up with the target rate on one core.")
+    else:
+        print(f"Frame size {crossover} is the smallest that keeps up, larger frames only add latency.")
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else default_target_rate
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else default_max_delay
+    main(target, delay)
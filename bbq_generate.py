@@ -0,0 +1,437 @@
+"""
+    Synthetic smoker data for stress testing, learned from smoker-temps.csv.
+
+    smoker-temps.csv is one cook, about 2,500 rows. This generator writes as
+    many smokers and hours as you ask for, each smoker a cook with a smoker
+    channel and two food probes that look like the sample:
+        * the time between readings of a channel and the change from one
+          reading to the next are drawn together, as (gap, change) pairs,
+          from the sample, so the 5 second repeats, the ~1 minute cadence and
+          the noise all carry over
+        * the smoker is pulled back towards its setpoint (the sample's,
+          give or take setpoint_spread) at the rate fitted to the sample, so
+          it warms up and then holds temperature
+        * each probe rises at the sample's average rate (give or take
+          rate_spread) and levels off food_margin below its smoker
+    Events are injected with known ground truth:
+        smoker-drop  the smoker falls drop_size degrees over drop_seconds
+                     (a lid left open, the fire dying) and recovers
+        food-stall   a probe holds within stall_noise of stall_temp for
+                     stall_seconds when it gets there (evaporative cooling)
+    and listed in an events CSV (kind, stream, sensor_id, start, end,
+    magnitude), so alert rules can be scored against them (see check below).
+
+    Streams are named like the keyed routing keys, smoker-7.smoker,
+    smoker-7.food-A, ..., with binary sensor ids 3 * (n - 1) + 1, 2, 3, so
+    smoker-1 uses the ids of the single-smoker queues.
+
+    Output is written slice by slice (slice_seconds of event time), so
+    memory stays bounded however much is generated:
+        csv     a directory with one smoker-NNNN.csv per smoker, in the
+                Time (UTC),Channel1,Channel2,Channel3 layout the producer
+                reads (set data_file in bbq_producer.py to one of them)
+        binary  one file of back-to-back 14 byte application/x-bbq-reading
+                records for every smoker, in time order, ready to be sliced
+                into frames or read with numpy.fromfile(path, reading_dtype)
+    Each smoker has its own random generator seeded from the seed and its
+    number, so both layouts hold the same readings.
+
+    Needs NumPy.
+
+    Usage:
+        python bbq_generate.py csv [smokers] [hours] [out_dir] [seed]
+        python bbq_generate.py binary [smokers] [hours] [out_file] [seed]
+        python bbq_generate.py check [smokers] [hours] [seed]
+    check generates binary data into a scratch directory, runs it through
+    the alert rules and reports how many injected events raised an alert.
+
+"""
+
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+from bbq_ingest import reading_dtype
+from bbq_readings import format_time, parse_time
+
+# Define the variables
+source_file = "smoker-temps.csv"
+channel_names = ("smoker", "food-A", "food-B")
+# the first cook starts at the sample's first reading, the others up to start_spread seconds later
+start_spread = 3600
+# event time generated and written at a time
+slice_seconds = 900
+# each smoker's setpoint is the learned one plus normal noise of this many degrees
+setpoint_spread = 15.0
+# each probe heats up to this fraction faster or slower than the sample
+rate_spread = 0.3
+# a probe levels off this many degrees below its smoker's setpoint
+food_margin = 10.0
+# smoker drops per cook (Poisson), none in the first drop_after seconds
+drops_per_cook = 1.0
+drop_after = 3600
+drop_size = (20.0, 40.0)
+drop_seconds = (30, 120)
+recover_seconds = (300, 900)
+# share of probes that stall, at what temperature and for how long
+stall_probability = 0.7
+stall_temp = (150.0, 170.0)
+stall_seconds = (1200, 3600)
+stall_noise = 0.2
+# (gap, change) pairs whose unexplained change is outside these percentiles are left out
+noise_percentiles = (1, 99)
+# random draws made at a time per channel
+draw_batch = 256
+
+events_header = ["kind", "stream", "sensor_id", "start_time", "end_time", "magnitude"]
+
+
+class ChannelModel:
+    """
+    One channel of the sample cook.
+
+    Parameters:
+        gaps: seconds between consecutive readings
+        noise: change between the same readings that the trend does not explain
+        first_delay (int): seconds from the start of the cook to the first reading
+        first_value (float): the first reading
+        trend (float): smoker, share of the distance to the setpoint closed
+                       per reading; probes, degrees per second
+        setpoint (float): smoker only, the temperature it holds
+    """
+
+    __slots__ = ("gaps", "noise", "first_delay", "first_value", "trend", "setpoint")
+
+    def __init__(self, gaps, noise, first_delay, first_value, trend, setpoint=None):
+        self.gaps = gaps
+        self.noise = noise
+        self.first_delay = first_delay
+        self.first_value = first_value
+        self.trend = trend
+        self.setpoint = setpoint
+
+
+def learn(path: str = source_file):
+    """Fit a ChannelModel to each channel of a smoker CSV, returns (start time, [models])."""
+    columns = ([], [], [])
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        start = None
+        for row in reader:
+            timestamp = parse_time(row[0])
+            if start is None:
+                start = timestamp
+            for values, value in zip(columns, row[1:]):
+                if value.strip():
+                    values.append((timestamp, float(value)))
+
+    models = []
+    for index, readings in enumerate(columns):
+        times = np.array([t for t, v in readings], dtype=np.int64)
+        temps = np.array([v for t, v in readings])
+        gaps = np.diff(times)
+        changes = np.diff(temps)
+        if index == 0:
+            # changes = trend * (setpoint - temp) + noise, least squares for trend
+            setpoint = float(np.median(temps[len(temps) // 5:]))
+            distance = setpoint - temps[:-1]
+            trend = float(np.dot(changes, distance) / np.dot(distance, distance))
+            noise = changes - trend * distance
+        else:
+            setpoint = None
+            trend = float(changes.sum() / gaps.sum())
+            noise = changes - trend * gaps
+        # the sample's own drops and probe moves are outliers here, events are injected instead
+        low, high = np.percentile(noise, noise_percentiles)
+        keep = (noise >= low) & (noise <= high)
+        models.append(ChannelModel(gaps[keep], noise[keep], int(times[0] - start), float(temps[0]), trend, setpoint))
+    return start, models
+
+
+class SyntheticSmoker:
+    """
+    One generated cook: a smoker channel and two probes.
+
+    slice(end) returns the readings before `end` that have not been returned
+    yet as (times, sensor ids, temps) arrays, and adds the events that
+    started in them to self.events.
+    """
+
+    def __init__(self, number: int, models: list, start: int, hours: float, seed: int = 0):
+        rng = self.rng = np.random.default_rng([seed, number])
+        self.number = number
+        self.models = models
+        self.start = start + int(rng.integers(0, start_spread // 5 + 1)) * 5
+        self.end = self.start + int(hours * 3600)
+        self.streams = [f"smoker-{number}.{name}" for name in channel_names]
+        self.sensor_ids = [3 * (number - 1) + index + 1 for index in range(3)]
+        self.events = []
+
+        smoker = models[0]
+        self.setpoint = smoker.setpoint + rng.normal(0.0, setpoint_spread)
+        self.next_time = [self.start + model.first_delay for model in models]
+        self.value = [model.first_value for model in models]
+        self.rates = [None] + [model.trend * (1 + rng.uniform(-rate_spread, rate_spread)) for model in models[1:]]
+        # each channel draws from its own generator, so how the cook is sliced does not change it
+        self.channel_rngs = [np.random.default_rng([seed, number, channel]) for channel in range(3)]
+        self.draws = [None, None, None]
+        self.drawn = [draw_batch] * 3
+
+        # smoker drops are planned up front: (start, bottom, recovered, size)
+        self.drops = []
+        for _ in range(rng.poisson(drops_per_cook)):
+            begin = int(rng.integers(self.start + drop_after, max(self.end, self.start + drop_after + 1)))
+            down = int(rng.integers(drop_seconds[0], drop_seconds[1] + 1))
+            up = int(rng.integers(recover_seconds[0], recover_seconds[1] + 1))
+            size = float(rng.uniform(*drop_size))
+            self.drops.append((begin, begin + down, begin + down + up, size))
+            self.events.append(("smoker-drop", self.streams[0], self.sensor_ids[0], begin, begin + down, round(size, 1)))
+        # probe stalls start when the probe reaches the stall temperature
+        self.stalls = [None]
+        for _ in models[1:]:
+            if rng.random() < stall_probability:
+                self.stalls.append([float(rng.uniform(*stall_temp)), int(rng.integers(stall_seconds[0], stall_seconds[1] + 1)), None])
+            else:
+                self.stalls.append(None)
+
+    def _draw(self, channel: int) -> int:
+        """Index of the next (gap, noise) pair to use for a channel."""
+        if self.drawn[channel] == draw_batch:
+            self.draws[channel] = self.channel_rngs[channel].integers(0, len(self.models[channel].gaps), draw_batch).tolist()
+            self.drawn[channel] = 0
+        index = self.draws[channel][self.drawn[channel]]
+        self.drawn[channel] += 1
+        return index
+
+    def _drop_offset(self, timestamp: int) -> float:
+        offset = 0.0
+        for begin, bottom, recovered, size in self.drops:
+            if begin <= timestamp < bottom:
+                offset -= size * (timestamp - begin) / (bottom - begin)
+            elif bottom <= timestamp < recovered:
+                offset -= size * (recovered - timestamp) / (recovered - bottom)
+        return offset
+
+    def slice(self, end: int):
+        end = min(end, self.end)
+        times, ids, temps = [], [], []
+        # smoker: pulled towards its setpoint, plus any drop in progress
+        smoker = self.models[0]
+        timestamp, value = self.next_time[0], self.value[0]
+        sensor_id = self.sensor_ids[0]
+        while timestamp < end:
+            reading = value + self._drop_offset(timestamp) if self.drops else value
+            times.append(timestamp)
+            ids.append(sensor_id)
+            temps.append(round(reading, 1))
+            index = self._draw(0)
+            value += smoker.trend * (self.setpoint - value) + smoker.noise[index]
+            timestamp += int(smoker.gaps[index])
+        self.next_time[0], self.value[0] = timestamp, value
+
+        # probes: rise at their rate until food_margin below the setpoint, or stall
+        ceiling = self.setpoint - food_margin
+        for channel in (1, 2):
+            model = self.models[channel]
+            rate = self.rates[channel]
+            stall = self.stalls[channel]
+            timestamp, value = self.next_time[channel], self.value[channel]
+            sensor_id = self.sensor_ids[channel]
+            while timestamp < end:
+                if stall is not None and stall[2] is None and value >= stall[0]:
+                    # the stall starts now and lasts stall[1] seconds
+                    stall[2] = timestamp + stall[1]
+                    value = stall[0]
+                    self.events.append(("food-stall", self.streams[channel], sensor_id, timestamp, stall[2], round(stall[0], 1)))
+                stalled = stall is not None and stall[2] is not None and timestamp < stall[2]
+                if stalled:
+                    reading = value + self.channel_rngs[channel].uniform(-stall_noise, stall_noise)
+                else:
+                    reading = value
+                times.append(timestamp)
+                ids.append(sensor_id)
+                temps.append(round(reading, 1))
+                index = self._draw(channel)
+                gap = int(model.gaps[index])
+                if not stalled:
+                    value = min(value + rate * gap + model.noise[index], ceiling)
+                timestamp += gap
+            self.next_time[channel], self.value[channel] = timestamp, value
+        return times, ids, temps
+
+    @property
+    def done(self) -> bool:
+        return min(self.next_time) >= self.end
+
+
+def write_events(writer, smoker: SyntheticSmoker) -> int:
+    """Write and forget the events the smoker has recorded, returns how many."""
+    count = len(smoker.events)
+    for kind, stream, sensor_id, start, end, magnitude in smoker.events:
+        writer.writerow([kind, stream, sensor_id, format_time(start), format_time(end), magnitude])
+    smoker.events.clear()
+    return count
+
+
+def generate_csv(directory: str, smokers: int, hours: float, seed: int = 0, source: str = source_file):
+    """Write one CSV per smoker plus events.csv into `directory`, returns (rows, readings, events)."""
+    start, models = learn(source)
+    os.makedirs(directory, exist_ok=True)
+    width = len(str(smokers))
+    rows = readings = events = 0
+    with open(os.path.join(directory, "events.csv"), "w", newline="") as events_file:
+        events_writer = csv.writer(events_file)
+        events_writer.writerow(events_header)
+        for number in range(1, smokers + 1):
+            smoker = SyntheticSmoker(number, models, start, hours, seed)
+            path = os.path.join(directory, f"smoker-{number:0{width}d}.csv")
+            with open(path, "w") as file:
+                file.write("Time (UTC),Channel1,Channel2,Channel3\n")
+                edge = smoker.start
+                while not smoker.done:
+                    edge += slice_seconds
+                    times, ids, temps = smoker.slice(edge)
+                    readings += len(times)
+                    # one row per timestamp, a column per channel, empty where it did not report
+                    order = sorted(range(len(times)), key=times.__getitem__)
+                    lines = []
+                    row_time, cells = None, None
+                    first_id = smoker.sensor_ids[0]
+                    for i in order:
+                        if times[i] != row_time:
+                            if cells is not None:
+                                lines.append(f"{format_time(row_time)},{cells[0]},{cells[1]},{cells[2]}\n")
+                            row_time, cells = times[i], ["", "", ""]
+                        cells[ids[i] - first_id] = temps[i]
+                    if cells is not None:
+                        lines.append(f"{format_time(row_time)},{cells[0]},{cells[1]},{cells[2]}\n")
+                    rows += len(lines)
+                    file.writelines(lines)
+            events += write_events(events_writer, smoker)
+    return rows, readings, events
+
+
+def generate_binary(path: str, smokers: int, hours: float, seed: int = 0, source: str = source_file,
+                    events_path: str = None):
+    """
+    Write every smoker's readings to one binary file in time order and the
+    events to `events_path` (path + ".events.csv" by default), returns (readings, events).
+    """
+    start, models = learn(source)
+    events_path = events_path or path + ".events.csv"
+    cooks = [SyntheticSmoker(number, models, start, hours, seed) for number in range(1, smokers + 1)]
+    readings = events = 0
+    edge = start
+    with open(path, "wb") as file, open(events_path, "w", newline="") as events_file:
+        events_writer = csv.writer(events_file)
+        events_writer.writerow(events_header)
+        while cooks:
+            edge += slice_seconds
+            times, ids, temps = [], [], []
+            for smoker in cooks:
+                t, i, v = smoker.slice(edge)
+                times.extend(t)
+                ids.extend(i)
+                temps.extend(v)
+                events += write_events(events_writer, smoker)
+            cooks = [smoker for smoker in cooks if not smoker.done]
+            if not times:
+                continue
+            records = np.empty(len(times), dtype=reading_dtype)
+            records["time"] = times
+            records["sensor_id"] = ids
+            records["temp"] = temps
+            # every reading in this slice is before the next slice's, so sorting the slice sorts the file
+            records = records[np.argsort(records["time"], kind="stable")]
+            file.write(records.tobytes())
+            readings += len(records)
+    return readings, events
+
+
+def read_events(path: str) -> list:
+    """Read an events CSV, returns (kind, stream, start, end, magnitude) tuples with epoch times."""
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        return [(kind, stream, parse_time(start), parse_time(end), float(magnitude))
+                for kind, stream, sensor_id, start, end, magnitude in reader]
+
+
+def check(smokers: int = 50, hours: float = 12, seed: int = 0, chunk_records: int = 1_000_000):
+    """
+    Generate binary data, run it through the default alert rules one stream
+    per key (like bbq_keyed_consumer.py) and print how many injected events
+    raised their alert:
+        smoker-drop  a smoker alert between the start of the drop and 150 s after it bottoms out
+        food-stall   a stall alert while the stall lasts
+    """
+    import tempfile
+
+    from bbq_streams import KeyedMonitors
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.bin")
+        started = time.perf_counter()
+        readings, events = generate_binary(path, smokers, hours, seed)
+        seconds = time.perf_counter() - started
+        print(f"generated {readings} readings and {events} events for {smokers} smokers in {seconds:.1f} s "
+              f"({readings / seconds:.0f} readings/sec, {os.path.getsize(path) / 2**20:.1f} MiB)")
+
+        streams = {}
+        for number in range(1, smokers + 1):
+            for index, name in enumerate(channel_names):
+                streams[3 * (number - 1) + index + 1] = f"smoker-{number}.{name}"
+        monitors = KeyedMonitors()
+        alerts = {}
+        records = np.memmap(path, dtype=reading_dtype, mode="r")
+        for first in range(0, len(records), chunk_records):
+            chunk = records[first:first + chunk_records]
+            for timestamp, sensor_id, temp in zip(chunk["time"].tolist(), chunk["sensor_id"].tolist(),
+                                                  chunk["temp"].tolist()):
+                stream = streams[sensor_id]
+                for message in monitors.get(stream).add(timestamp, round(temp, 1)):
+                    kind = "smoker-drop" if "SMOKER" in message else "food-stall" if "STALL" in message else None
+                    if kind is not None:
+                        alerts.setdefault((kind, stream), []).append(timestamp)
+        del records
+
+        found = {"smoker-drop": [0, 0], "food-stall": [0, 0]}
+        for kind, stream, start, end, magnitude in read_events(path + ".events.csv"):
+            limit = end + 150 if kind == "smoker-drop" else end
+            times = alerts.get((kind, stream), ())
+            found[kind][1] += 1
+            if any(start <= t <= limit for t in times):
+                found[kind][0] += 1
+        for kind, (hit, total) in found.items():
+            share = hit / total if total else 1.0
+            print(f"{kind:>12}: {hit} of {total} injected events raised an alert ({share:.0%})")
+        raised = sum(len(times) for times in alerts.values())
+        print(f"{raised} drop and stall alerts in total")
+        return found
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    layout = sys.argv[1] if len(sys.argv) > 1 else "csv"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    length = float(sys.argv[3]) if len(sys.argv) > 3 else 12
+    if layout == "check":
+        check(count, length, int(sys.argv[4]) if len(sys.argv) > 4 else 0)
+        sys.exit(0)
+    out = sys.argv[4] if len(sys.argv) > 4 else ("synthetic" if layout == "csv" else "synthetic.bin")
+    seed_value = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    began = time.perf_counter()
+    if layout == "csv":
+        total_rows, total_readings, total_events = generate_csv(out, count, length, seed_value)
+        print(f"wrote {total_rows} rows ({total_readings} readings) for {count} smokers to {out}/")
+    elif layout == "binary":
+        total_readings, total_events = generate_binary(out, count, length, seed_value)
+        print(f"wrote {total_readings} readings for {count} smokers to {out}")
+    else:
+        print(f"unknown layout {layout!r}, use csv, binary or check")
+        sys.exit(1)
+    print(f"{total_events} injected events, {time.perf_counter() - began:.1f} s")
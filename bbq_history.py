@@ -0,0 +1,349 @@
+"""
+    Persistent, columnar history of the readings the consumers have processed.
+
+    Once a reading is acked it only lives on in the windows for a few
+    minutes. With history_dir set, the consumers also append every reading
+    to a small column store, one directory per stream:
+        history/<stream>/000001.times   int64 epoch seconds, little-endian
+        history/<stream>/000001.temps   float32 degrees F, little-endian
+        history/<stream>/index          one line per sealed segment:
+                                        number, first time, last time, count, codec
+    A segment is two append-only files, one value per reading at the same
+    position in each, so reading a time range never parses text: the query
+    side (bbq_history_query.py) memory-maps the columns and binary-searches
+    the times.
+
+    The consumer callback never touches the files: HistoryWriter.append()
+    only adds the reading to a deque, like bbq_output.Output. A background
+    writer thread moves the waiting readings into two arrays per stream and
+    appends them to the open segment every flush_interval seconds (sooner
+    once flush_readings are waiting), and on close(). Sealing, with its
+    sort, compression and fsync, runs in that thread too. A crash loses at
+    most the readings still waiting; a segment cut short mid-write is
+    trimmed to its complete readings when the writer starts again.
+
+    The open segment is sealed once it holds segment_readings readings or
+    spans segment_seconds: its readings are sorted by time (readings can
+    arrive up to the allowed lateness out of order) and it is listed in the
+    index with its first and last time, so queries skip segments outside
+    their range. With compress_sealed, a sealed segment is rewritten as one
+    zlib file (000001.z) holding the time deltas and the temps, several
+    times smaller; the query side decompresses it when it is read.
+
+    Only the standard library is needed to write history, NumPy only to
+    query it.
+
+"""
+
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import deque, namedtuple
+
+# Define the variables
+# set to a directory to keep the history of every reading, e.g. "history"
+history_dir = None
+# seal the open segment once it holds this many readings or spans this many seconds
+segment_readings = 65536
+segment_seconds = 6 * 3600
+# rewrite sealed segments as zlib files
+compress_sealed = True
+# the writer thread appends the waiting readings every flush_interval seconds,
+# or as soon as flush_readings are waiting
+flush_readings = 1000
+flush_interval = 1.0
+
+# a sealed segment, as listed in a stream's index file
+Segment = namedtuple("Segment", ["number", "first", "last", "count", "codec"])
+
+# compressed segment header: magic, version, readings, bytes of compressed times
+zlib_header = struct.Struct("<4sBII")
+zlib_magic = b"BBQH"
+
+
+def stream_path(directory: str, stream: str) -> str:
+    """The directory holding a stream's segments, e.g. history/01-smoker."""
+    return os.path.join(directory, re.sub(r"[^\w.-]", "_", stream))
+
+
+def segment_path(path: str, number: int, suffix: str) -> str:
+    return os.path.join(path, f"{number:06d}{suffix}")
+
+
+def read_index(path: str) -> list:
+    """The sealed segments of a stream directory, oldest first."""
+    try:
+        with open(os.path.join(path, "index"), "r") as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return []
+    segments = []
+    for line in lines:
+        fields = line.split()
+        # a line cut short by a crash is ignored, the segment is sealed again
+        if len(fields) == 5:
+            number, first, last, count, codec = fields
+            segments.append(Segment(int(number), int(first), int(last), int(count), codec))
+    return segments
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pack_zlib_segment(times: array, temps: array) -> bytes:
+    """A compressed segment: zlib of the time deltas (int64) and of the temps (float32)."""
+    deltas = array("q", times)
+    for i in range(len(deltas) - 1, 0, -1):
+        deltas[i] -= deltas[i - 1]
+    packed_times = zlib.compress(_little_endian(deltas).tobytes(), 6)
+    packed_temps = zlib.compress(_little_endian(temps).tobytes(), 6)
+    return zlib_header.pack(zlib_magic, 1, len(times), len(packed_times)) + packed_times + packed_temps
+
+
+class StreamHistory:
+    """The open segment of one stream and its readings waiting to be written."""
+
+    __slots__ = ("path", "number", "first", "last", "count", "times", "temps")
+
+    def __init__(self, path: str):
+        self.path = path
+        # the open segment, its first and newest time and readings on disk
+        self.number = 1
+        self.first = None
+        self.last = None
+        self.count = 0
+        # readings not written yet
+        self.times = array("q")
+        self.temps = array("f")
+
+
+class HistoryWriter:
+    """
+    Append the readings of any number of streams to segment files.
+
+    Parameters:
+        directory (str): the history directory, one subdirectory per stream
+        segment_readings (int), segment_seconds (int): when to seal a segment
+        compress (bool): rewrite sealed segments as zlib files
+
+    In the callback, for every reading added:
+        history.append(stream, timestamp, temp)
+    and history.close() on shutdown. Everything else runs in the writer
+    thread, which starts with the first reading.
+    """
+
+    def __init__(self, directory: str, segment_readings: int = segment_readings,
+                 segment_seconds: int = segment_seconds, compress: bool = compress_sealed,
+                 flush_readings: int = flush_readings, flush_interval: float = flush_interval):
+        self.directory = directory
+        self.segment_readings = segment_readings
+        self.segment_seconds = segment_seconds
+        self.compress = compress
+        self.flush_readings = flush_readings
+        self.flush_interval = flush_interval
+        # (stream, timestamp, temp) readings waiting for the writer thread
+        self.pending = deque()
+        # stream name -> StreamHistory, only used by the writer thread
+        self.streams = {}
+        self.sealed = 0
+        # the first error the writer thread hit, readings are dropped after it
+        self.error = None
+        self.dropped = 0
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def append(self, stream: str, timestamp: int, temp: float):
+        """Queue a reading for the writer thread, never waits on the disk."""
+        if self.error is not None:
+            self.dropped += 1
+            return
+        if self.thread is None:
+            self._start()
+        pending = self.pending
+        pending.append((stream, timestamp, temp))
+        if len(pending) >= self.flush_readings and not self.wake.is_set():
+            self.wake.set()
+
+    def extend(self, stream: str, readings):
+        """Queue a batch of (timestamp, temp) readings."""
+        for timestamp, temp in readings:
+            self.append(stream, timestamp, temp)
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self._run, name="bbq-history", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stopping.is_set():
+                self.wake.wait(self.flush_interval)
+                self.wake.clear()
+                self._drain()
+                self.flush()
+            self._drain()
+            self.flush()
+        except Exception as e:
+            # e.g. a full disk, stop writing rather than fail every callback
+            self.error = e
+            sys.stderr.write(f" [!] History writer failed, no more readings are kept: {e}\n")
+
+    def _drain(self):
+        """Move the waiting readings into their streams' arrays (runs in the writer thread)."""
+        pending = self.pending
+        streams = self.streams
+        while pending:
+            stream, timestamp, temp = pending.popleft()
+            history = streams.get(stream)
+            if history is None:
+                history = streams[stream] = self._open(stream)
+            history.times.append(timestamp)
+            history.temps.append(temp)
+
+    def _open(self, stream: str) -> StreamHistory:
+        """Pick up where the last run left the stream's directory."""
+        path = stream_path(self.directory, stream)
+        os.makedirs(path, exist_ok=True)
+        history = StreamHistory(path)
+        index_file = os.path.join(path, "index")
+        if os.path.exists(index_file):
+            with open(index_file, "rb") as file:
+                index = file.read()
+            if index and not index.endswith(b"\n"):
+                # a line cut short by a crash, its segment is sealed again
+                os.truncate(index_file, index.rfind(b"\n") + 1)
+        sealed = read_index(path)
+        if sealed:
+            history.number = sealed[-1].number + 1
+            # raw files left behind by a crash after their zlib file was indexed
+            for segment in sealed:
+                if segment.codec == "zlib":
+                    for suffix in (".times", ".temps"):
+                        if os.path.exists(segment_path(path, segment.number, suffix)):
+                            os.remove(segment_path(path, segment.number, suffix))
+        times_file = segment_path(path, history.number, ".times")
+        temps_file = segment_path(path, history.number, ".temps")
+        if os.path.exists(temps_file + ".tmp"):
+            if os.path.exists(times_file + ".tmp"):
+                # a crash before the sorted columns replaced the open segment
+                os.remove(times_file + ".tmp")
+                os.remove(temps_file + ".tmp")
+            else:
+                # a crash between replacing the two columns, finish the second
+                os.replace(temps_file + ".tmp", temps_file)
+        columns = ((times_file, 8), (temps_file, 4))
+        if any(os.path.exists(file_name) for file_name, _ in columns):
+            # keep only the readings written to both columns
+            count = min(os.path.getsize(file_name) // size if os.path.exists(file_name) else 0
+                        for file_name, size in columns)
+            for file_name, size in columns:
+                if os.path.exists(file_name):
+                    os.truncate(file_name, count * size)
+            if count:
+                with open(times_file, "rb") as file:
+                    times = _from_little_endian("q", file.read())
+                history.first, history.last, history.count = times[0], max(times), count
+        return history
+
+    def flush(self):
+        """Append every drained reading to its stream's open segment (runs in the writer thread)."""
+        for history in self.streams.values():
+            if not history.times:
+                continue
+            with open(segment_path(history.path, history.number, ".times"), "ab") as file:
+                file.write(_little_endian(history.times).tobytes())
+            with open(segment_path(history.path, history.number, ".temps"), "ab") as file:
+                file.write(_little_endian(history.temps).tobytes())
+            if history.first is None:
+                history.first = history.times[0]
+            newest = max(history.times)
+            if history.last is None or newest > history.last:
+                history.last = newest
+            history.count += len(history.times)
+            del history.times[:]
+            del history.temps[:]
+            if history.count >= self.segment_readings or history.last - history.first >= self.segment_seconds:
+                self._seal(history)
+
+    def _seal(self, history: StreamHistory):
+        """Sort the open segment, compress it if asked to, list it in the index and start a new one."""
+        path, number = history.path, history.number
+        times_file = segment_path(path, number, ".times")
+        temps_file = segment_path(path, number, ".temps")
+        with open(times_file, "rb") as file:
+            times = _from_little_endian("q", file.read())
+        with open(temps_file, "rb") as file:
+            temps = _from_little_endian("f", file.read())
+        reorder = any(times[i] > times[i + 1] for i in range(len(times) - 1))
+        if reorder:
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times = array("q", [times[i] for i in order])
+            temps = array("f", [temps[i] for i in order])
+        if self.compress:
+            codec = "zlib"
+            self._write(segment_path(path, number, ".z.tmp"), pack_zlib_segment(times, temps))
+            os.replace(segment_path(path, number, ".z.tmp"), segment_path(path, number, ".z"))
+        else:
+            codec = "raw"
+            if reorder:
+                # both sorted columns are written before either replaces the old one
+                self._write(times_file + ".tmp", _little_endian(times).tobytes())
+                self._write(temps_file + ".tmp", _little_endian(temps).tobytes())
+                os.replace(times_file + ".tmp", times_file)
+                os.replace(temps_file + ".tmp", temps_file)
+        # the segment only counts as sealed once its index line is written
+        with open(os.path.join(path, "index"), "a") as file:
+            file.write(f"{number:06d} {times[0]} {times[-1]} {len(times)} {codec}\n")
+        if self.compress:
+            os.remove(times_file)
+            os.remove(temps_file)
+        history.number += 1
+        history.first = history.last = None
+        history.count = 0
+        self.sealed += 1
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        with open(path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def close(self):
+        """Write everything waiting and stop the writer, the open segments are picked up again next time."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            self.dropped += len(self.pending)
+            self.pending.clear()
+            sys.stderr.write(f" [!] {self.dropped} readings were not kept in the history\n")
+
+
+def make_history():
+    """A HistoryWriter for history_dir, or None if history is off."""
+    if not history_dir:
+        return None
+    return HistoryWriter(history_dir)
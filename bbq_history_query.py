@@ -0,0 +1,255 @@
+"""
+    Range and downsampled queries over the history written by the consumers.
+
+    HistoryReader answers questions like "smoker temps 14:00-16:00 at
+    1-minute resolution" straight from the segment files of bbq_history.py:
+        * the index lists every sealed segment with its first and last time,
+          segments outside the range are never opened
+        * raw segments (sealed or still open) are memory-mapped with
+          numpy.memmap and the range is found with a binary search of the
+          times, so only the pages holding the range are read from disk
+        * zlib segments are decompressed once and kept in a small cache
+    downsample() then groups the readings into `step` second buckets in a
+    few vectorized passes (mean, min, max and count of every bucket).
+
+    Usage:
+        python bbq_history_query.py load csv_file [history_dir]
+            append a smoker CSV export to the history, one stream per channel
+        python bbq_history_query.py query stream start end [step] [history_dir]
+            print the readings, or `step` second buckets, e.g.
+            python bbq_history_query.py query 01-smoker "05/22/21 14:00:00" "05/22/21 16:00:00" 60
+        python bbq_history_query.py check [days]
+            write `days` of one-second readings to a temporary history and
+            time queries against them
+
+"""
+
+import os
+import sys
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import bbq_history
+from bbq_history import read_index, segment_path, stream_path, zlib_header, zlib_magic
+
+# Define the variables
+# decompressed zlib segments kept in memory
+cache_segments = 8
+
+# downsample() result, one entry per bucket that holds readings
+Buckets = namedtuple("Buckets", ["time", "mean", "min", "max", "count"])
+
+
+class HistoryReader:
+    """Query the history directory written by HistoryWriter."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or bbq_history.history_dir or "history"
+        # (path, size, modified) -> (times, temps) of decompressed segments
+        self.cache = OrderedDict()
+
+    def streams(self) -> list:
+        """The streams that have history."""
+        try:
+            return sorted(name for name in os.listdir(self.directory)
+                          if os.path.isdir(os.path.join(self.directory, name)))
+        except FileNotFoundError:
+            return []
+
+    def _columns(self, path: str, segment) -> tuple:
+        """(times, temps) of a sealed segment."""
+        if segment.codec == "zlib":
+            return self._decompress(segment_path(path, segment.number, ".z"))
+        return self._map(path, segment.number)
+
+    def _map(self, path: str, number: int) -> tuple:
+        """Memory-map the columns of a raw segment, None if it is empty."""
+        times_file = segment_path(path, number, ".times")
+        temps_file = segment_path(path, number, ".temps")
+        try:
+            # the open segment may be half way through an append
+            count = min(os.path.getsize(times_file) // 8, os.path.getsize(temps_file) // 4)
+        except FileNotFoundError:
+            return None
+        if count == 0:
+            return None
+        times = np.memmap(times_file, dtype="<i8", mode="r", shape=(count,))
+        temps = np.memmap(temps_file, dtype="<f4", mode="r", shape=(count,))
+        return times, temps
+
+    def _decompress(self, file_name: str) -> tuple:
+        stat = os.stat(file_name)
+        key = (file_name, stat.st_size, stat.st_mtime_ns)
+        columns = self.cache.get(key)
+        if columns is not None:
+            self.cache.move_to_end(key)
+            return columns
+        with open(file_name, "rb") as file:
+            data = file.read()
+        magic, version, count, times_length = zlib_header.unpack_from(data)
+        if magic != zlib_magic or version != 1:
+            raise ValueError(f"{file_name} is not a history segment")
+        start = zlib_header.size
+        deltas = np.frombuffer(zlib.decompress(data[start:start + times_length]), dtype="<i8")
+        times = np.cumsum(deltas)
+        temps = np.frombuffer(zlib.decompress(data[start + times_length:]), dtype="<f4")
+        columns = self.cache[key] = (times[:count], temps[:count])
+        if len(self.cache) > cache_segments:
+            self.cache.popitem(last=False)
+        return columns
+
+    def read(self, stream: str, start: int, end: int) -> tuple:
+        """(times, temps) arrays of the readings with start <= time < end, in time order."""
+        path = stream_path(self.directory, stream)
+        sealed = read_index(path)
+        parts = []
+        for segment in sealed:
+            if segment.last < start or segment.first >= end:
+                continue
+            times, temps = self._columns(path, segment)
+            # sealed segments are sorted by time
+            first, last = np.searchsorted(times, [start, end])
+            if last > first:
+                parts.append((np.array(times[first:last]), np.array(temps[first:last])))
+        # the open segment is not in the index and may be out of order
+        columns = self._map(path, sealed[-1].number + 1 if sealed else 1)
+        if columns is not None:
+            times, temps = columns
+            if np.all(times[1:] >= times[:-1]):
+                first, last = np.searchsorted(times, [start, end])
+                selected = slice(first, last)
+            else:
+                selected = (times >= start) & (times < end)
+            parts.append((np.array(times[selected]), np.array(temps[selected])))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        times = np.concatenate([part[0] for part in parts])
+        temps = np.concatenate([part[1] for part in parts])
+        # late readings can land in a later segment than newer ones
+        if len(parts) > 1 and not np.all(times[1:] >= times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times, temps = times[order], temps[order]
+        return times, temps
+
+    def downsample(self, stream: str, start: int, end: int, step: int) -> Buckets:
+        """Mean, min, max and count of the readings in every `step` seconds from start to end."""
+        if step < 1:
+            raise ValueError("step must be at least 1 second")
+        times, temps = self.read(stream, start, end)
+        if len(times) == 0:
+            return Buckets(np.empty(0, dtype=np.int64), *(np.empty(0, dtype=np.float32),) * 3,
+                           np.empty(0, dtype=np.int64))
+        buckets = (times - start) // step
+        # index of the first reading of every bucket
+        firsts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts = np.diff(np.append(firsts, len(times)))
+        sums = np.add.reduceat(temps.astype(np.float64), firsts)
+        return Buckets(
+            start + buckets[firsts] * step,
+            (sums / counts).astype(np.float32),
+            np.minimum.reduceat(temps, firsts),
+            np.maximum.reduceat(temps, firsts),
+            counts,
+        )
+
+
+def load_csv(path: str, directory: str) -> int:
+    """Append a smoker CSV export to the history, returns the number of readings."""
+    import csv
+
+    from bbq_readings import parse_time
+
+    queues = ["01-smoker", "02-food-A", "02-food-B"]
+    writer = bbq_history.HistoryWriter(directory)
+    count = 0
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for row in reader:
+            timestamp = parse_time(row[0])
+            for queue, value in zip(queues, row[1:]):
+                if value.strip():
+                    writer.append(queue, timestamp, round(float(value), 2))
+                    count += 1
+    writer.close()
+    return count
+
+
+def check(days: int = 30):
+    """Write `days` of one-second readings to a temporary history and time queries."""
+    import tempfile
+    import time
+
+    from bbq_readings import parse_time
+
+    start = parse_time("05/22/21 00:00:00")
+    seconds = days * 86400
+    times = np.arange(start, start + seconds, dtype=np.int64)
+    # a slow cook curve with sensor noise
+    rng = np.random.default_rng(1)
+    temps = (225 + 10 * np.sin(np.arange(seconds) / 3600) + rng.normal(0, 0.5, seconds)).round(2)
+    for compress in (True, False):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = bbq_history.HistoryWriter(directory, compress=compress)
+            began = time.perf_counter()
+            # append the readings in chunks, like a consumer would over time
+            for index in range(0, seconds, 86400):
+                chunk = zip(times[index:index + 86400].tolist(), temps[index:index + 86400].tolist())
+                writer.extend("01-smoker", chunk)
+            writer.close()
+            written = time.perf_counter() - began
+            path = stream_path(directory, "01-smoker")
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+            reader = HistoryReader(directory)
+            query_start = start + (days // 2) * 86400 + 14 * 3600
+            query_end = query_start + 2 * 3600
+            began = time.perf_counter()
+            buckets = reader.downsample("01-smoker", query_start, query_end, 60)
+            first_query = time.perf_counter() - began
+            began = time.perf_counter()
+            for _ in range(100):
+                reader.downsample("01-smoker", query_start, query_end, 60)
+            repeat_query = (time.perf_counter() - began) / 100
+
+            # the same buckets straight from the arrays
+            selected = (times >= query_start) & (times < query_end)
+            expected = temps[selected].astype(np.float32).reshape(-1, 60)
+            assert len(buckets.time) == 120 and np.all(buckets.count == 60)
+            assert np.allclose(buckets.mean, expected.astype(np.float64).mean(axis=1), atol=1e-4)
+            assert np.array_equal(buckets.min, expected.min(axis=1))
+            assert np.array_equal(buckets.max, expected.max(axis=1))
+            everything = reader.read("01-smoker", start, start + seconds)
+            assert np.array_equal(everything[0], times)
+
+            print(f"{'zlib' if compress else 'raw'}: {seconds} readings written in {written:.1f} s "
+                  f"({seconds / written:.0f}/s), {size / 2 ** 20:.1f} MiB on disk "
+                  f"({size / seconds:.2f} bytes per reading); 2 hours at 1 minute: "
+                  f"first query {first_query * 1000:.1f} ms, then {repeat_query * 1000:.2f} ms")
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    from bbq_readings import format_time, parse_time
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "load":
+        directory = sys.argv[3] if len(sys.argv) > 3 else "history"
+        print(f"Loaded {load_csv(sys.argv[2], directory)} readings into {directory}")
+    elif command == "query":
+        stream, start, end = sys.argv[2], parse_time(sys.argv[3]), parse_time(sys.argv[4])
+        step = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        reader = HistoryReader(sys.argv[6] if len(sys.argv) > 6 else None)
+        if step:
+            buckets = reader.downsample(stream, start, end, step)
+            for when, mean, low, high, count in zip(*buckets):
+                print(f"{format_time(int(when))}  mean {mean:6.2f}  min {low:6.2f}  max {high:6.2f}  ({count})")
+        else:
+            for when, temp in zip(*reader.read(stream, start, end)):
+                print(f"{format_time(int(when))}, {temp:.2f}")
+    elif command == "check":
+        check(int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+    else:
+        sys.exit(f"unknown command {command!r}, use load, query or check")
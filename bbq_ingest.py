@@ -0,0 +1,157 @@
+"""
+    Fast, memory-mapped ingestion of smoker CSV exports with NumPy.
+
+    bbq_producer.py reads the CSV with csv.reader and, for every row, runs
+    float(), round() and a try/except ValueError for each of the three
+    channels. On a season of cooks (multi-GB exports) that is slow, and the
+    empty Channel2/Channel3 values at the start of a cook turn into
+    exception-driven control flow.
+
+    read_csv_columns() memory-maps the file and works through it in chunks
+    of whole lines, so memory stays bounded however large the file is. For
+    each chunk it parses every column in bulk:
+        times   int64 epoch seconds, decoded from the fixed-width Time column
+        temps   float64 (rows x 3) readings for Channel1..3, rounded to 2 places
+        present bool (rows x 3) mask, False where the CSV value is empty
+    split_streams() then uses the masks to pre-split each chunk into one
+    (times, temps) stream per queue before anything is published.
+
+    NumPy is only needed for this ingestion path.
+
+"""
+
+import mmap
+from collections import namedtuple
+
+import numpy as np
+
+from bbq_readings import parse_time
+
+# Define the variables
+# bytes of CSV parsed at a time (rounded to whole lines)
+default_chunk_bytes = 8 * 1024 * 1024
+# queue for each Channel column, in column order
+channel_queues = ("01-smoker", "02-food-A", "02-food-B")
+
+# one parsed chunk of the CSV file
+Columns = namedtuple("Columns", ["time_strings", "times", "temps", "present"])
+# the readings of one queue within a chunk
+Stream = namedtuple("Stream", ["time_strings", "times", "temps"])
+
+# byte offsets of the digits in a Time stamp like 05/22/21 12:20:15
+_month, _day, _year, _hour, _minute, _second = 0, 3, 6, 9, 12, 15
+
+
+def _two_digits(chars, offset):
+    """Vectorized int of the two ASCII digits at `offset` in each row."""
+    digits = chars[:, offset:offset + 2].astype(np.int64) - 48
+    if digits.min() < 0 or digits.max() > 9:
+        raise ValueError("Time column does not match %m/%d/%y %H:%M:%S")
+    return digits[:, 0] * 10 + digits[:, 1]
+
+
+def parse_times(time_strings) -> np.ndarray:
+    """Convert an array of Time stamps (bytes) to int64 epoch seconds (UTC)."""
+    if len(time_strings) == 0:
+        return np.empty(0, dtype=np.int64)
+    if time_strings.dtype.itemsize != 17 or np.char.str_len(time_strings).min() != 17:
+        # not the usual fixed width, fall back to parsing one at a time
+        return np.array([parse_time(t.decode()) for t in time_strings], dtype=np.int64)
+    chars = np.ascontiguousarray(time_strings).view(np.uint8).reshape(-1, 17)
+    years = 2000 + _two_digits(chars, _year)
+    months = _two_digits(chars, _month)
+    days = _two_digits(chars, _day)
+    # days since the epoch, built with numpy's calendar arithmetic
+    dates = (
+        (years - 1970).astype("datetime64[Y]")
+        + (months - 1).astype("timedelta64[M]")
+    ).astype("datetime64[D]") + (days - 1).astype("timedelta64[D]")
+    seconds = (
+        _two_digits(chars, _hour) * 3600
+        + _two_digits(chars, _minute) * 60
+        + _two_digits(chars, _second)
+    )
+    return dates.astype(np.int64) * 86400 + seconds
+
+
+def parse_chunk(chunk: bytes) -> Columns:
+    """Parse a chunk of whole CSV lines (no header) into columns."""
+    chunk = chunk.replace(b"\r", b"")
+    if not chunk.endswith(b"\n"):
+        chunk += b"\n"
+    # one C-level split gives every field of every row in order
+    fields = chunk.replace(b"\n", b",").split(b",")
+    fields.pop()
+    if len(fields) % 4:
+        raise ValueError("every CSV row must have 4 columns: Time,Channel1,Channel2,Channel3")
+    table = np.array(fields, dtype=np.bytes_).reshape(-1, 4)
+
+    time_strings = table[:, 0]
+    lengths = np.char.str_len(time_strings)
+    if lengths.min() == lengths.max() == 17:
+        time_strings = time_strings.astype("S17")
+    times = parse_times(time_strings)
+
+    values = table[:, 1:]
+    present = values != b""
+    # empty values become NaN and are masked out by `present`
+    temps = np.where(present, values, b"nan").astype(np.float64)
+    temps = np.round(temps, 2)
+    return Columns(time_strings, times, temps, present)
+
+
+def read_csv_columns(path: str, chunk_bytes: int = default_chunk_bytes):
+    """
+    Memory-map a smoker CSV export and yield it as Columns, one chunk at a time.
+    The header line is skipped.
+    """
+    with open(path, "rb") as file:
+        if file.seek(0, 2) == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            start = data.find(b"\n") + 1
+            if start == 0:
+                return
+            while start < size:
+                end = min(start + chunk_bytes, size)
+                if end < size:
+                    # finish the chunk at the end of a line
+                    newline = data.find(b"\n", end)
+                    end = size if newline == -1 else newline + 1
+                chunk = data[start:end]
+                start = end
+                if chunk.strip():
+                    yield parse_chunk(chunk)
+
+
+def split_streams(columns: Columns, queues=channel_queues) -> dict:
+    """Split one chunk into {queue: Stream} using the missing-value masks."""
+    streams = {}
+    for index, queue in enumerate(queues):
+        present = columns.present[:, index]
+        streams[queue] = Stream(
+            columns.time_strings[present],
+            columns.times[present],
+            columns.temps[present, index],
+        )
+    return streams
+
+
+def read_streams(path: str, chunk_bytes: int = default_chunk_bytes):
+    """Yield {queue: Stream} for each chunk of the file."""
+    for columns in read_csv_columns(path, chunk_bytes):
+        yield split_streams(columns)
+
+
+# numpy layout of the 14 byte binary reading in bbq_readings.py (<qHf)
+reading_dtype = np.dtype([("time", "<i8"), ("sensor_id", "<u2"), ("temp", "<f4")])
+
+
+def encode_binary_stream(stream: Stream, sensor_id: int) -> bytes:
+    """Pack a whole stream into back-to-back 14 byte binary readings."""
+    records = np.empty(len(stream.times), dtype=reading_dtype)
+    records["time"] = stream.times
+    records["sensor_id"] = sensor_id
+    records["temp"] = stream.temps
+    return records.tobytes()
@@ -0,0 +1,332 @@
+"""
+    Time-aligned join of the sensor streams for composite alerts.
+
+    Each consumer only sees its own queue, so it cannot say "the smoker
+    dropped 15 F and food A stalled within the same 10 minutes". StreamJoin
+    takes the readings and alerts of several streams (e.g. 01-smoker,
+    02-food-A and 02-food-B in bbq_async_consumer.py) and lines them up on
+    their event time, the Time stamp in each message.
+
+    Streams arrive at different speeds, so the join keeps a watermark: the
+    newest time every stream has reached. Composite rules are evaluated at
+    each reading time the watermark passes, once the readings and alerts up
+    to it are in from every stream, so the result does not depend on which
+    stream arrived first. Each stream keeps only a bounded buffer:
+        * entries older than the watermark minus the longest rule window are
+          evicted when the watermark moves
+        * a lagging stream holds the watermark back, and the other streams
+          buffer their readings until it catches up, up to max_buffer
+          entries per buffer
+        * only when a buffer would grow past max_buffer is the watermark
+          moved on without the lagging stream: add() returns a warning
+          naming the composite rules that may be missed, its readings that
+          arrive behind the watermark are dropped and counted as late, and
+          add() reports how many once the stream has caught up
+        * a stream that has not reported yet holds the watermark at most
+          max_lag seconds behind the newest one
+    Memory is therefore the same after an hour or after a 20 hour cook.
+
+    Composite rules (default_join_rules) are edge triggered: an alert is
+    raised when the condition becomes true and not again until it has been
+    false, so a condition lasting 10 minutes gives one alert, not 120.
+        together  every listed stream raised an alert containing its text
+                  within the last `within` seconds, e.g.
+                  {"type": "together", "within": 600,
+                   "alerts": {"01-smoker": "SMOKER ALERT", "02-food-A": "STALL"}}
+        faster    `stream` rose faster than `than` over the last `window`
+                  seconds by more than `margin` degrees per minute, e.g.
+                  {"type": "faster", "window": 600, "margin": 2,
+                   "stream": "02-food-A", "than": "01-smoker"}
+
+    Run this file to replay smoker-temps.csv through the join, in order,
+    with one stream held back, and with one held back further than small
+    buffers can wait for, and print the composite alerts and the largest
+    buffers:
+        python bbq_join.py [csv_file]
+
+"""
+
+import sys
+from bisect import bisect_right
+from collections import deque
+
+# Define the variables
+# a stream that has not reported yet holds the watermark at most this many seconds back
+max_lag = 600
+# most readings or alerts kept per stream while waiting for a lagging stream
+max_buffer = 2000
+
+default_join_rules = [
+    {"name": "drop and stall A", "type": "together", "within": 600,
+     "alerts": {"01-smoker": "SMOKER ALERT", "02-food-A": "STALL"},
+     "message": "COMBINED ALERT! Smoker dropped 15 F and Food A stalled within 10 minutes"},
+    {"name": "drop and stall B", "type": "together", "within": 600,
+     "alerts": {"01-smoker": "SMOKER ALERT", "02-food-B": "STALL"},
+     "message": "COMBINED ALERT! Smoker dropped 15 F and Food B stalled within 10 minutes"},
+    {"name": "food A outpacing smoker", "type": "faster", "window": 600, "margin": 2,
+     "stream": "02-food-A", "than": "01-smoker",
+     "message": "PROBE ALERT! Food A is rising {difference:.1f} F/min faster than the smoker, check the probe"},
+    {"name": "food B outpacing smoker", "type": "faster", "window": 600, "margin": 2,
+     "stream": "02-food-B", "than": "01-smoker",
+     "message": "PROBE ALERT! Food B is rising {difference:.1f} F/min faster than the smoker, check the probe"},
+]
+
+
+class StreamBuffer:
+    """A stream's recent (timestamp, value) entries in time order."""
+
+    __slots__ = ("times", "values")
+
+    def __init__(self):
+        self.times = deque()
+        self.values = deque()
+
+    def add(self, timestamp: int, value):
+        times = self.times
+        if not times or timestamp >= times[-1]:
+            times.append(timestamp)
+            self.values.append(value)
+        else:
+            # out of order but not late, keep the buffer sorted
+            index = bisect_right(times, timestamp)
+            times.insert(index, timestamp)
+            self.values.insert(index, value)
+
+    def evict(self, cutoff: int):
+        """Drop the entries stamped at or before cutoff."""
+        times, values = self.times, self.values
+        while times and times[0] <= cutoff:
+            times.popleft()
+            values.popleft()
+
+    def trim(self, size: int) -> int:
+        """Drop the oldest entries beyond `size`, returns how many."""
+        times, values = self.times, self.values
+        excess = len(times) - size
+        for _ in range(excess):
+            times.popleft()
+            values.popleft()
+        return max(excess, 0)
+
+    def between(self, start: int, end: int):
+        """(timestamp, value) entries with start < timestamp <= end."""
+        times = self.times
+        first = bisect_right(times, start)
+        last = bisect_right(times, end)
+        return [(times[i], self.values[i]) for i in range(first, last)]
+
+    def __len__(self):
+        return len(self.times)
+
+
+class StreamJoin:
+    """
+    Join the readings and alerts of several streams on event time.
+
+    add(stream, timestamp, temp, alerts) returns (timestamp, message) for
+    every composite alert raised as the watermark moves, and for every
+    stream the watermark had to move on without (see left_out).
+    """
+
+    def __init__(self, streams: list, rules: list = None, max_buffer: int = max_buffer):
+        self.rules = default_join_rules if rules is None else rules
+        self.streams = list(streams)
+        self.max_buffer = max_buffer
+        self.readings = {stream: StreamBuffer() for stream in self.streams}
+        self.alerts = {stream: StreamBuffer() for stream in self.streams}
+        self.latest = dict.fromkeys(self.streams)
+        # the newest time of any stream, and what it was when each stream last delivered a reading
+        self.newest = None
+        self.heard = dict.fromkeys(self.streams)
+        self.span = max([rule.get("within", rule.get("window", 0)) for rule in self.rules] + [1])
+        self.watermark = None
+        # rules whose condition held the last time they were evaluated
+        self.active = set()
+        # streams the watermark moved on without -> readings dropped as late since
+        self.left_out = {}
+        self.late = 0
+        # entries dropped because even the rule windows held more than max_buffer
+        self.overflow = 0
+
+    def add(self, stream: str, timestamp: int, temp: float, alerts=()) -> list:
+        """Add a reading and the alerts it raised in its own stream."""
+        if stream not in self.latest:
+            return []
+        newest = self.newest
+        if newest is None or timestamp > newest:
+            self.newest = newest = timestamp
+        # a lagging stream is still delivering, however old its readings are
+        self.heard[stream] = newest
+        latest = self.latest[stream]
+        if latest is None or timestamp > latest:
+            self.latest[stream] = latest = timestamp
+        fired = []
+        watermark = self.watermark
+        if watermark is not None and timestamp <= watermark:
+            # the join has moved past this time without the stream
+            self.late += 1
+            if stream in self.left_out:
+                self.left_out[stream] += 1
+            elif latest < watermark:
+                # it was quiet, or had not reported yet, and comes back behind the join
+                self.left_out[stream] = 1
+                fired.append((watermark, self._left_out_warning(stream, watermark - latest)))
+            return fired
+        self.readings[stream].add(timestamp, temp)
+        for message in alerts:
+            self.alerts[stream].add(timestamp, message)
+        if stream in self.left_out:
+            # back ahead of the watermark, it is part of the join again
+            fired.append((timestamp, f"JOIN NOTICE: {stream} caught up, {self.left_out.pop(stream)} "
+                                     f"of its late readings were left out of the composite alerts"))
+        fired.extend(self._advance())
+        return fired
+
+    def _quiet(self, stream: str) -> bool:
+        """True if the stream delivered nothing while the newest time moved on max_lag seconds."""
+        heard = self.heard[stream]
+        return heard is None or self.newest - heard > max_lag
+
+    def _advance(self) -> list:
+        newest = self.newest
+        # the slowest stream still delivering holds the watermark back, one
+        # that has gone quiet (e.g. a probe taken out) does not
+        watermark = min(latest for stream, latest in self.latest.items() if not self._quiet(stream))
+        if None in self.latest.values() and newest - watermark < max_lag:
+            # wait up to max_lag for the streams that have not reported yet
+            watermark = min(newest - max_lag, watermark)
+        # but no further back than the buffers can hold: move on far enough
+        # that evicting behind it brings every buffer back to max_buffer
+        for buffer in (*self.readings.values(), *self.alerts.values()):
+            excess = len(buffer) - self.max_buffer
+            if excess > 0:
+                watermark = max(watermark, min(buffer.times[excess - 1] + self.span, newest))
+        previous = self.watermark
+        if previous is not None and watermark <= previous:
+            return []
+        self.watermark = watermark
+        fired = []
+        for stream, latest in self.latest.items():
+            if latest is not None and latest < watermark and stream not in self.left_out and not self._quiet(stream):
+                # the buffers are full, the join moves on without this stream
+                self.left_out[stream] = 0
+                fired.append((watermark, self._left_out_warning(stream, watermark - latest)))
+        # evaluate at every reading time the watermark has passed, so the
+        # alerts do not depend on the order the streams arrived in
+        start = watermark - self.span if previous is None else previous
+        moments = sorted({timestamp for buffer in self.readings.values()
+                          for timestamp, _ in buffer.between(start, watermark)})
+        for moment in moments:
+            for index, rule in enumerate(self.rules):
+                message = self._evaluate(rule, moment)
+                if message is None:
+                    self.active.discard(index)
+                elif index not in self.active:
+                    self.active.add(index)
+                    fired.append((moment, message))
+        cutoff = watermark - self.span
+        for stream in self.streams:
+            self.readings[stream].evict(cutoff)
+            self.alerts[stream].evict(cutoff)
+            # only when the rule windows alone hold more than max_buffer entries
+            self.overflow += self.readings[stream].trim(self.max_buffer)
+            self.overflow += self.alerts[stream].trim(self.max_buffer)
+        return fired
+
+    def _left_out_warning(self, stream: str, behind: int) -> str:
+        """The message for a stream the watermark moved on without."""
+        rules = [rule.get("name", rule["type"]) for rule in self.rules
+                 if stream in rule.get("alerts", ()) or stream in (rule.get("stream"), rule.get("than"))]
+        return (f"JOIN WARNING! {stream} is {behind} s behind the join, its readings are left out "
+                f"until it catches up; these composite alerts may be missed: {', '.join(rules) or 'none'}")
+
+    def _evaluate(self, rule: dict, watermark: int):
+        """The rule's message if its condition holds at the watermark, else None."""
+        kind = rule["type"]
+        if kind == "together":
+            start = watermark - rule["within"]
+            for stream, text in rule["alerts"].items():
+                buffer = self.alerts.get(stream)
+                if buffer is None or not any(text in message for _, message in buffer.between(start, watermark)):
+                    return None
+            return rule["message"]
+        if kind == "faster":
+            rate = self._rate(rule["stream"], rule["window"], watermark)
+            other = self._rate(rule["than"], rule["window"], watermark)
+            if rate is None or other is None or rate <= 0:
+                return None
+            difference = rate - other
+            if difference <= rule.get("margin", 0):
+                return None
+            return rule["message"].format(rate=rate, other=other, difference=difference)
+        raise ValueError(f"unknown join rule type {kind!r}")
+
+    def _rate(self, stream: str, window: int, watermark: int):
+        """Degrees per minute over the window ending at the watermark, None without enough readings."""
+        buffer = self.readings.get(stream)
+        if buffer is None:
+            return None
+        entries = buffer.between(watermark - window, watermark)
+        if len(entries) < 2:
+            return None
+        (first_time, first), (last_time, last) = entries[0], entries[-1]
+        # the readings must cover at least half the window
+        if last_time - first_time < window // 2:
+            return None
+        return (last - first) * 60 / (last_time - first_time)
+
+    def buffered(self) -> int:
+        """Entries held across every buffer."""
+        return sum(len(b) for b in self.readings.values()) + sum(len(b) for b in self.alerts.values())
+
+
+def replay(path: str, delay: dict = None, buffer_size: int = max_buffer):
+    """
+    Replay a smoker CSV through the stream monitors and a StreamJoin.
+    `delay` holds a stream back, {stream: seconds}, to check a lagging stream.
+    Returns (composite alerts, largest number of entries buffered, late readings).
+    """
+    import csv
+    import heapq
+
+    from bbq_readings import parse_time
+    from bbq_streams import make_monitor
+
+    queues = ["01-smoker", "02-food-A", "02-food-B"]
+    delay = delay or {}
+    arrivals = []
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for order, row in enumerate(reader):
+            timestamp = parse_time(row[0])
+            for queue, value in zip(queues, row[1:]):
+                if value.strip():
+                    # arrival order: when the reading is delivered, then CSV order
+                    arrivals.append((timestamp + delay.get(queue, 0), order, queue, timestamp, round(float(value), 2)))
+    heapq.heapify(arrivals)
+    monitors = {queue: make_monitor(queue) for queue in queues}
+    join = StreamJoin(queues, max_buffer=buffer_size)
+    composite = []
+    largest = 0
+    while arrivals:
+        _, _, queue, timestamp, temp = heapq.heappop(arrivals)
+        alerts = monitors[queue].add(timestamp, temp)
+        composite.extend(join.add(queue, timestamp, temp, alerts))
+        largest = max(largest, join.buffered())
+    return composite, largest, join.late
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    from bbq_readings import format_time
+
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else "smoker-temps.csv"
+    for label, held_back, buffer_size in (
+            ("in order", None, max_buffer), ("food A 5 min behind", {"02-food-A": 300}, max_buffer),
+            ("food B 30 min behind", {"02-food-B": 1800}, max_buffer),
+            ("food B 30 min behind, 40 entry buffers", {"02-food-B": 1800}, 40)):
+        found, most, late = replay(csv_file, held_back, buffer_size)
+        print(f"{label}: {len(found)} composite alerts, at most {most} entries buffered, {late} late readings")
+        for when, text in found:
+            print(f"    {format_time(when)} {text}")
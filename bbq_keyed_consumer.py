@@ -0,0 +1,244 @@
+"""
+    This program listens for keyed readings from many smokers at once.
+
+    With routing_mode = 'topic' or 'hash' in bbq_producer.py, readings are
+    published to an exchange with the routing key <smoker_id>.<channel>,
+    e.g. smoker-7.food-A. This consumer keeps a separate StreamMonitor (windows
+    and alert rules) for every routing key it sees, in a KeyedMonitors table.
+
+    topic mode: the consumer binds its queue to the topic exchange with one or
+        more patterns, e.g. "*.smoker" for every smoker or "pit-2.*" for one pit.
+    hash mode: every consumer instance is a shard with its own queue bound to
+        the consistent-hash exchange. RabbitMQ spreads the routing keys over
+        the shards, a key always goes to the same shard, so per-key order is
+        kept. Start another shard to spread the keys over more consumers.
+        Needs the rabbitmq_consistent_hash_exchange plugin.
+
+    Usage:
+        python bbq_keyed_consumer.py topic [pattern ...]
+        python bbq_keyed_consumer.py hash [shard]
+
+"""
+
+import sys
+
+import pika
+
+from bbq_acks import AckBatcher
+from bbq_catchup import make_catchup
+from bbq_dedup import DuplicateFilter
+from bbq_eta import Estimate
+from bbq_history import make_history
+from bbq_metrics import ConsumerMetrics
+from bbq_output import make_output, received_line
+from bbq_profile import SamplingProfiler, StageTimers, install_signal_handlers
+from bbq_readings import decode_readings
+from bbq_streams import KeyedMonitors
+from bbq_transport import connect
+
+# Define the variables
+host = "localhost"
+topic_exchange = "bbq.readings"
+hash_exchange = "bbq.readings.hash"
+# share of the hash ring each shard gets, relative to the other shards
+shard_weight = 1
+# readings may arrive up to this many seconds out of order
+allowed_lateness = 0
+# prefetch_count = Per consumer limit of unaknowledged messages
+prefetch_count = 100
+# ack every ack_batch_size messages with one basic_ack(multiple=True),
+# or ack_max_delay seconds after the oldest unacked message
+ack_batch_size = 50
+ack_max_delay = 0.1
+# drop the state of keys that have not reported for this many seconds (event time)
+idle_seconds = 6 * 3600
+
+# one monitor per routing key
+keyed_monitors = KeyedMonitors(allowed_lateness)
+# created in main() once the channel is open
+ack_batcher = None
+# readings and alerts are written by a background thread (see bbq_output.py)
+output = make_output(host)
+# newest event time seen, used to evict idle keys
+latest_time = 0
+# end-to-end latency, gaps and duplicates per routing key (see bbq_metrics.py)
+metrics = ConsumerMetrics("keyed")
+metrics_port = None
+# per-stage callback timers and a sampling profiler, toggled with
+# kill -USR2 / kill -USR1 <pid> (see bbq_profile.py)
+profile_stages = False
+stages = StageTimers(profile_stages)
+profiler = SamplingProfiler()
+# drop readings delivered more than once, per routing key (see bbq_dedup.py)
+duplicates = DuplicateFilter()
+# every reading per routing key in columnar segment files, if history_dir is set (see bbq_history.py)
+history = make_history()
+# skip the per-message logs and add the readings in batches while behind (see bbq_catchup.py)
+catchup = make_catchup(output, metrics, None, prefetch_count, seen=duplicates.seen, history=history)
+
+
+# define a callback function to be called when a message is received
+def callback(ch, method, properties, body):
+    """ Define behavior on getting a message."""
+    global latest_time
+    # the routing key says which smoker and channel the reading is from
+    key = method.routing_key
+    stages.start()
+    monitor = keyed_monitors.get(key)
+    started = metrics.received(key, properties)
+    try:
+        readings = decode_readings(properties, body)
+        stages.mark("decode")
+        # while catching up, queue the readings for the next batch, which acks them
+        # (idle keys are evicted by the next message handled normally)
+        if catchup.observe(properties):
+            catchup.defer(monitor, method, readings, started)
+            metrics.maybe_report()
+            return
+        # add any queued readings first so they stay in order
+        catchup.flush()
+        for timestamp, temp in readings:
+            # skip readings that were delivered before
+            if duplicates.seen(key, timestamp):
+                continue
+            if history is not None:
+                history.append(key, timestamp, temp)
+            output.message(received_line, timestamp, temp, key)
+            stages.mark("print")
+            if stages.enabled:
+                alerts = monitor.add_timed(timestamp, temp, stages.mark)
+            else:
+                alerts = monitor.add(timestamp, temp)
+            for alert in alerts:
+                output.alert(alert, key, timestamp)
+                if isinstance(alert, Estimate):
+                    metrics.estimated()
+                else:
+                    metrics.alerted(started)
+            stages.mark("alert")
+            if timestamp > latest_time:
+                # check for idle keys about once an hour of event time
+                if timestamp // 3600 != latest_time // 3600:
+                    keyed_monitors.evict_idle(timestamp - idle_seconds)
+                    duplicates.evict_idle(timestamp - idle_seconds)
+                latest_time = timestamp
+    except ValueError:
+        pass
+    except Exception:
+        # ack the messages processed before this one, this one stays unacked
+        if ack_batcher is not None:
+            ack_batcher.flush()
+        raise
+
+    # Acknowledge that the message has been processed and can be removed from the queue
+    if ack_batcher is not None:
+        ack_batcher.done(method.delivery_tag)
+    else:
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    stages.mark("ack")
+    metrics.maybe_report()
+
+
+def bind_queue(channel, mode: str, args: list) -> str:
+    """Declare this consumer's queue, bind it to the exchange and return its name."""
+    if mode == "topic":
+        patterns = args or ["#"]
+        channel.exchange_declare(exchange=topic_exchange, exchange_type="topic", durable=True)
+        queue = "bbq-topic-" + "+".join(patterns)
+        channel.queue_declare(queue=queue, durable=True)
+        for pattern in patterns:
+            channel.queue_bind(queue=queue, exchange=topic_exchange, routing_key=pattern)
+    elif mode == "hash":
+        shard = int(args[0]) if args else 0
+        channel.exchange_declare(exchange=hash_exchange, exchange_type="x-consistent-hash", durable=True)
+        queue = f"bbq-shard-{shard}"
+        channel.queue_declare(queue=queue, durable=True)
+        # for a consistent-hash exchange the binding key is the shard's weight
+        channel.queue_bind(queue=queue, exchange=hash_exchange, routing_key=str(shard_weight))
+    else:
+        raise ValueError(f"unknown mode {mode!r}, use topic or hash")
+    return queue
+
+
+# define a main function to run the program
+def main(hn: str = "localhost", mode: str = "topic", args: list = None):
+    """ Continuously listen for keyed readings on this consumer's queue."""
+    global ack_batcher
+
+    # when a statement can go wrong, use a try-except block
+    try:
+        # RabbitMQ, or the in-process broker with transport = 'local' (see bbq_transport.py)
+        connection = connect(hn)
+
+    # If there's an error:
+    except Exception as e:
+        print()
+        print("ERROR: connection to RabbitMQ server failed.")
+        print(f"Verify the server is running on host={hn}.")
+        print(f"The error says: {e}")
+        print()
+        sys.exit(1)
+
+    if metrics_port:
+        metrics.serve(metrics_port)
+    install_signal_handlers(stages, profiler)
+
+    try:
+        # use the connection to create a communication channel
+        channel = connection.channel()
+
+        # declare the exchange and this consumer's durable queue and bind them
+        queue = bind_queue(channel, mode, args or [])
+
+        # prefetch_count = Per consumer limit of unaknowledged messages
+        channel.basic_qos(prefetch_count=prefetch_count)
+
+        # acknowledge processed messages in batches (see bbq_acks.py)
+        ack_batcher = AckBatcher(channel, ack_batch_size, ack_max_delay, connection.call_later,
+                                 prefetch_count=prefetch_count)
+        catchup.attach(ack_batcher, connection.call_later)
+        catchup.watch_depth(channel, queue, connection.call_later)
+
+        # one consumer per queue keeps the readings of every key in order
+        channel.basic_consume(queue=queue, on_message_callback=callback)
+
+        # print a message to the console for the user
+        print(f" [*] Listening on {queue}. To exit press CTRL+C")
+
+        # start consuming messages via the communication channel
+        channel.start_consuming()
+
+    # If there's an error:
+    except Exception as e:
+        print()
+        print("ERROR: something went wrong.")
+        print(f"The error says: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+        print(" User interrupted continuous listening process.")
+        sys.exit(0)
+    finally:
+        # acknowledge every message that was processed before closing
+        if ack_batcher is not None:
+            try:
+                catchup.flush()
+                ack_batcher.flush()
+            except pika.exceptions.AMQPError:
+                ack_batcher.discard()
+        if history is not None:
+            history.close()
+        output.close()
+        print(metrics.summary())
+        print(duplicates.summary())
+        print(f"\nFollowed {len(keyed_monitors)} keys. Closing connection. Goodbye.\n")
+        connection.close()
+
+
+# Standard Python idiom to indicate main program entry point
+# This allows us to import this module and use its functions
+# without executing the code below.
+# If this is the program being run, then execute the code below
+if __name__ == "__main__":
+    # call the main function with the mode (topic or hash) and its arguments
+    main(host, sys.argv[1] if len(sys.argv) > 1 else "topic", sys.argv[2:])
@@ -0,0 +1,268 @@
+"""
+    End-to-end latency and delivery metrics for the BBQ consumers.
+
+    The producer stamps every message with two AMQP headers:
+        x-sent-at  publish time, integer microseconds since the epoch
+        x-seq      sequence number per stream (routing key), starting at 1
+    and a consumer's ConsumerMetrics turns them into:
+        queue latency   x-sent-at -> the callback starts on the message
+        alert latency   callback start -> an alert is printed
+        gaps            sequence numbers skipped (lost or not yet delivered)
+        duplicates      sequence numbers seen again (redeliveries, reorders)
+
+    Latencies go into LatencyHistogram, a log-linear (HDR-style) histogram:
+    values below 2**sub_bits are counted exactly, above that every power of
+    two is split into 2**(sub_bits - 1) buckets, so every value is kept to
+    within about 3% in a fixed list of counters. Recording is a bit_length(),
+    a shift and a list increment, cheap enough to run on every message.
+
+    Summaries are printed every report_interval seconds, and serve() can
+    expose the same numbers as JSON on http://localhost:<port>/metrics.
+    Both clocks are the wall clock, so the producer and consumer hosts
+    should be time-synchronized (NTP) for the queue latency to mean much.
+
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Define the variables
+sent_at_header = "x-sent-at"
+seq_header = "x-seq"
+# seconds between printed summaries
+default_report_interval = 10.0
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of non-negative integer values (microseconds).
+
+    Parameters:
+        sub_bits (int): 2**sub_bits exact buckets, about 2**-(sub_bits - 1) relative error above
+        max_value (int): larger values are counted in the top bucket
+    """
+
+    __slots__ = ("sub_bits", "half", "counts", "count", "total", "min", "max")
+
+    def __init__(self, sub_bits: int = 6, max_value: int = 3_600_000_000):
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.counts = [0] * (self._index(max_value) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        # the top sub_bits bits of the value, offset by its power of two
+        return (shift << (self.sub_bits - 1)) + (value >> shift)
+
+    def _upper(self, index: int) -> int:
+        """Largest value counted in a bucket."""
+        if index < (1 << self.sub_bits):
+            return index
+        shift = (index >> (self.sub_bits - 1)) - 1
+        mantissa = index - (shift << (self.sub_bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int):
+        """Count one value, negative values (clock skew) count as 0."""
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        counts = self.counts
+        if index >= len(counts):
+            index = len(counts) - 1
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float):
+        """Return the value at a percentile (0-100), or None if nothing was recorded."""
+        if self.count == 0:
+            return None
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add the counts of a histogram with the same sub_bits and max_value."""
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def snapshot(self) -> dict:
+        """Count, mean and percentiles in milliseconds."""
+        def ms(value):
+            return None if value is None else round(value / 1000, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.mean()),
+            "p50_ms": ms(self.percentile(50)),
+            "p99_ms": ms(self.percentile(99)),
+            "p999_ms": ms(self.percentile(99.9)),
+            "max_ms": ms(self.max),
+        }
+
+
+class SequenceTracker:
+    """
+    Count gaps and duplicates in the x-seq numbers of each stream.
+    A sequence number of 1 means the producer started again.
+    """
+
+    __slots__ = ("highest", "gaps", "duplicates")
+
+    def __init__(self):
+        # stream -> highest sequence number seen
+        self.highest = {}
+        self.gaps = 0
+        self.duplicates = 0
+
+    def see(self, stream: str, seq: int):
+        highest = self.highest.get(stream)
+        if highest is None or seq == 1:
+            self.highest[stream] = seq
+        elif seq > highest:
+            self.gaps += seq - highest - 1
+            self.highest[stream] = seq
+        else:
+            self.duplicates += 1
+
+
+def stamp_headers(seq: int) -> dict:
+    """The headers the producer adds to a message."""
+    return {sent_at_header: time.time_ns() // 1000, seq_header: seq}
+
+
+class ConsumerMetrics:
+    """
+    Latency histograms and sequence tracking for one consumer.
+
+    In the callback:
+        started = metrics.received(stream, properties)
+        ... for every alert: metrics.alerted(started)
+        ... for every ETA line (bbq_eta.Estimate): metrics.estimated()
+        metrics.maybe_report()
+    """
+
+    def __init__(self, name: str, report_interval: float = default_report_interval):
+        self.name = name
+        self.report_interval = report_interval
+        self.queue_latency = LatencyHistogram()
+        self.alert_latency = LatencyHistogram()
+        self.sequences = SequenceTracker()
+        self.messages = 0
+        self.alerts = 0
+        self.estimates = 0
+        self.last_report = time.monotonic()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def received(self, stream: str, properties) -> int:
+        """Record a message as its callback starts, returns the start time (ns) for alerted()."""
+        started = time.time_ns()
+        self.messages += 1
+        headers = getattr(properties, "headers", None)
+        if headers:
+            sent_at = headers.get(sent_at_header)
+            seq = headers.get(seq_header)
+            with self.lock:
+                if sent_at is not None:
+                    self.queue_latency.record(started // 1000 - sent_at)
+                if seq is not None:
+                    self.sequences.see(stream, seq)
+        return started
+
+    def alerted(self, started: int):
+        """Record an alert raised by the message whose callback started at `started`."""
+        self.alerts += 1
+        with self.lock:
+            self.alert_latency.record((time.time_ns() - started) // 1000)
+
+    def estimated(self):
+        """Record an ETA line (bbq_eta.Estimate), kept out of the alert count and latency."""
+        self.estimates += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "name": self.name,
+                "messages": self.messages,
+                "alerts": self.alerts,
+                "estimates": self.estimates,
+                "gaps": self.sequences.gaps,
+                "duplicates": self.sequences.duplicates,
+                "queue_latency": self.queue_latency.snapshot(),
+                "alert_latency": self.alert_latency.snapshot(),
+            }
+
+    def summary(self) -> str:
+        s = self.snapshot()
+        q, a = s["queue_latency"], s["alert_latency"]
+        return (
+            f" [m] {s['name']}: {s['messages']} msgs, {s['alerts']} alerts, {s['estimates']} ETAs, "
+            f"{s['gaps']} gaps, {s['duplicates']} dups | "
+            f"queue p50 {q['p50_ms']} p99 {q['p99_ms']} max {q['max_ms']} ms | "
+            f"alert p50 {a['p50_ms']} p99 {a['p99_ms']} max {a['max_ms']} ms"
+        )
+
+    def maybe_report(self):
+        """Print a summary if report_interval seconds have passed."""
+        now = time.monotonic()
+        if now - self.last_report >= self.report_interval:
+            self.last_report = now
+            print(self.summary())
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serve snapshot() as JSON on http://host:port/metrics from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # keep the request log out of the consumer's output
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.server
@@ -0,0 +1,235 @@
+"""
+    Non-blocking console output and alert sinks for the producer and consumers.
+
+    print() writes to stdout before it returns, so on a slow terminal or a
+    piped log every reading waits for the I/O. Output moves that off the
+    receive loop:
+        * message(), info() and alert() only append an entry to a deque, an
+          atomic operation that never waits on I/O
+        * a background writer thread wakes every flush_interval seconds,
+          formats the waiting entries and writes them to stdout in one call,
+          then hands the alerts to the sinks
+    Per-message logs are also cheaper to skip:
+        verbosity 0  alerts and status lines only
+        verbosity 1  one per-message log in every sample_every
+        verbosity 2  every per-message log (the old behaviour)
+    and message() can take a formatting function and its arguments, e.g.
+    message(received_line, timestamp, temp), so the line is only built, in
+    the writer thread, for the messages that are logged.
+
+    If the writer falls behind by more than max_pending entries, per-message
+    logs are dropped (and counted), alerts never are.
+
+    Alerts can be sent to sinks as well as stdout:
+        FileSink      appends "time stream alert" lines to a file
+        ExchangeSink  publishes each alert to a topic exchange (bbq.alerts by
+                      default) with the stream name as the routing key, so any
+                      number of services can subscribe to the alerts
+    Both run in the writer thread, the exchange sink on its own connection.
+
+"""
+
+import sys
+import threading
+from collections import deque
+
+import pika
+
+from bbq_readings import format_time
+from bbq_transport import connect
+
+# Define the variables
+# 0 = alerts only, 1 = sample the per-message logs, 2 = log every message
+verbosity = 2
+# with verbosity 1, log one message in every sample_every
+sample_every = 100
+# seconds the writer thread waits between writes
+flush_interval = 0.05
+# per-message logs waiting to be written before new ones are dropped
+max_pending = 100_000
+# set to a file name to append every alert to it, e.g. "alerts.log"
+alert_file = None
+# set to an exchange name to publish every alert to it, e.g. "bbq.alerts"
+alert_exchange = None
+
+_message, _info, _alert = 0, 1, 2
+
+
+def received_line(timestamp: int, temp: float, key: str = None) -> str:
+    """The consumers' " [x] Received ..." line."""
+    if key is None:
+        return f" [x] Received {format_time(timestamp)}, {temp}"
+    return f" [x] Received {key} {format_time(timestamp)}, {temp}"
+
+
+def sent_line(message) -> str:
+    """The producer's " [x] sent ..." line."""
+    return f" [x] sent {message}"
+
+
+class FileSink:
+    """Append every alert to a text file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a")
+
+    def write(self, alerts: list):
+        self.file.write("".join(
+            f"{'-' if timestamp is None else format_time(timestamp)} {stream} {text}\n"
+            for text, stream, timestamp in alerts
+        ))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ExchangeSink:
+    """
+    Publish every alert to a durable topic exchange, routing key = stream name.
+    The connection is opened by the writer thread on the first alert.
+    """
+
+    def __init__(self, host: str = "localhost", exchange: str = "bbq.alerts"):
+        self.host = host
+        self.exchange = exchange
+        self.connection = None
+        self.channel = None
+
+    def write(self, alerts: list):
+        if self.channel is None:
+            self.connection = connect(self.host)
+            self.channel = self.connection.channel()
+            self.channel.exchange_declare(exchange=self.exchange, exchange_type="topic", durable=True)
+        for text, stream, timestamp in alerts:
+            headers = None if timestamp is None else {"x-event-time": timestamp}
+            self.channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=stream or "alert",
+                body=text.encode(),
+                properties=pika.BasicProperties(content_type="text/plain", headers=headers),
+            )
+
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+
+class Output:
+    """
+    Buffered console output written by a background thread.
+
+    Parameters:
+        verbosity (int): 0 alerts and info only, 1 sampled messages, 2 every message
+        sample_every (int): with verbosity 1, log one message in this many
+        sinks (list): objects with write(alerts) and close(), alerts are (text, stream, timestamp)
+        stream: where lines are written, sys.stdout by default
+    """
+
+    def __init__(self, verbosity: int = 2, sample_every: int = 100, sinks=(),
+                 stream=None, flush_interval: float = 0.05, max_pending: int = 100_000):
+        self.verbosity = verbosity
+        self.sample_every = max(1, sample_every)
+        self.sinks = list(sinks)
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.seen = 0
+        self.dropped = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def _put(self, entry):
+        if self.thread is None:
+            self._start()
+        self.pending.append(entry)
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self._run, name="bbq-output", daemon=True)
+                self.thread.start()
+
+    def message(self, line, *args):
+        """
+        Log a per-message line, subject to verbosity and sampling.
+        `line` is a string, or a function called with `args` in the writer thread.
+        """
+        verbosity = self.verbosity
+        if verbosity <= 0:
+            return
+        if verbosity == 1:
+            self.seen += 1
+            if self.seen % self.sample_every:
+                return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._put((_message, line, args))
+
+    def info(self, line: str):
+        """Log a status line, written whatever the verbosity."""
+        self._put((_info, line, ()))
+
+    def alert(self, text: str, stream: str = "", timestamp: int = None):
+        """Write an alert to stdout and every sink."""
+        self._put((_alert, text, (stream, timestamp)))
+
+    def _run(self):
+        while not self.stopping.wait(self.flush_interval):
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        """Write everything that is waiting (runs in the writer thread)."""
+        pending = self.pending
+        if not pending:
+            return
+        lines = []
+        alerts = []
+        while pending:
+            kind, line, args = pending.popleft()
+            if kind == _alert:
+                alerts.append((line, *args))
+            elif args or callable(line):
+                line = line(*args)
+            lines.append(line)
+        stream = self.stream or sys.stdout
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+        if not alerts:
+            return
+        for sink in list(self.sinks):
+            try:
+                sink.write(alerts)
+            except Exception as e:
+                # a broken sink must not stop the console output
+                stream.write(f" [!] Alert sink {type(sink).__name__} failed and was removed: {e}\n")
+                self.sinks.remove(sink)
+
+    def close(self):
+        """Write everything that is waiting, stop the writer and close the sinks."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        else:
+            self._drain()
+        for sink in self.sinks:
+            sink.close()
+        if self.dropped:
+            (self.stream or sys.stdout).write(f" [!] {self.dropped} per-message logs dropped\n")
+
+
+def make_output(host: str = "localhost") -> Output:
+    """Create an Output from the settings at the top of this module."""
+    sinks = []
+    if alert_file:
+        sinks.append(FileSink(alert_file))
+    if alert_exchange:
+        sinks.append(ExchangeSink(host, alert_exchange))
+    return Output(verbosity, sample_every, sinks, flush_interval=flush_interval, max_pending=max_pending)
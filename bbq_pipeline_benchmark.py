@@ -0,0 +1,209 @@
+"""
+    End-to-end benchmark of the producer and the three consumers, no RabbitMQ needed.
+
+    The producer (bbq_producer.py) and bbq_smoker_consumer.py,
+    bbq_food_a_consumer.py and food_b_consumer.py run unchanged, each in its
+    own thread, connected through the in-process broker in bbq_transport.py.
+    The producer replays the CSV file as fast as it can and the consumers
+    process every message exactly as they would from RabbitMQ (windows,
+    rules, alerts, acks, checkpoints in a scratch directory).
+
+    For every consumer the table shows:
+        msgs/sec   messages processed per second, from the start of the
+                   replay until its queue is empty and every message is acked
+        p50 / p99  queue latency from the producer's x-sent-at header to the
+                   start of the callback (see bbq_metrics.py), so it includes
+                   the time a message waits behind the ones before it
+        memory     KiB the consumer holds when it is done (windows, rule
+                   state, metrics), measured with tracemalloc in a second run
+                   so the tracing does not slow the first one down
+    Consumers share one process and the GIL, so the numbers are for
+    comparing changes, not for sizing a server.
+
+    Scaled-up data is the CSV file repeated, every copy shifted in time past
+    the end of the one before, so the windows and rules see a longer cook.
+
+    Usage:
+        python bbq_pipeline_benchmark.py [scale ...]
+    e.g. "python bbq_pipeline_benchmark.py 1 10" runs smoker-temps.csv and then
+    a version 10 times as long.
+
+"""
+
+import contextlib
+import csv
+import importlib
+import io
+import os
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import tracemalloc
+
+import bbq_output
+import bbq_transport
+from bbq_readings import format_time, parse_time
+
+# Define the variables
+data_file = "smoker-temps.csv"
+default_scales = [1, 10]
+# consumer module and the queue it listens on
+consumers = [
+    ("bbq_smoker_consumer", "01-smoker"),
+    ("bbq_food_a_consumer", "02-food-A"),
+    ("food_b_consumer", "02-food-B"),
+]
+# give up on a run after this many seconds
+timeout = 600
+# stack frames tracemalloc keeps, enough to find the consumer module in every trace
+memory_frames = 30
+
+
+def scale_csv(path: str, scale: int, directory: str) -> str:
+    """Write the CSV file `scale` times over into `directory`, returns the new file's path."""
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = list(reader)
+    first, last = parse_time(rows[0][0]), parse_time(rows[-1][0])
+    # each copy starts 5 seconds after the last reading of the one before
+    span = last - first + 5
+    scaled = os.path.join(directory, f"scaled-x{scale}.csv")
+    with open(scaled, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for copy in range(scale):
+            shift = copy * span
+            for row in rows:
+                writer.writerow([format_time(parse_time(row[0]) + shift), *row[1:]])
+    return scaled
+
+
+def fresh(name: str):
+    """Import a module, or import it again so its module-level state starts over."""
+    if name in sys.modules:
+        return importlib.reload(sys.modules[name])
+    return importlib.import_module(name)
+
+
+def run(path: str, directory: str, trace_memory: bool = False) -> dict:
+    """
+    Replay `path` through the producer and every consumer.
+    Returns {"producer": (messages, seconds), queue: {...}} with each consumer's results.
+    """
+    bbq_transport.transport = "local"
+    broker = bbq_transport.local_broker = bbq_transport.LocalBroker()
+    # alerts and status lines only, no per-message logs
+    bbq_output.verbosity = 0
+
+    producer = fresh("bbq_producer")
+    producer.data_file = path
+    producer.replay_mode = "max"
+    modules = {}
+    for name, queue in consumers:
+        module = modules[queue] = fresh(name)
+        # keep the checkpoints of real runs out of the benchmark
+        module.checkpointer.path = os.path.join(directory, f"{queue}.ckpt")
+
+    errors = []
+
+    def guarded(target, *args):
+        try:
+            target(*args)
+        except SystemExit as e:
+            if e.code:
+                errors.append(f"{target.__module__} exited with {e.code}")
+        except Exception as e:
+            errors.append(f"{target.__module__}: {e!r}")
+
+    log = io.StringIO()
+    results = {}
+    with contextlib.redirect_stdout(log):
+        if trace_memory:
+            tracemalloc.start(memory_frames)
+        start = time.perf_counter()
+        producer_thread = threading.Thread(target=guarded, args=(producer.send_message,), name="producer")
+        producer_thread.start()
+        # the producer deletes and declares the queues, consumers must subscribe after that
+        while not all(queue in broker.queues for queue in modules) and producer_thread.is_alive():
+            time.sleep(0.001)
+        threads = [
+            threading.Thread(target=guarded, args=(module.main, "localhost", queue), name=queue)
+            for queue, module in modules.items()
+        ]
+        for thread in threads:
+            thread.start()
+
+        producer_thread.join(timeout)
+        producer_seconds = time.perf_counter() - start
+        finished = {}
+        deadline = time.monotonic() + timeout
+        while len(finished) < len(modules) and not errors and time.monotonic() < deadline:
+            for queue in modules:
+                if queue not in finished and broker.idle(queue):
+                    finished[queue] = time.perf_counter() - start
+            time.sleep(0.002)
+
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        broker.stop_consumers()
+        for thread in threads:
+            thread.join(timeout)
+
+    if errors or len(finished) < len(modules):
+        sys.stdout.write(log.getvalue()[-2000:])
+        raise RuntimeError("; ".join(errors) or f"timed out after {timeout} seconds")
+
+    results["producer"] = (broker.published, producer_seconds)
+    for queue, module in modules.items():
+        snap = module.metrics.snapshot()
+        result = results[queue] = {
+            "messages": snap["messages"],
+            "seconds": finished[queue],
+            "p50_ms": snap["queue_latency"]["p50_ms"],
+            "p99_ms": snap["queue_latency"]["p99_ms"],
+            "alerts": snap["alerts"],
+        }
+        if trace_memory:
+            traces = snapshot.filter_traces([tracemalloc.Filter(True, module.__file__, all_frames=True)])
+            result["memory"] = sum(stat.size for stat in traces.statistics("filename"))
+    return results
+
+
+def main(scales: list = None):
+    """Run the benchmark for every scale and print a table for each."""
+    scales = scales or default_scales
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            path = data_file if scale == 1 else scale_csv(data_file, scale, directory)
+            timed = run(path, directory)
+            traced = run(path, directory, trace_memory=True)
+            published, seconds = timed["producer"]
+            print(f"\n{path if scale == 1 else data_file + f' x{scale}'}: "
+                  f"producer sent {published} messages in {seconds:.2f} s ({published / seconds:.0f} msgs/sec)")
+            print(f"{'consumer':>10} {'messages':>9} {'alerts':>7} {'msgs/sec':>9} "
+                  f"{'p50 ms':>9} {'p99 ms':>9} {'memory KiB':>11}")
+            for name, queue in consumers:
+                result = timed[queue]
+                print(
+                    f"{queue:>10} {result['messages']:>9} {result['alerts']:>7} "
+                    f"{result['messages'] / result['seconds']:>9.0f} "
+                    f"{result['p50_ms']:>9} {result['p99_ms']:>9} "
+                    f"{traced[queue]['memory'] / 1024:>11.1f}"
+                )
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    try:
+        scales = [int(arg) for arg in sys.argv[1:]]
+    except ValueError:
+        scales = None
+    if scales is None or any(scale < 1 for scale in scales):
+        # e.g. --help
+        print(textwrap.dedent(__doc__[__doc__.index("    Usage:"):]).strip())
+        sys.exit(0 if {"-h", "--help"} & set(sys.argv[1:]) else 2)
+    main(scales)
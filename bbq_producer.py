@@ -13,6 +13,22 @@ import sys
 import webbrowser
 import csv
 import time
+from operator import itemgetter
+
+from bbq_metrics import stamp_headers
+from bbq_output import make_output, sent_line
+from bbq_publisher import ConfirmedPublisher
+from bbq_readings import (
+    FrameBuffer,
+    binary_content_type,
+    encode_binary,
+    frame_content_type,
+    parse_time,
+    reading_struct,
+    sensor_ids,
+    text_content_type,
+)
+from bbq_transport import connect
 
 # Define the variables
 host = 'localhost'
@@ -21,6 +37,163 @@ food_a_queue = '02-food-A'
 food_b_queue = '02-food-B'
 data_file = 'smoker-temps.csv'
 
+# 'text' sends "Time, temp" strings, 'binary' sends 14 byte struct records
+# (see bbq_readings.py), the content_type header tells the consumers which one
+wire_format = 'text'
+text_properties = pika.BasicProperties(content_type=text_content_type)
+binary_properties = pika.BasicProperties(content_type=binary_content_type)
+
+# frame_size > 1 packs that many binary readings into each message (a frame)
+# a partly filled frame is sent once its oldest reading is frame_max_delay seconds old
+# bigger frames mean fewer messages and more throughput but more latency,
+# run bbq_frame_benchmark.py to see the trade-off
+frame_size = 1
+frame_max_delay = 0.5
+frame_properties = pika.BasicProperties(content_type=frame_content_type)
+frame_buffers = {}
+
+# stamp every message with x-sent-at (publish time in microseconds) and x-seq
+# (sequence number per stream) headers, the consumers use them to measure
+# end-to-end latency and count lost or duplicated messages (see bbq_metrics.py)
+stamp_messages = True
+sequence_numbers = {}
+
+# the " [x] sent" lines are written by a background thread so publishing never
+# waits on the terminal, set verbosity / sampling in bbq_output.py
+output = make_output(host)
+
+# deadband_epsilon = x only sends a reading when it differs from the last reading
+# sent on its channel by more than x degrees (0 = whenever it changes), or when
+# deadband_heartbeat seconds (event time) have passed since the last one sent,
+# so the consumers know the sensor is still there. None sends every reading.
+# The consumers should then carry the last value forward (carry_forward in bbq_streams.py)
+deadband_epsilon = None
+deadband_heartbeat = 300
+deadband_filters = {}
+
+# 'csv' reads the file row by row with csv.reader, 'numpy' memory-maps it and
+# parses whole columns at once (see bbq_ingest.py, needs NumPy), which is much
+# faster on large exports
+ingest_mode = 'csv'
+
+# 'basic' publishes one message at a time, 'confirmed' uses the
+# high-throughput publisher with batching and publisher confirms
+publish_mode = 'basic'
+# messages published per batch and most unconfirmed messages in flight
+batch_size = 500
+max_in_flight = 5000
+
+# 'queue' publishes to the three queues above through the default exchange (one smoker)
+# 'topic' publishes to the topic_exchange with routing key <smoker_id>.<channel>,
+# e.g. smoker-1.food-A, so consumers can bind to patterns like *.smoker
+# 'hash' publishes the same routing keys to a consistent-hash exchange
+# (rabbitmq_consistent_hash_exchange plugin), which spreads the keys over the
+# consumer shards while every key stays on one shard, in order
+routing_mode = 'queue'
+smoker_id = 'smoker-1'
+topic_exchange = 'bbq.readings'
+hash_exchange = 'bbq.readings.hash'
+channel_names = {smoker_queue: 'smoker', food_a_queue: 'food-A', food_b_queue: 'food-B'}
+
+# how fast to replay the CSV file (see ReplayScheduler)
+# 'realtime' follows the gaps in the Time column, 'speedup' replays replay_speed
+# times faster than real time, 'rate' sends replay_rate rows per second
+# (1/30 = one reading every 30 seconds) and 'max' sends as fast as possible
+replay_mode = 'max'
+replay_speed = 10.0
+replay_rate = 1 / 30
+
+class ReplayScheduler:
+    """
+    Pace the replay of the CSV file.
+
+    Every row gets a deadline measured from the start of the replay, e.g. in
+    real time a row stamped 12:21:10 is due 55 seconds after the 12:20:15 row.
+    Deadlines are absolute rather than "sleep for the gap", so small sleep
+    errors never add up over a long run. To keep jitter low the scheduler
+    sleeps until just before the deadline and then spins for the last
+    `spin` seconds.
+    """
+
+    def __init__(self, mode='max', speed=1.0, rate=1.0, spin=0.002,
+                 clock=time.perf_counter, sleep=time.sleep):
+        if mode not in ('realtime', 'speedup', 'rate', 'max'):
+            raise ValueError(f"unknown replay mode {mode!r}")
+        if mode == 'speedup' and speed <= 0:
+            raise ValueError("speed must be positive")
+        if mode == 'rate' and rate <= 0:
+            raise ValueError("rate must be positive")
+        self.mode = mode
+        self.speed = 1.0 if mode == 'realtime' else speed
+        self.rate = rate
+        self.spin = spin
+        self.clock = clock
+        self.sleep = sleep
+        # wall clock and event time of the first row
+        self.start = None
+        self.first_time = None
+        self.rows = 0
+        # stamp and deadline of the newest row
+        self.last_time = None
+        self.last_deadline = None
+        # how far behind its deadline each row was sent, in seconds
+        self.late_total = 0.0
+        self.late_max = 0.0
+
+    @property
+    def paced(self) -> bool:
+        return self.mode != 'max'
+
+    def deadline(self, timestamp) -> float:
+        """
+        Return the clock time the row stamped `timestamp` (epoch seconds) is
+        due, without waiting for it. The readings of a row share its deadline.
+        """
+        if timestamp == self.last_time:
+            return self.last_deadline
+        if self.start is None:
+            self.start = self.clock()
+            self.first_time = timestamp
+        if self.mode == 'rate':
+            offset = self.rows / self.rate
+        else:
+            offset = (timestamp - self.first_time) / self.speed
+        self.rows += 1
+        self.last_time = timestamp
+        self.last_deadline = self.start + offset
+        return self.last_deadline
+
+    def wait(self, timestamp):
+        """Block until the row stamped `timestamp` (epoch seconds) is due."""
+        if self.mode == 'max':
+            return
+        new_row = timestamp != self.last_time
+        deadline = self.deadline(timestamp)
+
+        now = self.clock()
+        remaining = deadline - now
+        if remaining > self.spin:
+            self.sleep(remaining - self.spin)
+        # spin for the last moment, sleep() is not precise enough
+        now = self.clock()
+        while now < deadline:
+            now = self.clock()
+
+        if new_row:
+            late = now - deadline
+            self.late_total += late
+            if late > self.late_max:
+                self.late_max = late
+
+    def report(self) -> str:
+        """Return a one-line summary of how closely the replay kept to schedule."""
+        mean = self.late_total / self.rows if self.rows else 0.0
+        return f"replay {self.mode}: {self.rows} rows, lateness mean {mean * 1000:.3f}ms max {self.late_max * 1000:.3f}ms"
+
+def make_scheduler():
+    """Create a ReplayScheduler from the replay variables above."""
+    return ReplayScheduler(replay_mode, replay_speed, replay_rate)
+
 def offer_rabbitmq_admin_site(show_offer):
     """Offer to open the RabbitMQ Admin website by using True or False"""
     if show_offer == 'True':
@@ -30,6 +203,108 @@ def offer_rabbitmq_admin_site(show_offer):
             webbrowser.open_new("http://localhost:15672/#/queues")
             print()
 
+class DeadbandFilter:
+    """
+    Decide which readings of one channel are worth sending.
+
+    A reading is kept when it is the first one, when it differs from the last
+    kept reading by more than `epsilon`, or when `heartbeat` seconds have
+    passed since the last kept reading. Comparing with the last kept reading
+    (not the previous one) means a slow drift is still sent once it adds up.
+    """
+
+    __slots__ = ("epsilon", "heartbeat", "last_time", "last_temp", "kept", "skipped")
+
+    def __init__(self, epsilon=0.0, heartbeat=300):
+        self.epsilon = epsilon
+        self.heartbeat = heartbeat
+        self.last_time = None
+        self.last_temp = None
+        self.kept = 0
+        self.skipped = 0
+
+    def keep(self, timestamp, temp) -> bool:
+        """Return True if the reading should be sent."""
+        if (self.last_time is None
+                or abs(temp - self.last_temp) > self.epsilon
+                or timestamp - self.last_time >= self.heartbeat):
+            self.last_time = timestamp
+            self.last_temp = temp
+            self.kept += 1
+            return True
+        self.skipped += 1
+        return False
+
+def deadband_filter(queue):
+    """Return the queue's DeadbandFilter, creating it on first use."""
+    if queue not in deadband_filters:
+        deadband_filters[queue] = DeadbandFilter(deadband_epsilon, deadband_heartbeat)
+    return deadband_filters[queue]
+
+def deadband_report():
+    """One line per channel with how many readings the deadband filter kept."""
+    return "\n".join(
+        f" [x] deadband {queue}: sent {f.kept} of {f.kept + f.skipped} readings"
+        for queue, f in deadband_filters.items()
+    )
+
+def encode_message(queue, Time, temp):
+    """
+    Encode a reading in the configured wire format, returns (message, properties).
+    When frames are on, returns (None, None) until the queue's frame is ready.
+    Also returns (None, None) for readings the deadband filter skips.
+    """
+    if deadband_epsilon is not None and not deadband_filter(queue).keep(parse_time(Time), temp):
+        return None, None
+    if frame_size > 1:
+        if queue not in frame_buffers:
+            frame_buffers[queue] = FrameBuffer(frame_size, frame_max_delay)
+        frame = frame_buffers[queue].add(parse_time(Time), sensor_ids[queue], temp)
+        if frame is None:
+            return None, None
+        return frame, frame_properties
+    if wire_format == 'binary':
+        return encode_binary(parse_time(Time), sensor_ids[queue], temp), binary_properties
+    return f"{Time}, {temp}".encode(), text_properties
+
+def stamp(queue, properties):
+    """Return a copy of the properties with the x-sent-at and x-seq headers."""
+    if not stamp_messages:
+        return properties
+    seq = sequence_numbers.get(queue, 0) + 1
+    sequence_numbers[queue] = seq
+    return pika.BasicProperties(content_type=properties.content_type, headers=stamp_headers(seq))
+
+def exchange_for_mode():
+    """Return the exchange to publish to for the routing_mode."""
+    if routing_mode == 'topic':
+        return topic_exchange
+    if routing_mode == 'hash':
+        return hash_exchange
+    return ""
+
+def routing_key_for(queue):
+    """Return the routing key for a reading meant for `queue`."""
+    if routing_mode == 'queue':
+        return queue
+    return f"{smoker_id}.{channel_names[queue]}"
+
+def declare_exchange(ch):
+    """Declare the durable topic or consistent-hash exchange for the routing_mode."""
+    exchange_type = 'topic' if routing_mode == 'topic' else 'x-consistent-hash'
+    ch.exchange_declare(exchange=exchange_for_mode(), exchange_type=exchange_type, durable=True)
+
+def flush_frames(force=False):
+    """
+    Yield (queue, frame) for every frame that is due, or every partly
+    filled frame when force is True (at the end of the data).
+    """
+    for queue, frame_buffer in frame_buffers.items():
+        if force or frame_buffer.due():
+            frame = frame_buffer.flush()
+            if frame is not None:
+                yield queue, frame
+
 def send_message():
     """
     Creates and sends a message to the queue each execution.
@@ -45,59 +320,84 @@ def send_message():
 
         try:
             # create a blocking connection to the RabbitMQ server
-            conn = pika.BlockingConnection(pika.ConnectionParameters(host))
+            # (or to the in-process broker with transport = 'local', see bbq_transport.py)
+            conn = connect(host)
             # use the connection to create a communication channel
             ch = conn.channel()
-            # delete the queue on starup to clear them before initiating them again
-            ch.queue_delete(smoker_queue)
-            ch.queue_delete(food_a_queue)
-            ch.queue_delete(food_b_queue)
-
-            # use the channel to declare a durable queue
-            # a durable queue will survive a  server restart
-            # and help ensure messages are processed in order
-            # messages will not be deleted until the consumer acknowledges
-            ch.queue_declare(queue=smoker_queue, durable=True)
-            ch.queue_declare(queue=food_a_queue, durable=True)
-            ch.queue_declare(queue=food_b_queue, durable=True)
+            if routing_mode == 'queue':
+                # delete the queue on starup to clear them before initiating them again
+                ch.queue_delete(smoker_queue)
+                ch.queue_delete(food_a_queue)
+                ch.queue_delete(food_b_queue)
+
+                # use the channel to declare a durable queue
+                # a durable queue will survive a  server restart
+                # and help ensure messages are processed in order
+                # messages will not be deleted until the consumer acknowledges
+                ch.queue_declare(queue=smoker_queue, durable=True)
+                ch.queue_declare(queue=food_a_queue, durable=True)
+                ch.queue_declare(queue=food_b_queue, durable=True)
+            else:
+                # the consumers declare and bind their own queues to the exchange
+                declare_exchange(ch)
+            exchange = exchange_for_mode()
     
+            # pace the replay (see replay_mode above)
+            scheduler = make_scheduler()
+
             # set the variables for reach column in the row
             for row in reader:
                 Time,Channel1,Channel2,Channel3 = row
+                # wait until this row is due
+                scheduler.wait(parse_time(Time))
 
                 # For Smoker, Food_A, and Food_B, the below steps will be followed:
                 # use the round() function to round 2 decimal places
                 # use the float() function to convert the string to a float
-                # use an fstring to create a message from our data
-                # prepare a binary message to stream
+                # encode the message in the configured wire format (text or binary)
                 # use the channel to publish a message to the queue
 
                 try:
                     smoker_channel1 = round(float(Channel1), 2)
-                    smoker_data = f"{Time}, {smoker_channel1}"
-                    smoker_message = str(smoker_data).encode()
-                    ch.basic_publish(exchange="", routing_key=smoker_queue, body=smoker_message)
-                    print(f" [x] sent {smoker_message}")
+                    smoker_message, properties = encode_message(smoker_queue, Time, smoker_channel1)
+                    if smoker_message is not None:
+                        ch.basic_publish(exchange=exchange, routing_key=routing_key_for(smoker_queue), body=smoker_message, properties=stamp(smoker_queue, properties))
+                        output.message(sent_line, smoker_message)
                 except ValueError:
                     pass
 
                 try:
                     food_a_channel2 = round(float(Channel2), 2)
-                    food_a_data = f"{Time}, {food_a_channel2}"
-                    food_a_message = str(food_a_data).encode()
-                    ch.basic_publish(exchange="", routing_key=food_a_queue, body=food_a_message)
-                    print(f" [x] sent {food_a_message}")
+                    food_a_message, properties = encode_message(food_a_queue, Time, food_a_channel2)
+                    if food_a_message is not None:
+                        ch.basic_publish(exchange=exchange, routing_key=routing_key_for(food_a_queue), body=food_a_message, properties=stamp(food_a_queue, properties))
+                        output.message(sent_line, food_a_message)
                 except ValueError:
                     pass    
 
                 try:
                     food_b_channel3 = round(float(Channel3), 2)
-                    food_b_data = f"{Time}, {food_b_channel3}"
-                    food_b_message = str(food_b_data).encode()
-                    ch.basic_publish(exchange="", routing_key=food_b_queue, body=food_b_message)
-                    print(f" [x] sent {food_b_message}")
+                    food_b_message, properties = encode_message(food_b_queue, Time, food_b_channel3)
+                    if food_b_message is not None:
+                        ch.basic_publish(exchange=exchange, routing_key=routing_key_for(food_b_queue), body=food_b_message, properties=stamp(food_b_queue, properties))
+                        output.message(sent_line, food_b_message)
                 except ValueError:
                     pass
+
+                # send any frame that has waited frame_max_delay seconds
+                for queue, frame in flush_frames():
+                    ch.basic_publish(exchange=exchange, routing_key=routing_key_for(queue), body=frame, properties=stamp(queue, frame_properties))
+                    output.message(f" [x] sent frame of {len(frame) // reading_struct.size} readings to {queue}")
+
+            # send the frames that are still partly filled
+            for queue, frame in flush_frames(force=True):
+                ch.basic_publish(exchange=exchange, routing_key=routing_key_for(queue), body=frame, properties=stamp(queue, frame_properties))
+                output.message(f" [x] sent frame of {len(frame) // reading_struct.size} readings to {queue}")
+
+            if scheduler.paced:
+                output.info(f" [x] {scheduler.report()}")
+            if deadband_filters:
+                output.info(deadband_report())
         
         except pika.exceptions.AMQPConnectionError as e:
             print(f"Error: Connection to RabbitMQ server failed: {e}")
@@ -106,6 +406,198 @@ def send_message():
         finally:
             # close the connection to the server
             conn.close()
+            # write the log lines that are still waiting
+            output.close()
+
+def read_messages():
+    """
+    Read the CSV file and yield a (queue, message, properties) tuple for every
+    reading or frame, each once it is due (see replay_mode).
+    """
+    scheduler = make_scheduler()
+    for timestamp, queue, message, properties in read_timed_messages(scheduler.paced):
+        scheduler.wait(timestamp)
+        yield queue, message, properties
+
+def read_timed_messages(sort_by_time=False):
+    """
+    Read the CSV file and yield a (timestamp, queue, message, properties) tuple
+    for every reading or frame as fast as it is read, the caller paces them.
+    Empty Channel values are skipped, like in send_message().
+    """
+    if ingest_mode == 'numpy':
+        yield from read_messages_vectorized(sort_by_time)
+        return
+    timestamp = None
+    with open(data_file, 'r') as file:
+        reader = csv.reader(file, delimiter= ',')
+        header = next(reader)
+        for row in reader:
+            Time,Channel1,Channel2,Channel3 = row
+            timestamp = parse_time(Time)
+            for queue, channel in ((smoker_queue, Channel1), (food_a_queue, Channel2), (food_b_queue, Channel3)):
+                try:
+                    temp = round(float(channel), 2)
+                except ValueError:
+                    continue
+                message, properties = encode_message(queue, Time, temp)
+                if message is not None:
+                    yield timestamp, queue, message, properties
+            for queue, frame in flush_frames():
+                yield timestamp, queue, frame, frame_properties
+    for queue, frame in flush_frames(force=True):
+        yield timestamp, queue, frame, frame_properties
+
+def read_messages_vectorized(sort_by_time=False):
+    """
+    Read the CSV file with bbq_ingest (memory-mapped, parsed column by column)
+    and yield a (timestamp, queue, message, properties) tuple for every reading
+    or frame. Each chunk of the file is pre-split into one stream per queue
+    first. With sort_by_time (a paced replay), each chunk's messages are put
+    back in time order.
+
+    Frames hold the same readings as on the csv path: a queue's partly filled
+    frame carries over into the next chunk and is only sent once it is full,
+    at the end of the data, or when its oldest reading has waited
+    frame_max_delay seconds. That wait is checked after each chunk instead of
+    after each row, and without sort_by_time the messages of a chunk go out
+    queue by queue rather than row by row.
+    """
+    from bbq_ingest import read_streams
+
+    for streams in read_streams(data_file):
+        messages = encode_streams(streams)
+        if sort_by_time:
+            # sorted() is stable, so messages with the same time keep their order
+            messages = sorted(messages, key=itemgetter(0))
+        yield from messages
+        # send any frame that has waited frame_max_delay seconds
+        for queue, frame in flush_frames():
+            yield frame_buffers[queue].newest, queue, frame, frame_properties
+    # send the frames that are still partly filled
+    for queue, frame in flush_frames(force=True):
+        yield frame_buffers[queue].newest, queue, frame, frame_properties
+
+def encode_streams(streams):
+    """Yield (timestamp, queue, message, properties) for a chunk of per-queue streams."""
+    from bbq_ingest import encode_binary_stream
+
+    for queue, stream in streams.items():
+        if deadband_epsilon is not None:
+            # the filter depends on the last reading kept, so it runs reading by reading
+            keep = deadband_filter(queue).keep
+            kept = [index for index, (timestamp, temp)
+                    in enumerate(zip(stream.times.tolist(), stream.temps.tolist()))
+                    if keep(timestamp, temp)]
+            stream = type(stream)(*(column[kept] for column in stream))
+        count = len(stream.times)
+        if count == 0:
+            continue
+        times = stream.times.tolist()
+        if frame_size > 1:
+            # pack the whole stream at once and cut it into frames where the
+            # csv path's FrameBuffer would, carrying on the frame the last chunk left
+            records = encode_binary_stream(stream, sensor_ids[queue])
+            if queue not in frame_buffers:
+                frame_buffers[queue] = FrameBuffer(frame_size, frame_max_delay)
+            frame_buffer = frame_buffers[queue]
+            size = reading_struct.size
+            first = 0
+            while first < count:
+                if len(frame_buffer) == 0 and count - first >= frame_size:
+                    # a whole frame straight from the stream
+                    last = first + frame_size
+                    frame = records[first * size:last * size]
+                else:
+                    last = min(first + frame_size - len(frame_buffer), count)
+                    frame = frame_buffer.extend(records[first * size:last * size], last - first, times[last - 1])
+                first = last
+                if frame is not None:
+                    # a frame is due when its last reading is
+                    yield times[last - 1], queue, frame, frame_properties
+        elif wire_format == 'binary':
+            # pack the whole stream at once and slice it into messages
+            records = encode_binary_stream(stream, sensor_ids[queue])
+            step = reading_struct.size
+            for first in range(count):
+                yield times[first], queue, records[first * step:(first + 1) * step], binary_properties
+        else:
+            for time_string, timestamp, temp in zip(stream.time_strings.tolist(), times, stream.temps.tolist()):
+                yield timestamp, queue, time_string + b", " + str(temp).encode(), text_properties
+
+def send_message_vectorized():
+    """
+    Send every reading using the memory-mapped NumPy ingestion path.
+    The same messages as send_message(), frames included, but a chunk's
+    messages are sent queue by queue and frame_max_delay is only checked
+    between chunks (see read_messages_vectorized).
+    This process runs and finishes.
+    """
+    conn = None
+    try:
+        # create a blocking connection to the RabbitMQ server
+        conn = connect(host)
+        ch = conn.channel()
+        if routing_mode == 'queue':
+            # delete the queues on startup to clear them and declare them again
+            for queue in (smoker_queue, food_a_queue, food_b_queue):
+                ch.queue_delete(queue)
+                ch.queue_declare(queue=queue, durable=True)
+        else:
+            declare_exchange(ch)
+        exchange = exchange_for_mode()
+        for queue, message, properties in read_messages():
+            ch.basic_publish(exchange=exchange, routing_key=routing_key_for(queue), body=message, properties=stamp(queue, properties))
+            output.message(sent_line, message)
+        if deadband_filters:
+            output.info(deadband_report())
+
+    except pika.exceptions.AMQPConnectionError as e:
+        print(f"Error: Connection to RabbitMQ server failed: {e}")
+        sys.exit(1)
+
+    finally:
+        # close the connection to the server
+        if conn is not None:
+            conn.close()
+        output.close()
+
+def send_message_confirmed():
+    """
+    Send every reading with batched, pipelined publishing and publisher confirms.
+    Prints the sustained msgs/sec and confirm latency when the run is done.
+    """
+    if routing_mode == 'queue':
+        queues, exchange_type = [smoker_queue, food_a_queue, food_b_queue], None
+    else:
+        queues = []
+        exchange_type = 'topic' if routing_mode == 'topic' else 'x-consistent-hash'
+    # the publisher runs in an ioloop callback, which must never sleep: each
+    # message carries its deadline instead, and one that is not due yet is
+    # held and published from an ioloop timer
+    scheduler = make_scheduler()
+    messages = ((routing_key_for(queue), message, properties, scheduler.deadline(timestamp) if scheduler.paced else None)
+                for timestamp, queue, message, properties in read_timed_messages(scheduler.paced))
+    # stamp the headers when a message is published, not when it is read
+    queue_for_key = {routing_key_for(queue): queue for queue in (smoker_queue, food_a_queue, food_b_queue)}
+    publisher = ConfirmedPublisher(
+        host,
+        queues,
+        messages,
+        batch_size=batch_size,
+        max_in_flight=max_in_flight,
+        exchange=exchange_for_mode(),
+        exchange_type=exchange_type,
+        stamp=lambda routing_key, properties: stamp(queue_for_key[routing_key], properties),
+    )
+    try:
+        stats = publisher.run()
+    except pika.exceptions.AMQPError as e:
+        print(f"Error: Connection to RabbitMQ server failed: {e}")
+        sys.exit(1)
+    print(f" [x] {stats.report()}")
+    if deadband_filters:
+        print(deadband_report())
 
 # Standard Python idiom to indicate main program entry point
 # This allows us to import this module and use its functions
@@ -116,6 +608,11 @@ if __name__ == "__main__":
     # ask the user if they would like to open the RabbitMQ Admmin
     offer_rabbitmq_admin_site('True')
     # Send Message
-    send_message()
+    if publish_mode == 'confirmed':
+        send_message_confirmed()
+    elif ingest_mode == 'numpy':
+        send_message_vectorized()
+    else:
+        send_message()
     # sleep should be for 30 seconds as the assignment calls
     time.sleep(30)
\ No newline at end of file
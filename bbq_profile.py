@@ -0,0 +1,191 @@
+"""
+    Opt-in profiling of the consumers' message callback.
+
+    StageTimers splits the time spent in the callback into stages:
+        decode   reading the headers, content_type dispatch, splitting the
+                 text and float() (or struct unpack)
+        print    printing the received reading
+        window   adding the reading to the event-time windows
+        rules    evaluating the alert rules
+        alert    printing the alerts
+        ack      basic_ack (or handing the tag to the AckBatcher)
+    The callback calls stages.start() when a message arrives and
+    stages.mark(stage) at the end of each stage. While the timers are off
+    both are a shared no-op function, so leaving the calls in the hot path
+    costs a few tens of nanoseconds per message.
+
+    SamplingProfiler is a statistical profiler: a background thread looks at
+    the main thread's stack every few milliseconds and counts each distinct
+    stack. dump() writes them in the folded format flame graph tools read
+    (one "outer;inner;leaf count" line per stack), e.g.
+        flamegraph.pl profile-1234-1.folded > profile.svg
+    or open the file in speedscope.
+
+    install_signal_handlers() lets you turn both on and off in a running
+    consumer without restarting it (POSIX only):
+        kill -USR1 <pid>   start the sampler / stop it and dump the profile
+        kill -USR2 <pid>   start the stage timers / stop them and print the table
+
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+# Define the variables
+# seconds between stack samples
+default_sample_interval = 0.005
+stage_names = ("decode", "print", "window", "rules", "alert", "ack")
+
+
+def _off(*args):
+    """Stand-in for start() and mark() while the timers are off."""
+
+
+class StageTimers:
+    """Per-stage time and call counters for the message callback."""
+
+    def __init__(self, enabled: bool = False, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.totals = dict.fromkeys(stage_names, 0)
+        self.counts = dict.fromkeys(stage_names, 0)
+        self.messages = 0
+        self.last = 0
+        self.enabled = False
+        self.start = _off
+        self.mark = _off
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        """Reset the counters and start timing."""
+        self.reset()
+        self.enabled = True
+        self.start = self._start
+        self.mark = self._mark
+
+    def disable(self):
+        self.enabled = False
+        self.start = _off
+        self.mark = _off
+
+    def toggle(self):
+        """Turn the timers on, or off and print what they measured."""
+        if self.enabled:
+            self.disable()
+            print(self.report())
+        else:
+            self.enable()
+            print(" [p] Stage timers on")
+
+    def reset(self):
+        self.totals = dict.fromkeys(stage_names, 0)
+        self.counts = dict.fromkeys(stage_names, 0)
+        self.messages = 0
+
+    def _start(self):
+        self.messages += 1
+        self.last = self.clock()
+
+    def _mark(self, stage: str):
+        now = self.clock()
+        self.totals[stage] = self.totals.get(stage, 0) + now - self.last
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        self.last = now
+
+    def report(self) -> str:
+        total = sum(self.totals.values()) or 1
+        lines = [f" [p] {self.messages} messages, {total / 1e6:.1f} ms in the callback",
+                 f"{'stage':>10} {'calls':>10} {'total ms':>10} {'mean us':>10} {'share':>7}"]
+        for stage, spent in self.totals.items():
+            calls = self.counts[stage]
+            mean = spent / calls / 1000 if calls else 0
+            lines.append(f"{stage:>10} {calls:>10} {spent / 1e6:>10.2f} {mean:>10.2f} {spent / total:>7.1%}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """
+    Sample one thread's stack from a background thread and count the stacks.
+
+    Parameters:
+        interval (float): seconds between samples
+        thread_id (int): the thread to sample, the main thread by default
+    """
+
+    def __init__(self, interval: float = default_sample_interval, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.stacks = Counter()
+        self.samples = 0
+        self.dumps = 0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="bbq-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            names.reverse()
+            self.stacks[";".join(names)] += 1
+            self.samples += 1
+
+    def dump(self, path: str = None) -> str:
+        """Write the folded stacks, most frequent first, and return the file name."""
+        self.dumps += 1
+        path = path or f"profile-{os.getpid()}-{self.dumps}.folded"
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        return path
+
+    def toggle(self):
+        """Start sampling, or stop and dump the profile."""
+        if self.running:
+            self.stop()
+            path = self.dump()
+            print(f" [p] Wrote {self.samples} samples to {path}")
+        else:
+            self.start()
+            print(f" [p] Sampling every {self.interval * 1000:g} ms")
+
+
+def install_signal_handlers(stages: StageTimers, profiler: SamplingProfiler):
+    """SIGUSR1 toggles the sampling profiler, SIGUSR2 the stage timers (POSIX only)."""
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+    # only the main thread can set signal handlers, e.g. not a consumer run by bbq_pipeline_benchmark.py
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: stages.toggle())
+    return True
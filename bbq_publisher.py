@@ -0,0 +1,308 @@
+"""
+    High-throughput publishing with publisher confirms for bbq_producer.py.
+
+    The basic producer calls basic_publish once per message on a
+    BlockingConnection and never learns whether RabbitMQ actually received it.
+    ConfirmedPublisher uses an asynchronous pika.SelectConnection instead:
+        * the channel is put in confirm mode, so the broker acks (or nacks)
+          every message it takes responsibility for
+        * messages are published in batches without waiting for each ack
+        * at most `max_in_flight` messages may be unconfirmed at any time,
+          publishing pauses until acks bring the count back down
+        * nacked messages are published again
+        * a message may carry the clock time it is due (a paced replay), one
+          that is not due yet is held and published from an ioloop timer, the
+          loop never sleeps
+    At the end of a run it reports the sustained messages per second and the
+    publish-to-confirm latency.
+
+"""
+
+import time
+from array import array
+from collections import deque
+
+import pika
+
+
+class PublishStats:
+    """Counters and confirm latencies collected during a run."""
+
+    def __init__(self):
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.started = None
+        self.finished = None
+        # confirm latency of every message in seconds, stored compactly
+        self.latencies = array("d")
+        # how far behind its due time each paced message was published, in seconds
+        self.paced = 0
+        self.late_total = 0.0
+        self.late_max = 0.0
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def rate(self) -> float:
+        """Return the sustained confirmed messages per second."""
+        elapsed = self.elapsed()
+        return self.confirmed / elapsed if elapsed else 0.0
+
+    def latency_percentile(self, percent: float) -> float:
+        """Return a confirm latency percentile in milliseconds."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index] * 1000
+
+    def report(self) -> str:
+        """Return a one-line summary of the run."""
+        line = (
+            f"published={self.published} confirmed={self.confirmed} nacked={self.nacked} "
+            f"elapsed={self.elapsed():.2f}s rate={self.rate():.0f} msgs/sec "
+            f"confirm latency p50={self.latency_percentile(50):.2f}ms "
+            f"p99={self.latency_percentile(99):.2f}ms "
+            f"max={self.latency_percentile(100):.2f}ms"
+        )
+        if self.paced:
+            line += (f" replay lateness mean={self.late_total / self.paced * 1000:.3f}ms "
+                     f"max={self.late_max * 1000:.3f}ms")
+        return line
+
+
+class ConfirmedPublisher:
+    """
+    Publish (routing_key, body) messages with pipelined publisher confirms.
+
+    Parameters:
+        host (str): the host name or IP address of the RabbitMQ server
+        queues (list): queues to delete and declare (durable) before publishing
+        messages (iterable): (routing_key, body), (routing_key, body, properties)
+            or (routing_key, body, properties, due), where due is the
+            time.perf_counter() time to publish it at (None = at once)
+        batch_size (int): messages published per turn of the I/O loop
+        max_in_flight (int): most unconfirmed messages allowed at once
+        exchange (str): exchange to publish to ("" = the default exchange)
+        exchange_type (str): declare the exchange as this type (durable) before publishing
+        stamp (callable): stamp(routing_key, properties) -> properties, called
+            just before a message is first published, e.g. to set a sent-at header
+    """
+
+    def __init__(self, host, queues, messages, batch_size=500, max_in_flight=5000,
+                 exchange="", exchange_type=None, stamp=None):
+        if batch_size < 1 or max_in_flight < 1:
+            raise ValueError("batch_size and max_in_flight must be at least 1")
+        self.host = host
+        self.queues = list(queues)
+        self.messages = iter(messages)
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.stamp = stamp
+        self.stats = PublishStats()
+
+        self.connection = None
+        self.channel = None
+        self.error = None
+        # delivery tag -> (send time, routing_key, body, properties)
+        self.outstanding = {}
+        # oldest delivery tag that may still be unconfirmed
+        self.oldest_tag = 1
+        self.next_tag = 1
+        # nacked messages waiting to be published again
+        self.retry = deque()
+        # the next message, held until it is due
+        self.held = None
+        self.exhausted = False
+        self.publish_scheduled = False
+        self.closing = False
+
+    def run(self) -> PublishStats:
+        """Publish every message and return the stats once all are confirmed."""
+        self.connection = pika.SelectConnection(
+            pika.ConnectionParameters(self.host),
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_open_error,
+            on_close_callback=self.on_connection_closed,
+        )
+        self.connection.ioloop.start()
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+    # connection and channel set-up
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_open_error(self, connection, error):
+        if isinstance(error, pika.exceptions.AMQPError):
+            self.error = error
+        else:
+            self.error = pika.exceptions.AMQPConnectionError(error)
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason):
+        if not self.closing and self.error is None:
+            self.error = pika.exceptions.AMQPConnectionError(reason)
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        if self.exchange and self.exchange_type:
+            channel.exchange_declare(
+                exchange=self.exchange,
+                exchange_type=self.exchange_type,
+                durable=True,
+                callback=lambda _frame: self.setup_queues(list(self.queues)),
+            )
+        else:
+            self.setup_queues(list(self.queues))
+
+    def on_channel_closed(self, channel, reason):
+        if not self.closing:
+            self.error = pika.exceptions.AMQPChannelError(reason)
+            self.closing = True
+            self.connection.close()
+
+    def setup_queues(self, remaining):
+        """Delete and declare each queue in turn, then enable confirms."""
+        if not remaining:
+            self.channel.confirm_delivery(self.on_confirm, callback=self.on_confirm_select)
+            return
+        queue = remaining.pop(0)
+
+        def declare(_frame):
+            self.channel.queue_declare(
+                queue=queue, durable=True, callback=lambda _f: self.setup_queues(remaining)
+            )
+
+        self.channel.queue_delete(queue=queue, callback=declare)
+
+    def on_confirm_select(self, _frame):
+        self.stats.started = time.perf_counter()
+        self.schedule_publish()
+
+    # publishing
+
+    def schedule_publish(self):
+        """Publish the next batch on the next turn of the I/O loop."""
+        if not self.publish_scheduled and not self.closing:
+            self.publish_scheduled = True
+            self.connection.ioloop.call_later(0, self.publish_batch)
+
+    def next_message(self):
+        """Return the next (routing_key, body, properties, due) from the messages, or None."""
+        if self.held is not None:
+            message, self.held = self.held, None
+            return message
+        if self.exhausted:
+            return None
+        try:
+            message = next(self.messages)
+        except StopIteration:
+            self.exhausted = True
+            return None
+        if len(message) == 4:
+            return message
+        if len(message) == 2:
+            return message[0], message[1], None, None
+        return message[0], message[1], message[2], None
+
+    def is_due(self, message) -> bool:
+        """True if the message is due, otherwise hold it and publish again once it is."""
+        now = time.perf_counter()
+        remaining = message[3] - now
+        if remaining > 0:
+            self.held = message
+            # a timer rather than a sleep, so confirms keep being handled meanwhile
+            self.publish_scheduled = True
+            self.connection.ioloop.call_later(remaining, self.publish_batch)
+            return False
+        late = -remaining
+        self.stats.paced += 1
+        self.stats.late_total += late
+        if late > self.stats.late_max:
+            self.stats.late_max = late
+        return True
+
+    def publish_batch(self):
+        """Publish up to batch_size messages without passing max_in_flight."""
+        self.publish_scheduled = False
+        if self.closing:
+            return
+        channel = self.channel
+        outstanding = self.outstanding
+        published = 0
+        while published < self.batch_size and len(outstanding) < self.max_in_flight:
+            if self.retry:
+                # published before, so already stamped
+                routing_key, body, properties = self.retry.popleft()
+            else:
+                message = self.next_message()
+                if message is None:
+                    break
+                if message[3] is not None and not self.is_due(message):
+                    break
+                routing_key, body, properties, _due = message
+                if self.stamp is not None:
+                    properties = self.stamp(routing_key, properties)
+            channel.basic_publish(
+                exchange=self.exchange, routing_key=routing_key, body=body, properties=properties
+            )
+            outstanding[self.next_tag] = (time.perf_counter(), routing_key, body, properties)
+            self.next_tag += 1
+            published += 1
+        self.stats.published += published
+
+        if self.exhausted and not self.retry and not outstanding:
+            self.finish()
+        elif published and len(outstanding) < self.max_in_flight:
+            # more room in the window, keep the pipeline full
+            self.schedule_publish()
+        # otherwise on_confirm, or the timer of a held message, schedules the next batch
+
+    def on_confirm(self, frame):
+        """Handle a Basic.Ack or Basic.Nack from the broker."""
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        now = time.perf_counter()
+        outstanding = self.outstanding
+
+        if method.multiple:
+            tags = range(self.oldest_tag, method.delivery_tag + 1)
+        else:
+            tags = (method.delivery_tag,)
+        for tag in tags:
+            message = outstanding.pop(tag, None)
+            if message is None:
+                continue
+            if acked:
+                self.stats.confirmed += 1
+                self.stats.latencies.append(now - message[0])
+            else:
+                self.stats.nacked += 1
+                self.retry.append(message[1:])
+
+        # move past every tag that has been confirmed
+        while self.oldest_tag < self.next_tag and self.oldest_tag not in outstanding:
+            self.oldest_tag += 1
+
+        if self.exhausted and not self.retry and not outstanding:
+            self.finish()
+        else:
+            self.schedule_publish()
+
+    def finish(self):
+        """Every message is confirmed, close the connection and stop the loop."""
+        if self.closing:
+            return
+        self.stats.finished = time.perf_counter()
+        self.closing = True
+        self.connection.close()
@@ -0,0 +1,201 @@
+"""
+    Helpers to encode the readings sent by bbq_producer.py and decode them
+    in the consumers.
+
+    There are two wire formats, told apart by the AMQP content_type header:
+
+    text/plain (the original format) is a string like "05/22/21 12:20:15, 84.2":
+        [0] Time = Date-time stamp for the sensor reading (UTC)
+        [1] Temp = the temperature reading in degrees F
+
+    application/x-bbq-reading is a fixed-width 14 byte record packed with struct:
+        int64   Time as epoch seconds (UTC)
+        uint16  sensor id (see sensor_ids)
+        float32 Temp in degrees F
+    It is smaller on the wire and decodes with a single struct.unpack_from
+    straight out of the message body, without decoding or splitting a string.
+
+    application/x-bbq-frame packs many binary readings into one message, the
+    body is just the 14 byte records back to back (count = len(body) // 14).
+    FrameBuffer collects readings on the producer side and hands back a frame
+    once it holds `max_readings` or its oldest reading has waited `max_delay`
+    seconds, so fewer, larger messages trade a little latency for throughput.
+
+    Messages without a content_type are treated as text, so consumers keep
+    working with older producers.
+
+    Timestamps are converted to whole epoch seconds (an int) so the consumer
+    windows can compare and store them cheaply.
+
+"""
+
+import calendar
+import struct
+import time
+
+# Define the variables
+# format of the Time column in smoker-temps.csv, e.g. 05/22/21 12:20:15
+time_format = "%m/%d/%y %H:%M:%S"
+
+# epoch seconds of midnight for every date string seen so far
+# a cook spans a day or two, so this stays tiny and saves a strptime per message
+_midnight_cache = {}
+
+# content types advertised in the AMQP message properties
+text_content_type = "text/plain"
+binary_content_type = "application/x-bbq-reading"
+frame_content_type = "application/x-bbq-frame"
+
+# little-endian int64 timestamp, uint16 sensor id, float32 temp = 14 bytes
+reading_struct = struct.Struct("<qHf")
+
+# sensor id carried in binary readings for each queue
+sensor_ids = {
+    "01-smoker": 1,
+    "02-food-A": 2,
+    "02-food-B": 3,
+}
+
+
+def parse_time(text: str) -> int:
+    """Convert a Time stamp like '05/22/21 12:20:15' to epoch seconds (UTC)."""
+    text = text.strip()
+    if len(text) != 17 or text[8] != " ":
+        # let strptime deal with (and complain about) anything unusual
+        return calendar.timegm(time.strptime(text, time_format))
+    date = text[:8]
+    midnight = _midnight_cache.get(date)
+    if midnight is None:
+        midnight = calendar.timegm(time.strptime(date, "%m/%d/%y"))
+        _midnight_cache[date] = midnight
+    try:
+        hours = int(text[9:11])
+        minutes = int(text[12:14])
+        seconds = int(text[15:17])
+    except ValueError:
+        raise ValueError(f"time data {text!r} does not match format {time_format!r}")
+    return midnight + hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(timestamp: int) -> str:
+    """Convert epoch seconds back to the Time format used in the CSV file."""
+    return time.strftime(time_format, time.gmtime(timestamp))
+
+
+def parse_reading(body: bytes):
+    """
+    Split a message body into (timestamp, temp).
+    Raises ValueError if the message is not a valid reading.
+    """
+    reading_string = body.decode()
+    time_string, _, temp = reading_string.partition(",")
+    if not temp:
+        raise ValueError(f"not a reading: {reading_string!r}")
+    return parse_time(time_string), float(temp)
+
+
+def encode_binary(timestamp: int, sensor_id: int, temp: float) -> bytes:
+    """Pack a reading into the 14 byte application/x-bbq-reading format."""
+    return reading_struct.pack(timestamp, sensor_id, temp)
+
+
+def unpack_binary(body: bytes, offset: int = 0):
+    """Unpack (timestamp, sensor_id, temp) from a binary reading."""
+    return reading_struct.unpack_from(body, offset)
+
+
+def decode_reading(properties, body: bytes):
+    """
+    Return (timestamp, temp) for a message in either wire format.
+    The content_type in the message properties picks the decoder.
+    Raises ValueError if the message is not a valid reading.
+    """
+    content_type = properties.content_type if properties is not None else None
+    if content_type == binary_content_type:
+        try:
+            timestamp, sensor_id, temp = reading_struct.unpack_from(body)
+        except struct.error as e:
+            raise ValueError(f"not a binary reading: {e}")
+        # float32 cannot hold 84.2 exactly, the producer rounds to 2 decimal
+        # places so rounding here gives back exactly what the text format sends
+        return timestamp, round(temp, 2)
+    return parse_reading(body)
+
+
+def decode_readings(properties, body: bytes):
+    """
+    Return an iterable of (timestamp, temp) for a message in any wire format.
+    A frame yields all of its readings, a single reading yields one.
+    Raises ValueError if the message is not valid.
+    """
+    content_type = properties.content_type if properties is not None else None
+    if content_type == frame_content_type:
+        if len(body) % reading_struct.size:
+            raise ValueError(f"frame of {len(body)} bytes is not a whole number of readings")
+        # iter_unpack reads the records straight out of the body without copies
+        return [(timestamp, round(temp, 2)) for timestamp, sensor_id, temp in reading_struct.iter_unpack(body)]
+    return (decode_reading(properties, body),)
+
+
+class FrameBuffer:
+    """
+    Collect binary readings for one queue into application/x-bbq-frame messages.
+
+    A frame is ready when it holds `max_readings` readings, or when the oldest
+    reading in it has waited `max_delay` seconds (wall clock).
+    """
+
+    def __init__(self, max_readings: int, max_delay: float):
+        if max_readings < 1:
+            raise ValueError("max_readings must be at least 1")
+        self.max_readings = max_readings
+        self.max_delay = max_delay
+        self.buffer = bytearray()
+        self.count = 0
+        # time.monotonic() when the oldest buffered reading was added
+        self.started = None
+        # timestamp of the newest reading added, the time a flushed frame is due
+        self.newest = None
+
+    def add(self, timestamp: int, sensor_id: int, temp: float):
+        """Add a reading, returns a finished frame (bytes) or None."""
+        if self.count == 0:
+            self.started = time.monotonic()
+        self.buffer += reading_struct.pack(timestamp, sensor_id, temp)
+        self.count += 1
+        self.newest = timestamp
+        if self.count >= self.max_readings or self.due():
+            return self.flush()
+        return None
+
+    def extend(self, records: bytes, count: int, newest: int):
+        """
+        Add `count` readings already packed back to back (no more than fit in
+        the frame), e.g. a slice of a stream from bbq_ingest.encode_binary_stream.
+        Returns a finished frame (bytes) or None, like add().
+        """
+        if self.count == 0:
+            self.started = time.monotonic()
+        self.buffer += records
+        self.count += count
+        self.newest = newest
+        if self.count >= self.max_readings or self.due():
+            return self.flush()
+        return None
+
+    def due(self) -> bool:
+        """Return True if the oldest buffered reading has waited max_delay."""
+        return self.count > 0 and time.monotonic() - self.started >= self.max_delay
+
+    def flush(self):
+        """Return the buffered readings as a frame (bytes), or None if empty."""
+        if self.count == 0:
+            return None
+        frame = bytes(self.buffer)
+        self.buffer.clear()
+        self.count = 0
+        self.started = None
+        return frame
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,259 @@
+"""
+    Streaming statistics for the BBQ sensor streams, O(1) per reading.
+
+    Recomputing a mean or standard deviation over the window on every
+    message costs O(window). These keep running state instead:
+        RunningStats   Welford's algorithm: mean and variance of everything seen
+        Ewma           exponentially weighted mean and variance, decaying with
+                       event time (a reading `halflife` seconds old has half
+                       the weight of a new one), so gaps in the data are handled
+        WindowedStats  mean and variance over the last `span` seconds, Welford
+                       updates for readings entering and leaving the window
+    Each of them has zscore(x): how many standard deviations x is from the
+    mean so far, used by the "zscore" alert rule (see bbq_rules.py):
+        {"type": "zscore", "window": 600, "threshold": 4, ...}
+        {"type": "zscore", "halflife": 120, "threshold": 4, ...}
+    The reading is scored before it is added, so a spike does not hide itself.
+
+    Run this file to check the streaming results against a batch
+    recomputation over every stream in smoker-temps.csv:
+        python bbq_stats.py [csv_file]
+
+"""
+
+import math
+import sys
+from collections import deque
+
+# Define the variables
+# readings needed before a z-score is given
+min_count = 10
+# standard deviations below this count as 0 (a flat line), so z is not huge
+min_std = 1e-6
+
+
+class RunningStats:
+    """Mean and variance of every reading added (Welford's algorithm)."""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self.m2 = 0.0
+
+    def add(self, timestamp: int, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def variance(self) -> float:
+        """Sample variance (0 until there are two readings)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def std(self) -> float:
+        return math.sqrt(self.variance())
+
+    def zscore(self, x: float):
+        """Standard deviations from the mean, or None while there are too few readings."""
+        if self.count < min_count:
+            return None
+        std = self.std()
+        return 0.0 if std < min_std else (x - self.mean) / std
+
+
+class Ewma:
+    """
+    Exponentially weighted mean and variance over event time.
+
+    Parameters:
+        halflife (float): seconds after which a reading has half its weight
+    """
+
+    __slots__ = ("halflife", "count", "mean", "var", "last_time")
+
+    def __init__(self, halflife: float):
+        if halflife <= 0:
+            raise ValueError("halflife must be positive")
+        self.halflife = halflife
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_time = None
+
+    def add(self, timestamp: int, x: float):
+        self.count += 1
+        if self.last_time is None:
+            self.mean = x
+            self.last_time = timestamp
+            return
+        dt = timestamp - self.last_time
+        if dt > 0:
+            self.last_time = timestamp
+        # weight of the new reading, 1 - 0.5 ** (dt / halflife); a reading
+        # with the same timestamp counts like one a second later
+        alpha = 1.0 - 0.5 ** (max(dt, 1) / self.halflife)
+        delta = x - self.mean
+        increment = alpha * delta
+        self.mean += increment
+        self.var = (1.0 - alpha) * (self.var + delta * increment)
+
+    def variance(self) -> float:
+        return self.var
+
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+    def zscore(self, x: float):
+        if self.count < min_count:
+            return None
+        std = self.std()
+        return 0.0 if std < min_std else (x - self.mean) / std
+
+
+class WindowedStats:
+    """
+    Mean and variance of the readings from the last `span` seconds.
+
+    A reading stamped t is in the window while t > newest - span, like
+    EventTimeWindow. Readings are added and removed with Welford updates, so
+    both are O(1); the readings are kept to know what to remove.
+    """
+
+    __slots__ = ("span", "timestamps", "readings", "count", "mean", "m2")
+
+    def __init__(self, span: int):
+        if span < 1:
+            raise ValueError("span must be at least 1 second")
+        self.span = span
+        self.timestamps = deque()
+        self.readings = deque()
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, timestamp: int, x: float):
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            # out of order, keep the window sorted like EventTimeWindow does
+            return
+        self.timestamps.append(timestamp)
+        self.readings.append(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        cutoff = timestamp - self.span
+        timestamps, readings = self.timestamps, self.readings
+        while timestamps[0] <= cutoff:
+            timestamps.popleft()
+            self._remove(readings.popleft())
+
+    def _remove(self, x: float):
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.m2 -= delta * (x - self.mean)
+        if self.m2 < 0.0:
+            # rounding can leave a tiny negative sum for a flat window
+            self.m2 = 0.0
+
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def std(self) -> float:
+        return math.sqrt(self.variance())
+
+    def zscore(self, x: float):
+        if self.count < min_count:
+            return None
+        std = self.std()
+        return 0.0 if std < min_std else (x - self.mean) / std
+
+    def __len__(self):
+        return self.count
+
+
+def check_accuracy(path: str, span: int = 600, halflife: float = 120, ewma_limit: int = 2000) -> bool:
+    """
+    Compare the streaming statistics with a batch recomputation for every
+    stream in a smoker CSV file, print the largest errors and return True if
+    they are all within 1e-6.
+    """
+    import csv
+    import statistics
+
+    from bbq_readings import parse_time
+
+    streams = {"01-smoker": [], "02-food-A": [], "02-food-B": []}
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for row in reader:
+            timestamp = parse_time(row[0])
+            for queue, value in zip(streams, row[1:]):
+                try:
+                    streams[queue].append((timestamp, round(float(value), 2)))
+                except ValueError:
+                    pass
+
+    tolerance = 1e-6
+    ok = True
+    for queue, readings in streams.items():
+        running = RunningStats()
+        windowed = WindowedStats(span)
+        ewma = Ewma(halflife)
+        errors = {"running": 0.0, "windowed": 0.0, "ewma": 0.0}
+        weights = []
+        for index, (timestamp, x) in enumerate(readings):
+            running.add(timestamp, x)
+            windowed.add(timestamp, x)
+            ewma.add(timestamp, x)
+
+            seen = [r for t, r in readings[:index + 1]]
+            if len(seen) > 1:
+                errors["running"] = max(
+                    errors["running"],
+                    abs(running.mean - statistics.fmean(seen)),
+                    abs(running.variance() - statistics.variance(seen)),
+                )
+            in_window = [r for t, r in readings[:index + 1] if t > timestamp - span]
+            if len(in_window) > 1:
+                errors["windowed"] = max(
+                    errors["windowed"],
+                    abs(windowed.mean - statistics.fmean(in_window)),
+                    abs(windowed.variance() - statistics.variance(in_window)),
+                )
+
+            # EWMA from its definition: the weight of each reading is alpha at
+            # the time it arrived times (1 - alpha) of every later reading
+            if index < ewma_limit:
+                if index == 0:
+                    weights = [1.0]
+                else:
+                    dt = max(timestamp - readings[index - 1][0], 1)
+                    alpha = 1.0 - 0.5 ** (dt / halflife)
+                    weights = [w * (1.0 - alpha) for w in weights] + [alpha]
+                batch_mean = sum(w * r for w, r in zip(weights, seen))
+                errors["ewma"] = max(errors["ewma"], abs(ewma.mean - batch_mean))
+
+        passed = all(error <= tolerance for error in errors.values())
+        ok = ok and passed
+        print(
+            f"{queue:>10} {len(readings):>6} readings  max error: "
+            + ", ".join(f"{name} {error:.2e}" for name, error in errors.items())
+            + ("  ok" if passed else "  FAILED")
+        )
+    return ok
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    if not check_accuracy(sys.argv[1] if len(sys.argv) > 1 else "smoker-temps.csv"):
+        sys.exit(1)
@@ -0,0 +1,115 @@
+"""
+    The sensor streams the BBQ consumers watch and the alert rules for each one.
+
+    A StreamMonitor holds the compiled rules (see bbq_rules.py) for one stream
+    (one queue): the event-time windows they share and their evaluators. The
+    single-queue consumers (bbq_smoker_consumer.py, bbq_food_a_consumer.py,
+    food_b_consumer.py) and the all-in-one bbq_async_consumer.py share these
+    definitions, so every stream gets its own window state whichever process
+    hosts it.
+
+    We want know if (Conditions To monitor):
+        The smoker temperature decreases by more than 15 degrees F in 2.5 minutes (smoker alert!)
+        Any food temperature changes less than 1 degree F in 10 minutes (food stall!)
+    Both live in bbq_rules.json, along with any other rules you add.
+
+"""
+
+import sys
+
+from bbq_rules import compile_rules, rules_for
+
+# Define the variables
+# set to True when the producer sends change-only (deadband) streams: the windows
+# then hold the last value sent until the next one arrives (see EventTimeWindow)
+carry_forward = False
+
+
+class StreamMonitor:
+    """Compiled alert rules and their shared windows for one sensor stream."""
+
+    __slots__ = ("name", "rules", "latest")
+
+    def __init__(self, name: str, rules):
+        self.name = name
+        self.rules = rules
+        # newest event time added, used to find idle streams
+        self.latest = None
+
+    @property
+    def windows(self) -> dict:
+        """Window seconds -> EventTimeWindow used by this stream's rules."""
+        return self.rules.windows
+
+    def add(self, timestamp: int, temp: float):
+        """Add a reading, returns the messages of every rule that fires (may be empty)."""
+        if self.latest is None or timestamp > self.latest:
+            self.latest = timestamp
+        return self.rules.add(timestamp, temp)
+
+    def add_many(self, readings: list) -> list:
+        """Add a batch of (timestamp, temp) readings, returns (timestamp, message) for every rule that fires."""
+        for timestamp, temp in readings:
+            if self.latest is None or timestamp > self.latest:
+                self.latest = timestamp
+        return self.rules.add_many(readings)
+
+    def add_timed(self, timestamp: int, temp: float, mark):
+        """Like add(), timing the window update and rule check separately."""
+        if self.latest is None or timestamp > self.latest:
+            self.latest = timestamp
+        return self.rules.add_timed(timestamp, temp, mark)
+
+
+def make_monitor(queue: str, allowed_lateness: int = 0, config: dict = None) -> StreamMonitor:
+    """
+    Create the monitor for a queue from the rule config.
+    Queues without their own entry (e.g. a second smoker) use the first
+    matching pattern, like "*smoker*".
+    """
+    rules = compile_rules(rules_for(queue, config), queue, allowed_lateness, carry_forward)
+    return StreamMonitor(queue, rules)
+
+
+class KeyedMonitors:
+    """
+    A StreamMonitor per routing key (e.g. smoker-7.food-A), created on first use.
+
+    With keyed routing one consumer follows many smokers and probes, so the
+    table only holds what each key needs: interned key strings and slotted
+    monitors, windows and rule groups. Keys that go quiet can be dropped
+    with evict_idle().
+    """
+
+    __slots__ = ("monitors", "allowed_lateness", "config")
+
+    def __init__(self, allowed_lateness: int = 0, config: dict = None):
+        self.monitors = {}
+        self.allowed_lateness = allowed_lateness
+        self.config = config
+
+    def get(self, key: str) -> StreamMonitor:
+        """Return the monitor for a key, creating it from the rule config if needed."""
+        monitor = self.monitors.get(key)
+        if monitor is None:
+            key = sys.intern(key)
+            monitor = make_monitor(key, self.allowed_lateness, self.config)
+            self.monitors[key] = monitor
+        return monitor
+
+    def evict_idle(self, before: int) -> int:
+        """Drop the monitors whose newest reading is older than `before`, returns how many."""
+        idle = [key for key, monitor in self.monitors.items()
+                if monitor.latest is not None and monitor.latest < before]
+        for key in idle:
+            del self.monitors[key]
+        return len(idle)
+
+    def __len__(self):
+        return len(self.monitors)
+
+    def __contains__(self, key):
+        return key in self.monitors
+
+    def items(self):
+        return self.monitors.items()
@@ -0,0 +1,417 @@
+"""
+    Pluggable transport: RabbitMQ, or an in-process stand-in broker.
+
+    The producer and the blocking consumers open their connection with
+    connect(host) instead of pika.BlockingConnection. With transport =
+    'rabbitmq' (the default) that is exactly the old connection. With
+    transport = 'local' it is a LocalConnection to LocalBroker, a broker that
+    lives inside the Python process and implements the part of the
+    BlockingConnection / BlockingChannel API the scripts use:
+        queue_declare (passive too), queue_delete, queue_bind,
+        exchange_declare (direct, topic, fanout, x-consistent-hash),
+        basic_qos, basic_publish, basic_consume, basic_cancel, basic_ack,
+        start_consuming, stop_consuming, call_later, close
+    Messages, delivery tags, prefetch limits, redelivery of unacked messages
+    when a channel closes and the Basic.Deliver / BasicProperties objects the
+    callbacks get all behave like RabbitMQ's, so the same code runs on a
+    laptop or in CI without a server. Producer and consumers must run in the
+    same process (e.g. in threads, see bbq_pipeline_benchmark.py).
+
+    An x-consistent-hash exchange is a hash ring like the plugin's: every
+    binding puts hash_ring_points points per unit of weight on the ring and
+    a routing key goes to the queue owning the next point after the key's
+    hash. Adding or removing a shard only moves the keys of the ring arcs it
+    takes or gives back, about 1/n of them, as with RabbitMQ. The points are
+    placed with crc32 rather than the plugin's hash, so which shard gets a
+    given key differs from a real broker, but the stability does not.
+
+    The stand-in is not a full AMQP broker: nothing is persisted, there are
+    no transactions, confirms, nacks or dead-lettering, and the async
+    consumer and the confirmed publisher still need RabbitMQ.
+
+"""
+
+import heapq
+import itertools
+from bisect import bisect_right
+import threading
+import time
+import zlib
+from collections import deque
+
+import pika
+from pika.frame import Method
+from pika.spec import Basic, Queue
+
+# Define the variables
+# 'rabbitmq' connects to a RabbitMQ server, 'local' to the in-process LocalBroker
+transport = "rabbitmq"
+# longest a consuming channel sleeps before checking for a stop, in seconds
+idle_wait = 0.05
+# points on a consistent-hash ring per unit of binding weight
+hash_ring_points = 100
+
+
+def connect(host: str = "localhost"):
+    """Open a connection with the configured transport."""
+    if transport == "local":
+        return LocalConnection(local_broker)
+    if transport != "rabbitmq":
+        raise ValueError(f"unknown transport {transport!r}, use rabbitmq or local")
+    return pika.BlockingConnection(pika.ConnectionParameters(host=host))
+
+
+def topic_matches(pattern: list, words: list) -> bool:
+    """Match routing key words against topic binding words: * is one word, # zero or more."""
+    if not pattern:
+        return not words
+    first, rest = pattern[0], pattern[1:]
+    if first == "#":
+        return any(topic_matches(rest, words[index:]) for index in range(len(words) + 1))
+    if not words:
+        return False
+    return (first == "*" or first == words[0]) and topic_matches(rest, words[1:])
+
+
+class LocalQueue:
+    __slots__ = ("name", "messages", "consumers")
+
+    def __init__(self, name: str):
+        self.name = name
+        # (body, properties, exchange, routing_key, redelivered)
+        self.messages = deque()
+        # channels consuming this queue
+        self.consumers = 0
+
+
+class LocalBroker:
+    """
+    Queues and exchanges shared by every LocalConnection in the process.
+    One condition variable guards everything; publishing wakes the consumers.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = {}
+        # exchange name -> [type, [(binding key, queue name)]]
+        self.exchanges = {"": ["direct", []]}
+        # (exchange, routing key) -> queue names, cleared when the bindings change
+        self.routes = {}
+        # exchange name -> (sorted ring points, queue of each point), built from the routes' bindings
+        self.rings = {}
+        self.channels = []
+        self.published = 0
+
+    def route(self, exchange: str, routing_key: str):
+        """Names of the queues a message to this exchange and routing key goes to."""
+        queues = self.routes.get((exchange, routing_key))
+        if queues is None:
+            queues = self.routes[(exchange, routing_key)] = self._route(exchange, routing_key)
+        return queues
+
+    def _route(self, exchange: str, routing_key: str):
+        if exchange == "":
+            return [routing_key] if routing_key in self.queues else []
+        declared = self.exchanges.get(exchange)
+        if declared is None:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+        exchange_type, bindings = declared
+        if exchange_type == "fanout":
+            return [queue for _, queue in bindings]
+        if exchange_type == "topic":
+            words = routing_key.split(".")
+            return list(dict.fromkeys(queue for key, queue in bindings if topic_matches(key.split("."), words)))
+        if exchange_type == "x-consistent-hash":
+            points, owners = self._ring(exchange, bindings)
+            if not points:
+                return []
+            # the first point clockwise from the key's hash, wrapping around
+            index = bisect_right(points, zlib.crc32(routing_key.encode())) % len(points)
+            return [owners[index]]
+        return [queue for key, queue in bindings if key == routing_key]
+
+    def _ring(self, exchange: str, bindings: list) -> tuple:
+        """The hash ring of a consistent-hash exchange: the binding key is the queue's weight."""
+        ring = self.rings.get(exchange)
+        if ring is None or ring[0] != bindings:
+            placed = sorted((zlib.crc32(f"{queue}#{index}".encode()), queue)
+                            for key, queue in bindings
+                            for index in range(int(key) * hash_ring_points))
+            ring = self.rings[exchange] = (list(bindings), [point for point, _ in placed],
+                                           [queue for _, queue in placed])
+        return ring[1], ring[2]
+
+    def publish(self, exchange: str, routing_key: str, body: bytes, properties):
+        with self.condition:
+            for name in self.route(exchange, routing_key):
+                self.queues[name].messages.append((body, properties, exchange, routing_key, False))
+            self.published += 1
+            self.condition.notify_all()
+
+    def idle(self, queue: str = None) -> bool:
+        """True when the queue (or every queue) is empty and nothing is waiting for an ack."""
+        with self.condition:
+            queues = [self.queues[queue]] if queue in self.queues else (
+                [] if queue is not None else list(self.queues.values()))
+            if any(q.messages for q in queues):
+                return False
+            for channel in self.channels:
+                for _, name, _ in channel.unacked.values():
+                    if queue is None or name == queue:
+                        return False
+            return True
+
+    def stop_consumers(self):
+        """Make every start_consuming() loop return, as if each one had called stop_consuming()."""
+        with self.condition:
+            for channel in self.channels:
+                channel.consuming = False
+            self.condition.notify_all()
+
+
+# every connect() with transport = 'local' uses this broker
+local_broker = LocalBroker()
+
+
+class LocalConnection:
+    """A BlockingConnection look-alike connected to a LocalBroker."""
+
+    def __init__(self, broker: LocalBroker = None):
+        self.broker = broker or local_broker
+        self.is_open = True
+        self.timers = []
+        self.timer_ids = itertools.count()
+        self.channels = []
+        self.lock = threading.Lock()
+        self.callbacks = deque()
+
+    def channel(self):
+        channel = LocalChannel(self, len(self.channels) + 1)
+        self.channels.append(channel)
+        with self.broker.condition:
+            self.broker.channels.append(channel)
+        return channel
+
+    def call_later(self, delay: float, callback):
+        """Run callback() after `delay` seconds, from this connection's consuming loop."""
+        with self.lock:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_ids), callback))
+
+    def add_callback_threadsafe(self, callback):
+        """Run callback() from this connection's consuming loop, callable from any thread."""
+        self.callbacks.append(callback)
+        with self.broker.condition:
+            self.broker.condition.notify_all()
+
+    def run_timers(self):
+        """Run the callbacks that are due, returns seconds until the next timer (or None)."""
+        while self.callbacks:
+            self.callbacks.popleft()()
+        while True:
+            with self.lock:
+                if not self.timers:
+                    return None
+                due, _, callback = self.timers[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    return wait
+                heapq.heappop(self.timers)
+            callback()
+
+    def process_data_events(self, time_limit: float = 0):
+        self.run_timers()
+        for channel in self.channels:
+            channel.dispatch()
+
+    def close(self):
+        if not self.is_open:
+            return
+        for channel in list(self.channels):
+            channel.close()
+        self.is_open = False
+
+
+class LocalChannel:
+    """A BlockingChannel look-alike on a LocalConnection."""
+
+    def __init__(self, connection: LocalConnection, number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = number
+        self.is_open = True
+        self.prefetch_count = 0
+        self.next_tag = 1
+        # delivery tag -> (message, queue name, consumer tag), oldest first
+        self.unacked = {}
+        # consumer tag -> (queue name, callback)
+        self.consumers = {}
+        self.consumer_ids = itertools.count(1)
+        self.consuming = False
+
+    # declaring
+
+    def queue_declare(self, queue: str, passive: bool = False, durable: bool = False,
+                      exclusive: bool = False, auto_delete: bool = False, arguments=None):
+        with self.broker.condition:
+            declared = self.broker.queues.get(queue)
+            if declared is None:
+                if passive:
+                    self.is_open = False
+                    raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+                declared = self.broker.queues[queue] = LocalQueue(queue)
+                self.broker.routes.clear()
+            return Method(self.channel_number, Queue.DeclareOk(queue, len(declared.messages), declared.consumers))
+
+    def queue_delete(self, queue: str, if_unused: bool = False, if_empty: bool = False):
+        with self.broker.condition:
+            declared = self.broker.queues.pop(queue, None)
+            self.broker.routes.clear()
+            for exchange in self.broker.exchanges.values():
+                exchange[1] = [binding for binding in exchange[1] if binding[1] != queue]
+            for channel in self.broker.channels:
+                for tag, (name, _) in list(channel.consumers.items()):
+                    if name == queue:
+                        del channel.consumers[tag]
+            count = len(declared.messages) if declared is not None else 0
+            return Method(self.channel_number, Queue.DeleteOk(count))
+
+    def exchange_declare(self, exchange: str, exchange_type: str = "direct", passive: bool = False,
+                         durable: bool = False, auto_delete: bool = False, internal: bool = False, arguments=None):
+        with self.broker.condition:
+            declared = self.broker.exchanges.get(exchange)
+            if declared is None:
+                if passive:
+                    self.is_open = False
+                    raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+                self.broker.exchanges[exchange] = [str(exchange_type), []]
+            elif declared[0] != str(exchange_type) and not passive:
+                self.is_open = False
+                raise pika.exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - exchange '{exchange}' is a {declared[0]}")
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, arguments=None):
+        routing_key = queue if routing_key is None else routing_key
+        with self.broker.condition:
+            if queue not in self.broker.queues or exchange not in self.broker.exchanges:
+                self.is_open = False
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}' or exchange '{exchange}'")
+            bindings = self.broker.exchanges[exchange][1]
+            if (routing_key, queue) not in bindings:
+                bindings.append((routing_key, queue))
+                self.broker.routes.clear()
+
+    def basic_qos(self, prefetch_size: int = 0, prefetch_count: int = 0, global_qos: bool = False):
+        self.prefetch_count = prefetch_count
+
+    # publishing
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, mandatory: bool = False):
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker.publish(exchange, routing_key, bytes(body), properties or pika.BasicProperties())
+
+    # consuming
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False,
+                      exclusive: bool = False, consumer_tag: str = None, arguments=None):
+        with self.broker.condition:
+            declared = self.broker.queues.get(queue)
+            if declared is None:
+                self.is_open = False
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+            declared.consumers += 1
+        tag = consumer_tag or f"ctag{self.channel_number}.{next(self.consumer_ids)}"
+        self.consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def basic_cancel(self, consumer_tag: str = ""):
+        removed = self.consumers.pop(consumer_tag, None)
+        if removed is not None:
+            with self.broker.condition:
+                declared = self.broker.queues.get(removed[0])
+                if declared is not None:
+                    declared.consumers -= 1
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        with self.broker.condition:
+            if multiple:
+                for tag in [tag for tag in self.unacked if tag <= delivery_tag]:
+                    del self.unacked[tag]
+            elif self.unacked.pop(delivery_tag, None) is None:
+                self.is_open = False
+                raise pika.exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+            self.broker.condition.notify_all()
+
+    def _next_delivery(self):
+        """Take the next message this channel may receive, or None (call with the lock held)."""
+        if self.prefetch_count and len(self.unacked) >= self.prefetch_count:
+            return None
+        for consumer_tag, (queue, callback) in self.consumers.items():
+            declared = self.broker.queues.get(queue)
+            if declared is not None and declared.messages:
+                message = declared.messages.popleft()
+                tag = self.next_tag
+                self.next_tag += 1
+                self.unacked[tag] = (message, queue, consumer_tag)
+                # the next delivery looks at this channel's other consumers first
+                self.consumers[consumer_tag] = self.consumers.pop(consumer_tag)
+                return consumer_tag, tag, message, callback
+        return None
+
+    def dispatch(self) -> bool:
+        """Deliver one message to its callback, returns False if there was none."""
+        with self.broker.condition:
+            delivery = self._next_delivery()
+        if delivery is None:
+            return False
+        consumer_tag, tag, (body, properties, exchange, routing_key, redelivered), callback = delivery
+        method = Basic.Deliver(consumer_tag, tag, redelivered, exchange, routing_key)
+        callback(self, method, properties, body)
+        return True
+
+    def start_consuming(self):
+        """Deliver messages to the consumers until stop_consuming() or the connection closes."""
+        self.consuming = True
+        connection = self.connection
+        condition = self.broker.condition
+        while self.consuming and self.is_open and connection.is_open:
+            wait = connection.run_timers()
+            if not self.consuming:
+                break
+            if self.dispatch():
+                continue
+            with condition:
+                if self.consuming and not connection.callbacks and not self._peek():
+                    condition.wait(idle_wait if wait is None else min(wait, idle_wait))
+        self.consuming = False
+
+    def _peek(self) -> bool:
+        """True if a message is ready for this channel (call with the lock held)."""
+        if self.prefetch_count and len(self.unacked) >= self.prefetch_count:
+            return False
+        return any(self.broker.queues.get(queue) is not None and self.broker.queues[queue].messages
+                   for queue, _ in self.consumers.values())
+
+    def stop_consuming(self, consumer_tag: str = None):
+        self.consuming = False
+
+    def close(self):
+        """Close the channel, unacked messages go back to the front of their queues as redelivered."""
+        if not self.is_open:
+            return
+        with self.broker.condition:
+            for tag in reversed(list(self.unacked)):
+                (body, properties, exchange, routing_key, _), queue, _ = self.unacked[tag]
+                declared = self.broker.queues.get(queue)
+                if declared is not None:
+                    declared.messages.appendleft((body, properties, exchange, routing_key, True))
+            self.unacked.clear()
+            for queue, _ in self.consumers.values():
+                declared = self.broker.queues.get(queue)
+                if declared is not None:
+                    declared.consumers -= 1
+            self.consumers.clear()
+            if self in self.broker.channels:
+                self.broker.channels.remove(self)
+            self.is_open = False
+            self.consuming = False
+            self.broker.condition.notify_all()
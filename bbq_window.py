@@ -0,0 +1,348 @@
+"""
+    Sliding windows used by the BBQ consumers to check their alert conditions.
+
+    The consumers used to keep the most recent readings in a deque and call
+    max(deque) - min(deque) on every message. That walks the whole window for
+    every reading, so the cost grows with the window size.
+
+    SlidingWindow keeps two extra "monotonic" deques next to the readings:
+        max_deque holds readings in decreasing order, so the front is the max
+        min_deque holds readings in increasing order, so the front is the min
+    Each reading is added and removed from those deques at most once, so
+    append(), max() and min() are amortized O(1) no matter how wide the window is.
+
+    EventTimeWindow does the same over a span of seconds instead of a count of
+    readings, using the `Time` stamp carried in every message.
+
+    Run this file for a quick self-check of EventTimeWindow:
+        python bbq_window.py
+
+"""
+
+import heapq
+from collections import deque
+
+
+class SlidingWindow:
+    """Keep the most recent `size` readings with O(1) running max and min."""
+
+    __slots__ = ("size", "readings", "max_deque", "min_deque", "count")
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        # the readings currently in the window, oldest on the left
+        self.readings = deque()
+        # (position, reading) pairs, the front of each deque is the answer
+        self.max_deque = deque()
+        self.min_deque = deque()
+        # total number of readings ever appended, used as the position counter
+        self.count = 0
+
+    def append(self, reading: float):
+        """Add a reading and drop the oldest one once the window is full."""
+        position = self.count
+        self.count += 1
+
+        self.readings.append(reading)
+
+        # readings smaller than the new one can never be the max again
+        max_deque = self.max_deque
+        while max_deque and max_deque[-1][1] <= reading:
+            max_deque.pop()
+        max_deque.append((position, reading))
+
+        # readings larger than the new one can never be the min again
+        min_deque = self.min_deque
+        while min_deque and min_deque[-1][1] >= reading:
+            min_deque.pop()
+        min_deque.append((position, reading))
+
+        # once the window is full, drop the oldest reading from every deque
+        if len(self.readings) > self.size:
+            self.readings.popleft()
+            oldest = self.count - self.size
+            if max_deque[0][0] < oldest:
+                max_deque.popleft()
+            if min_deque[0][0] < oldest:
+                min_deque.popleft()
+
+    def max(self) -> float:
+        """Return the largest reading in the window."""
+        return self.max_deque[0][1]
+
+    def min(self) -> float:
+        """Return the smallest reading in the window."""
+        return self.min_deque[0][1]
+
+    def spread(self) -> float:
+        """Return max - min for the readings in the window."""
+        return self.max_deque[0][1] - self.min_deque[0][1]
+
+    def is_full(self) -> bool:
+        """Return True once the window holds `size` readings."""
+        return len(self.readings) == self.size
+
+    def clear(self):
+        """Forget every reading in the window."""
+        self.readings.clear()
+        self.max_deque.clear()
+        self.min_deque.clear()
+
+    def __len__(self):
+        return len(self.readings)
+
+    def __bool__(self):
+        return bool(self.readings)
+
+    def __iter__(self):
+        return iter(self.readings)
+
+
+class EventTimeWindow:
+    """
+    Keep the readings from the last `span` seconds of event time.
+
+    Event time is the `Time` stamp the producer puts in every message, stored
+    as whole epoch seconds (see bbq_readings.parse_time). The window holds the
+    readings with a timestamp in (newest - span, newest], so gaps in the sensor
+    data no longer stretch or shrink the minutes a rule looks at.
+
+    Readings may arrive out of order by up to `allowed_lateness` seconds.
+    They wait in a small heap until the watermark (newest timestamp seen minus
+    allowed_lateness) passes them and are then released into the window in
+    timestamp order. Anything older than the watermark is too late and dropped.
+
+    Timestamps and readings are kept in parallel deques of ints and floats
+    rather than tuples or datetime objects, which keeps a window cheap even
+    at high reading rates. Every reading enters and leaves each deque once,
+    so eviction and the running max/min stay amortized O(1).
+
+    With carry_forward=True the window treats the stream as sample-and-hold,
+    for producers that only send a reading when it changes (deadband): the
+    newest reading that falls out of the window is kept at the window's
+    start, because that is still the value in effect there.
+
+    is_full() is only True once the stream has been watched across the whole
+    span: a reading has fallen out of the window (or is carried forward at
+    its start) and no gap between readings is a span or longer. After a long
+    gap in the data the window first has to fill up again.
+    """
+
+    __slots__ = (
+        "span", "allowed_lateness", "timestamps", "readings",
+        "max_times", "max_readings", "min_times", "min_readings",
+        "pending", "latest", "evicted_time", "dropped", "carry_forward",
+    )
+
+    def __init__(self, span: int, allowed_lateness: int = 0, carry_forward: bool = False):
+        if span < 1:
+            raise ValueError("span must be at least 1 second")
+        if allowed_lateness < 0:
+            raise ValueError("allowed_lateness cannot be negative")
+        self.span = span
+        self.allowed_lateness = allowed_lateness
+        # the readings currently in the window, oldest on the left
+        self.timestamps = deque()
+        self.readings = deque()
+        # monotonic deques, the front of each one is the current max / min
+        self.max_times = deque()
+        self.max_readings = deque()
+        self.min_times = deque()
+        self.min_readings = deque()
+        # heap of (timestamp, reading) waiting for the watermark to pass them
+        self.pending = []
+        # newest timestamp seen so far, and the newest one that fell out of the window
+        self.latest = None
+        self.evicted_time = None
+        # number of readings dropped for arriving too late
+        self.dropped = 0
+        # hold the last evicted reading at the start of the window
+        self.carry_forward = carry_forward
+
+    def watermark(self):
+        """Return the timestamp up to which the window is complete."""
+        if self.latest is None:
+            return None
+        return self.latest - self.allowed_lateness
+
+    def add(self, timestamp: int, reading: float) -> bool:
+        """
+        Add a reading stamped with its event time.
+        Returns False if the reading arrived too late and was dropped.
+        """
+        if self.latest is not None:
+            if timestamp < self.latest - self.allowed_lateness:
+                self.dropped += 1
+                return False
+            if timestamp > self.latest:
+                self.latest = timestamp
+        else:
+            self.latest = timestamp
+
+        if self.allowed_lateness == 0:
+            self._release(timestamp, reading)
+            return True
+
+        # hold the reading until the watermark passes it
+        heapq.heappush(self.pending, (timestamp, reading))
+        watermark = self.latest - self.allowed_lateness
+        pending = self.pending
+        while pending and pending[0][0] <= watermark:
+            self._release(*heapq.heappop(pending))
+        return True
+
+    def flush(self):
+        """Release every pending reading, e.g. when the stream ends."""
+        pending = self.pending
+        while pending:
+            self._release(*heapq.heappop(pending))
+
+    def _release(self, timestamp: int, reading: float):
+        """Move a reading into the window and evict what fell out of it."""
+        self.timestamps.append(timestamp)
+        self.readings.append(reading)
+
+        # readings smaller than the new one can never be the max again
+        max_times, max_readings = self.max_times, self.max_readings
+        while max_readings and max_readings[-1] <= reading:
+            max_readings.pop()
+            max_times.pop()
+        max_times.append(timestamp)
+        max_readings.append(reading)
+
+        # readings larger than the new one can never be the min again
+        min_times, min_readings = self.min_times, self.min_readings
+        while min_readings and min_readings[-1] >= reading:
+            min_readings.pop()
+            min_times.pop()
+        min_times.append(timestamp)
+        min_readings.append(reading)
+
+        self._evict(timestamp - self.span)
+
+    def _evict(self, cutoff: int):
+        """Drop every reading stamped at or before `cutoff`."""
+        timestamps, readings = self.timestamps, self.readings
+        carried = None
+        while timestamps and timestamps[0] <= cutoff:
+            self.evicted_time = timestamps.popleft()
+            carried = readings.popleft()
+        while self.max_times and self.max_times[0] <= cutoff:
+            self.max_times.popleft()
+            self.max_readings.popleft()
+        while self.min_times and self.min_times[0] <= cutoff:
+            self.min_times.popleft()
+            self.min_readings.popleft()
+        if carried is not None and self.carry_forward and timestamps and timestamps[0] > cutoff + 1:
+            self._carry(cutoff + 1, carried)
+
+    def _carry(self, timestamp: int, reading: float):
+        """Put the value still in effect at the window start back in as its oldest reading."""
+        # the held value covers the window start, however long ago it was read
+        self.evicted_time = timestamp - 1
+        self.timestamps.appendleft(timestamp)
+        self.readings.appendleft(reading)
+        # it is older than everything left, so it only belongs in the
+        # monotonic deques if it beats their current front
+        if reading > self.max_readings[0]:
+            self.max_times.appendleft(timestamp)
+            self.max_readings.appendleft(reading)
+        if reading < self.min_readings[0]:
+            self.min_times.appendleft(timestamp)
+            self.min_readings.appendleft(reading)
+
+    def newest(self) -> int:
+        """Return the timestamp of the newest reading in the window."""
+        return self.timestamps[-1]
+
+    def first(self) -> float:
+        """Return the oldest reading in the window."""
+        return self.readings[0]
+
+    def last(self) -> float:
+        """Return the newest reading in the window."""
+        return self.readings[-1]
+
+    def duration(self) -> int:
+        """Return the seconds between the oldest and newest reading in the window."""
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def max(self) -> float:
+        """Return the largest reading in the window."""
+        return self.max_readings[0]
+
+    def min(self) -> float:
+        """Return the smallest reading in the window."""
+        return self.min_readings[0]
+
+    def spread(self) -> float:
+        """Return max - min for the readings in the window."""
+        return self.max_readings[0] - self.min_readings[0]
+
+    def is_full(self) -> bool:
+        """
+        Return True once the stream has been watched for the whole span,
+        so a rule like "changed less than 1 degree in 10 minutes" is not
+        raised from the first couple of readings, or from a couple of
+        readings after a gap longer than the span.
+        """
+        timestamps = self.timestamps
+        evicted = self.evicted_time
+        # readings inside the window are less than a span apart, only the
+        # step from the last reading before the window can be a gap
+        return len(timestamps) > 1 and evicted is not None and timestamps[0] - evicted < self.span
+
+    def clear(self):
+        """Forget every reading in the window."""
+        for d in (self.timestamps, self.readings, self.max_times,
+                  self.max_readings, self.min_times, self.min_readings):
+            d.clear()
+        self.pending.clear()
+        self.latest = None
+        self.evicted_time = None
+
+    def __len__(self):
+        return len(self.readings)
+
+    def __bool__(self):
+        return bool(self.readings)
+
+    def __iter__(self):
+        return iter(self.readings)
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    # a reading every 30 seconds: full once the stream was watched for the span
+    window = EventTimeWindow(600)
+    for timestamp in range(0, 600, 30):
+        window.add(timestamp, 225.0)
+    assert not window.is_full()
+    window.add(600, 225.0)
+    assert window.is_full() and window.spread() == 0
+
+    # a gap longer than the span: two readings seconds apart are not a stall
+    window.add(2000, 225.0)
+    window.add(2010, 225.2)
+    assert len(window) == 2 and not window.is_full()
+    for timestamp in range(2040, 2640, 30):
+        window.add(timestamp, 225.0)
+    assert window.is_full() and window.spread() == 0
+
+    # with carry_forward the held value covers the gap (a deadband producer)
+    held = EventTimeWindow(600, carry_forward=True)
+    held.add(0, 225.0)
+    held.add(1000, 225.0)
+    assert held.is_full() and list(held.timestamps) == [401, 1000]
+
+    # out of order readings wait for the watermark, too late ones are dropped
+    late = EventTimeWindow(150, allowed_lateness=30)
+    for timestamp, reading in ((0, 1.0), (40, 4.0), (20, 2.0), (60, 6.0), (10, 0.5)):
+        late.add(timestamp, reading)
+    assert list(late.timestamps) == [0, 20] and late.dropped == 1
+    late.flush()
+    assert list(late.timestamps) == [0, 20, 40, 60] and late.max() == 6.0 and late.min() == 1.0
+
+    print("EventTimeWindow self-check passed")
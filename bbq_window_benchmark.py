@@ -0,0 +1,79 @@
+"""
+    Micro-benchmark for the consumer alert check.
+
+    Compares the old approach (deque(maxlen=size) and max(deque) - min(deque)
+    on every reading) against SlidingWindow.spread() for window sizes from
+    5 to 100,000 readings. Both approaches see the same random-walk readings.
+
+    Usage:
+        python bbq_window_benchmark.py [readings_per_size]
+
+"""
+
+import random
+import sys
+import time
+from collections import deque
+
+from bbq_window import SlidingWindow
+
+# Define the variables
+window_sizes = [5, 20, 100, 1_000, 10_000, 100_000]
+default_readings = 200_000
+
+
+def make_readings(count: int, seed: int = 42) -> list:
+    """Create a random walk of smoker-like temperatures."""
+    rng = random.Random(seed)
+    temp = 225.0
+    readings = []
+    for _ in range(count):
+        temp += rng.uniform(-2.0, 2.0)
+        readings.append(round(temp, 2))
+    return readings
+
+
+def run_deque(size: int, warmup: list, readings: list) -> float:
+    """Time the original deque + max() - min() check."""
+    window = deque(warmup, maxlen=size)
+    start = time.perf_counter()
+    for reading in readings:
+        window.append(reading)
+        max(window) - min(window)
+    return time.perf_counter() - start
+
+
+def run_sliding_window(size: int, warmup: list, readings: list) -> float:
+    """Time the SlidingWindow running max/min check."""
+    window = SlidingWindow(size)
+    for reading in warmup:
+        window.append(reading)
+    start = time.perf_counter()
+    for reading in readings:
+        window.append(reading)
+        window.spread()
+    return time.perf_counter() - start
+
+
+def main(readings_per_size: int = default_readings):
+    """Run both approaches for every window size and print a table."""
+    print(f"{'window':>8} {'readings':>9} {'deque us/op':>12} {'window us/op':>13} {'speedup':>8}")
+    for size in window_sizes:
+        # the deque approach is O(size) per reading, so keep its run bounded
+        count = min(readings_per_size, max(2_000, 20_000_000 // size))
+        # fill the window first so only full-window checks are timed
+        readings = make_readings(size + count)
+        warmup, readings = readings[:size], readings[size:]
+        deque_seconds = run_deque(size, warmup, readings)
+        window_seconds = run_sliding_window(size, warmup, readings)
+        deque_us = deque_seconds / len(readings) * 1e6
+        window_us = window_seconds / len(readings) * 1e6
+        print(f"{size:>8} {len(readings):>9} {deque_us:>12.3f} {window_us:>13.3f} {deque_us / window_us:>7.1f}x")
+
+
+# Standard Python idiom to indicate main program entry point
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()